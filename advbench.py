@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""Time the Adventure Prompt tools on synthetic worlds of various sizes.
+
+Results go to standard output (or the file given with -o) as JSON, so runs
+from different commits can be compared; progress goes to standard error.
+"""
+
+from __future__ import print_function
+
+import sys
+import os
+import io
+import json
+import asyncio
+import time
+import random
+import platform
+import tempfile
+import tracemalloc
+import contextlib
+import configparser
+
+import advc
+import advbin
+import disadvent
+import advprompt
+
+words = ["stone", "old", "dusty", "bright", "narrow", "door", "wall", "the",
+	"a", "of", "and", "window", "light", "cold", "wooden", "floor", "some",
+	"smell", "distant", "quiet", "corridor", "moss", "under", "above"]
+
+def make_text(rng, size):
+	text = []
+	length = 0
+	while length < size:
+		word = rng.choice(words)
+		text.append(word)
+		length += len(word) + 1
+	return " ".join(text).capitalize() + "."
+
+def make_world(objects, exits=2, items=3, locks=0.1, text_size=100, seed=1):
+	"""Make config sections for a grid of rooms, as parse_source would.
+
+	Each room gets the given number of exits and items, so the room count
+	comes from the total number of objects. Exits are chained so every room
+	can be reached, and a fraction of them are locked to an item.
+	"""
+	rng = random.Random(seed)
+	rooms = max(1, objects // (1 + exits + items))
+	sections = {
+		"META": {"title": "Synthetic world", "author": "advbench.py"},
+		"CONFIG": {"max_score": str(rooms), "use_score": "true"},
+		"hero": {"type": "actor", "name": "You", "location": "r0",
+			"description": make_text(rng, text_size)}
+	}
+	for i in range(rooms):
+		room_id = "r{0}".format(i)
+		sections[room_id] = {
+			"type": "room",
+			"name": "Room {0}".format(i),
+			"description": make_text(rng, text_size),
+			"score": "1"
+		}
+		if rng.random() < 0.2:
+			sections[room_id]["dark"] = "true"
+		for j in range(exits):
+			exit_id = "{0}-{1}".format(room_id, j)
+			sections[exit_id] = {
+				"type": "exit",
+				"name": "Exit {0}".format(j),
+				"location": room_id,
+				"link": "r{0}".format((i + 1 + j * rng.randrange(rooms))
+					% rooms)
+			}
+			if items > 0 and rng.random() < locks:
+				key = rng.randrange(rooms)
+				sections[exit_id]["lock"] = "+i{0}-0".format(key)
+		for j in range(items):
+			item_id = "i{0}-{1}".format(i, j)
+			sections[item_id] = {
+				"type": "thing",
+				"name": "{0} {1}".format(rng.choice(words), j),
+				"location": room_id,
+				"description": make_text(rng, text_size)
+			}
+			if rng.random() < 0.05:
+				sections[item_id]["light"] = "true"
+	return sections
+
+def world_text(sections):
+	"""The same world as a config file, to time the parsers on."""
+	f = io.StringIO()
+	interpolation = configparser.BasicInterpolation()
+	for i in sections:
+		advc.write_section(i, list(sections[i].items()), f, interpolation)
+	return f.getvalue()
+
+def merge_world(sections):
+	game = advc.new_game()
+	advc.merge_data(sections, game)
+	del game["objects"]["limbo"] # Unused, and sanity_check would drop it.
+	return game
+
+def best_time(func, repeat):
+	times = []
+	for i in range(repeat):
+		start = time.perf_counter()
+		func()
+		times.append(time.perf_counter() - start)
+	return times
+
+def bench_configparser(world):
+	return lambda: advc.parse_configparser(world["text"])
+
+def bench_parse_ini(world):
+	return lambda: advc.parse_ini(world["text"])
+
+def bench_merge(world):
+	return lambda: merge_world(world["sections"])
+
+def bench_sanity(world):
+	def run():
+		with contextlib.redirect_stderr(io.StringIO()):
+			advc.sanity_check(world["game"])
+	return run
+
+def bench_bundle(world):
+	path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+		"promptrun.html")
+	with open(path) as f:
+		template = advc.split_template(f.read())
+	return lambda: advc.write_bundle(world["game"], template, io.StringIO())
+
+def bench_game2config(world):
+	return lambda: disadvent.game2config(world["game"]).write(io.StringIO())
+
+def bench_save(world):
+	path = os.path.join(world["tmp"], "save.json")
+	return lambda: world["editor"].save_game(path)
+
+def bench_restore(world):
+	return lambda: world["editor"].restore_game(world["story"])
+
+def bench_look(world):
+	editor = world["editor"]
+	rooms = sorted(editor.index["type"]["room"])[:100]
+	def run():
+		with contextlib.redirect_stdout(io.StringIO()):
+			for i in rooms:
+				editor.onecmd("tel " + i)
+				editor.onecmd("look")
+	return run
+
+def bench_find(world):
+	editor = world["editor"]
+	def run():
+		with contextlib.redirect_stdout(io.StringIO()):
+			editor.onecmd("find light")
+			editor.onecmd("find type exit")
+			editor.onecmd("find name Room 1") # Not indexed up front.
+	return run
+
+def bench_search(world):
+	editor = world["editor"]
+	editor.text_index() # Built on first use; time the queries alone.
+	def run():
+		with contextlib.redirect_stdout(io.StringIO()):
+			editor.onecmd("search narrow")
+			editor.onecmd('search "stone wall"')
+			editor.onecmd("search corr* moss")
+	return run
+
+def bench_complete(world):
+	editor = world["editor"]
+	lines = ["look r1", "tel r", "set i1-0 lo", "set i1-0 location r2",
+		"lock r0-0 +i", "link r0-0 r3"]
+	def run():
+		for i in lines:
+			text = i.split(" ")[-1]
+			begidx = len(i) - len(text)
+			editor.completedefault(text, i, begidx, len(i))
+	return run
+
+def measure_memory(func):
+	"""Bytes held by what func returns, and the peak while making it."""
+	tracemalloc.start()
+	try:
+		found = func()
+		current, peak = tracemalloc.get_traced_memory()
+	finally:
+		tracemalloc.stop()
+	del found
+	return current, peak
+
+def bench_memory_dicts(world):
+	with open(world["story"], "rb") as f:
+		data = f.read()
+	return lambda: advbin.load_any(data)
+
+def bench_memory_records(world):
+	with open(world["story"], "rb") as f:
+		data = f.read()
+	return lambda: advprompt.load_story(data)
+
+async def build_session(address, name, lines, latencies):
+	"""One simulated author, timing how long each command takes."""
+	reader, writer = await asyncio.open_connection(*address, limit=2**24)
+	writer.write((name + "\r\noutputsuffix --done--\r\n").encode("utf-8"))
+	await reader.readuntil(b"--done--\r\n")
+	for i in lines:
+		start = time.perf_counter()
+		writer.write(i.encode("utf-8") + b"\r\n")
+		await reader.readuntil(b"--done--\r\n")
+		latencies.append(time.perf_counter() - start)
+	writer.write(b"quit\r\n")
+	writer.close()
+
+async def load_test(server, clients, commands, run, latencies):
+	listener = await asyncio.start_server(server.session, "127.0.0.1", 0)
+	address = listener.sockets[0].getsockname()[:2]
+	sessions = []
+	for i in range(clients):
+		name = "a{0}-{1}".format(run, i)
+		lines = []
+		for j in range(commands // 5):
+			room = "{0}-{1}".format(name, j)
+			lines.extend([
+				"dig 'Room {0}' {0}".format(room),
+				"tel " + room,
+				"open out {0}-out r0".format(room),
+				"set {0} description 'Built by {1}.'".format(room, name),
+				"look"
+			])
+		sessions.append(build_session(address, name, lines, latencies))
+	await asyncio.gather(*sessions)
+	listener.close()
+	await listener.wait_closed()
+
+def bench_build_server(world):
+	editor = advprompt.SharedEditor()
+	editor.quiet = True
+	editor.restore_game(world["story"])
+	server = advprompt.BuildServer(editor)
+	runs = []
+	def run():
+		latencies = []
+		runs.append(latencies)
+		asyncio.run(load_test(server, world["clients"], world["commands"],
+			len(runs), latencies))
+		latencies.sort()
+		run.stats = {
+			"commands": len(latencies),
+			"p50": advprompt.percentile(latencies, 50),
+			"p99": advprompt.percentile(latencies, 99)
+		}
+	return run
+
+benchmarks = [
+	("configparser", bench_configparser),
+	("parse_ini", bench_parse_ini),
+	("merge_data", bench_merge),
+	("sanity_check", bench_sanity),
+	("bundle", bench_bundle),
+	("game2config", bench_game2config),
+	("editor_restore", bench_restore),
+	("editor_save", bench_save),
+	("editor_look", bench_look),
+	("editor_find", bench_find),
+	("editor_search", bench_search),
+	("editor_complete", bench_complete),
+	("memory_dicts", bench_memory_dicts),
+	("memory_records", bench_memory_records),
+	("build_server", bench_build_server)
+]
+
+# These report bytes instead of times, using tracemalloc.
+memory_benchmarks = ["memory_dicts", "memory_records"]
+
+def run_benchmarks(sizes, names, repeat, options, clients=32, commands=50):
+	results = []
+	for size in sizes:
+		print("Generating {0} objects...".format(size), file=sys.stderr)
+		sections = make_world(size, **options)
+		with tempfile.TemporaryDirectory() as tmp:
+			world = {
+				"sections": sections,
+				"text": world_text(sections),
+				"game": merge_world(sections),
+				"editor": advprompt.Editor(),
+				"story": os.path.join(tmp, "story.json"),
+				"tmp": tmp,
+				"clients": clients,
+				"commands": commands
+			}
+			with open(world["story"], "w") as f:
+				json.dump(world["game"], f)
+			world["editor"].quiet = True
+			world["editor"].restore_game(world["story"])
+			for name, setup in benchmarks:
+				if name not in names:
+					continue
+				print("  " + name, file=sys.stderr)
+				if name in memory_benchmarks:
+					current, peak = measure_memory(setup(world))
+					results.append({
+						"benchmark": name,
+						"objects": len(world["game"]["objects"]),
+						"bytes": current,
+						"peak": peak
+					})
+					continue
+				func = setup(world)
+				times = best_time(func, repeat)
+				results.append({
+					"benchmark": name,
+					"objects": len(world["game"]["objects"]),
+					"best": min(times),
+					"times": times
+				})
+				results[-1].update(getattr(func, "stats", {}))
+	return results
+
+if __name__ == "__main__":
+	import argparse
+
+	pargs = argparse.ArgumentParser(prog="advbench.py",
+		description="Benchmark the Adventure Prompt tools.")
+	pargs.add_argument("--sizes", default="1000,10000,100000,1000000",
+		help="comma-separated numbers of objects to try")
+	pargs.add_argument("--only", metavar="NAMES",
+		help="comma-separated benchmarks to run (default: all)")
+	pargs.add_argument("-n", "--repeat", type=int, default=3,
+		help="how many times to run each benchmark")
+	pargs.add_argument("--exits", type=int, default=2,
+		help="exits per room")
+	pargs.add_argument("--items", type=int, default=3,
+		help="items per room")
+	pargs.add_argument("--locks", type=float, default=0.1,
+		help="fraction of exits that are locked")
+	pargs.add_argument("--text-size", type=int, default=100,
+		help="approximate length of descriptions in characters")
+	pargs.add_argument("--seed", type=int, default=1,
+		help="random seed for the world generator")
+	pargs.add_argument("--clients", type=int, default=32,
+		help="simulated authors for the build server load test")
+	pargs.add_argument("--commands", type=int, default=50,
+		help="commands each simulated author sends")
+	pargs.add_argument("-l", "--list", action="store_true",
+		help="list available benchmarks and exit")
+	pargs.add_argument("-o", "--output", metavar="FILE",
+		help="write results to FILE instead of standard output")
+	args = pargs.parse_args()
+
+	if args.list:
+		for i in benchmarks:
+			print(i[0])
+		sys.exit(0)
+	names = [i[0] for i in benchmarks]
+	if args.only != None:
+		names = args.only.split(",")
+		for i in names:
+			if i not in dict(benchmarks):
+				pargs.error("unknown benchmark: " + i)
+	sizes = [int(i) for i in args.sizes.split(",")]
+	options = {
+		"exits": args.exits,
+		"items": args.items,
+		"locks": args.locks,
+		"text_size": args.text_size,
+		"seed": args.seed
+	}
+	report = {
+		"python": platform.python_version(),
+		"platform": platform.platform(),
+		"options": options,
+		"repeat": args.repeat,
+		"results": run_benchmarks(sizes, names, args.repeat, options,
+			args.clients, args.commands)
+	}
+	if args.output != None:
+		with open(args.output, "w") as f:
+			json.dump(report, f, indent=1)
+	else:
+		json.dump(report, sys.stdout, indent=1)
+		print()
@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""Compact binary container for Adventure Prompt story and save files.
+
+The layout, with integers unsigned 32-bit little-endian unless noted:
+
+	magic		b"ADVB" followed by a version byte
+	strings		count, byte size, length of each string in characters,
+			then all of them as one UTF-8 blob; everything else
+			refers to strings by index into this table
+	sections	count, then for each top-level key: key index, kind byte
+			and contents (a single value, a record, or objects)
+
+Objects are stored in groups sharing the same type and the same keys in the
+same order, each group with the position in the story and id of its members,
+then one column per property. A column is a tag byte per value (or just one
+if they're all alike) followed by arrays of string indices, 64-bit integers
+and doubles, so booleans, null, ints and floats all come back exactly as
+they went in. Anything else is kept as a JSON string. Index arrays are one,
+two or four bytes per entry, depending on the largest value.
+"""
+
+from __future__ import print_function
+
+import sys
+import json
+import struct
+import collections.abc
+from array import array
+
+magic = b"ADVB\x01"
+
+TAG_NULL = 0
+TAG_FALSE = 1
+TAG_TRUE = 2
+TAG_INT = 3
+TAG_FLOAT = 4
+TAG_STRING = 5
+TAG_JSON = 6
+TAG_ABSENT = 7
+TAG_MIXED = 255
+
+KIND_VALUE = 0
+KIND_RECORD = 1
+KIND_OBJECTS = 2
+
+absent = object()
+
+def is_binary(data):
+	return data[:len(magic)] == magic
+
+def to_bytes(values, typecode):
+	a = array(typecode, values)
+	if sys.byteorder != "little":
+		a.byteswap()
+	return a.tobytes()
+
+def index_typecode(values):
+	top = max(values) if len(values) > 0 else 0
+	if top < 0x100:
+		return "B"
+	elif top < 0x10000:
+		return "H"
+	else:
+		return "I"
+
+def index_map(table, indices):
+	return list(map(table.__getitem__, indices))
+
+class Writer(object):
+	def __init__(self):
+		self.strings = []
+		self.string_ids = {}
+		self.parts = []
+
+	def intern(self, text):
+		if text not in self.string_ids:
+			self.string_ids[text] = len(self.strings)
+			self.strings.append(text)
+		return self.string_ids[text]
+
+	def u8(self, value):
+		self.parts.append(struct.pack("<B", value))
+
+	def u32(self, value):
+		self.parts.append(struct.pack("<I", value))
+
+	def index_array(self, values):
+		typecode = index_typecode(values)
+		self.parts.append(typecode.encode("ascii"))
+		self.u32(len(values))
+		self.parts.append(to_bytes(values, typecode))
+
+	def values(self, values):
+		tags = bytearray()
+		strings = []
+		ints = []
+		floats = []
+		for i in values:
+			if i is absent:
+				tags.append(TAG_ABSENT)
+			elif i is None:
+				tags.append(TAG_NULL)
+			elif i is False:
+				tags.append(TAG_FALSE)
+			elif i is True:
+				tags.append(TAG_TRUE)
+			elif type(i) is str:
+				tags.append(TAG_STRING)
+				strings.append(self.intern(i))
+			elif type(i) is int and -2**63 <= i < 2**63:
+				tags.append(TAG_INT)
+				ints.append(i)
+			elif type(i) is float:
+				tags.append(TAG_FLOAT)
+				floats.append(i)
+			else:
+				tags.append(TAG_JSON)
+				strings.append(self.intern(json.dumps(i)))
+		self.u32(len(tags))
+		if len(tags) > 0 and tags.count(tags[0]) == len(tags):
+			self.u8(tags[0]) # All the same, as in most columns.
+		else:
+			self.u8(TAG_MIXED)
+			self.parts.append(bytes(tags))
+		self.index_array(strings)
+		self.u32(len(ints))
+		self.parts.append(to_bytes(ints, "q"))
+		self.u32(len(floats))
+		self.parts.append(to_bytes(floats, "d"))
+
+	def objects(self, objs):
+		groups = {}
+		position = 0
+		for i in objs:
+			obj = objs[i]
+			t = obj.get("type", absent)
+			if type(t) is not str and t is not absent:
+				t = ("json", json.dumps(t))
+			key = (t, tuple(obj))
+			if key not in groups:
+				groups[key] = []
+			groups[key].append((position, i))
+			position += 1
+		self.u32(position)
+		self.u32(len(groups))
+		for key in groups:
+			members = groups[key]
+			first = objs[members[0][1]]
+			self.values([first.get("type", absent)])
+			self.index_array([self.intern(i) for i in key[1]])
+			self.index_array([i[0] for i in members])
+			self.index_array([self.intern(i[1]) for i in members])
+			for i in key[1]:
+				if i != "type":
+					self.values([objs[j[1]][i] for j in members])
+
+	def section(self, key, value):
+		self.u32(self.intern(key))
+		if key == "objects" and type(value) is dict and all(
+				isinstance(i, collections.abc.Mapping)
+				for i in value.values()):
+			self.u8(KIND_OBJECTS)
+			self.objects(value)
+		elif type(value) is dict:
+			self.u8(KIND_RECORD)
+			self.index_array([self.intern(i) for i in value])
+			self.values(list(value.values()))
+		else:
+			self.u8(KIND_VALUE)
+			self.values([value])
+
+	def finish(self):
+		blob = "".join(self.strings).encode("utf-8")
+		lengths = [len(i) for i in self.strings]
+		typecode = index_typecode(lengths)
+		head = [magic, struct.pack("<II", len(self.strings), len(blob)),
+			typecode.encode("ascii"), to_bytes(lengths, typecode), blob]
+		return b"".join(head + self.parts)
+
+class Reader(object):
+	def __init__(self, data):
+		if not is_binary(data):
+			raise ValueError("not an Adventure Prompt binary story")
+		self.data = memoryview(data)
+		self.pos = len(magic)
+		count, size = self.unpack("<II")
+		lengths = self.array(self.bytes(1).decode("ascii"), count)
+		text = self.bytes(size).decode("utf-8")
+		self.strings = []
+		start = 0
+		for i in lengths:
+			self.strings.append(text[start:start + i])
+			start += i
+
+	def unpack(self, fmt):
+		values = struct.unpack_from(fmt, self.data, self.pos)
+		self.pos += struct.calcsize(fmt)
+		return values
+
+	def u8(self):
+		return self.unpack("<B")[0]
+
+	def u32(self):
+		return self.unpack("<I")[0]
+
+	def bytes(self, size):
+		chunk = self.data[self.pos:self.pos + size]
+		if len(chunk) < size:
+			raise ValueError("binary story is truncated")
+		self.pos += size
+		return chunk.tobytes()
+
+	def array(self, typecode, count):
+		a = array(typecode)
+		a.frombytes(self.bytes(count * a.itemsize))
+		if sys.byteorder != "little":
+			a.byteswap()
+		return a
+
+	def index_array(self):
+		typecode = self.bytes(1).decode("ascii")
+		return self.array(typecode, self.u32())
+
+	def values(self):
+		count = self.u32()
+		tag = self.u8()
+		if tag == TAG_MIXED:
+			tags = self.bytes(count)
+		strings = self.index_array()
+		ints = self.array("q", self.u32())
+		floats = self.array("d", self.u32())
+		table = self.strings
+		if tag == TAG_STRING:
+			return index_map(table, strings)
+		elif tag == TAG_INT:
+			return ints.tolist()
+		elif tag == TAG_FLOAT:
+			return floats.tolist()
+		elif tag == TAG_TRUE:
+			return [True] * count
+		elif tag == TAG_FALSE:
+			return [False] * count
+		elif tag == TAG_NULL:
+			return [None] * count
+		elif tag == TAG_ABSENT:
+			return [absent] * count
+		elif tag != TAG_MIXED:
+			tags = bytes([tag]) * count
+		strings = iter(strings)
+		ints = iter(ints)
+		floats = iter(floats)
+		found = []
+		for i in tags:
+			if i == TAG_STRING:
+				found.append(table[next(strings)])
+			elif i == TAG_TRUE:
+				found.append(True)
+			elif i == TAG_FALSE:
+				found.append(False)
+			elif i == TAG_NULL:
+				found.append(None)
+			elif i == TAG_INT:
+				found.append(next(ints))
+			elif i == TAG_FLOAT:
+				found.append(next(floats))
+			elif i == TAG_JSON:
+				found.append(json.loads(table[next(strings)]))
+			elif i == TAG_ABSENT:
+				found.append(absent)
+			else:
+				raise ValueError("bad value tag: {0}".format(i))
+		return found
+
+	def objects(self):
+		table = self.strings
+		count = self.u32()
+		ids = [None] * count
+		found = [None] * count
+		for i in range(self.u32()):
+			obj_type = self.values()[0]
+			layout = index_map(table, self.index_array())
+			members = self.index_array()
+			member_ids = index_map(table, self.index_array())
+			for n, obj_id in zip(members, member_ids):
+				ids[n] = obj_id
+			columns = []
+			for j in layout:
+				if j == "type":
+					columns.append([obj_type] * len(members))
+				else:
+					columns.append(self.values())
+			if len(columns) > 0:
+				rows = zip(*columns)
+			else: # Empty objects, with nothing to zip.
+				rows = [()] * len(members)
+			for n, row in zip(members, rows):
+				found[n] = dict(zip(layout, row))
+		return dict(zip(ids, found))
+
+	def sections(self):
+		game = {}
+		for i in range(self.u32()):
+			key = self.strings[self.u32()]
+			kind = self.u8()
+			if kind == KIND_OBJECTS:
+				game[key] = self.objects()
+			elif kind == KIND_RECORD:
+				keys = index_map(self.strings, self.index_array())
+				game[key] = dict(zip(keys, self.values()))
+			elif kind == KIND_VALUE:
+				game[key] = self.values()[0]
+			else:
+				raise ValueError("bad section kind: {0}".format(kind))
+		return game
+
+def dumps(game):
+	writer = Writer()
+	writer.u32(len(game))
+	for i in game:
+		writer.section(i, game[i])
+	return writer.finish()
+
+def loads(data):
+	return Reader(data).sections()
+
+def dump(game, f):
+	f.write(dumps(game))
+
+def load(f):
+	return loads(f.read())
+
+def load_any(data):
+	"""Load a story from bytes holding either the binary format or JSON."""
+	if is_binary(data):
+		return loads(data)
+	else:
+		return json.loads(data.decode("utf-8"))
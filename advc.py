@@ -4,12 +4,33 @@
 from __future__ import print_function
 
 import sys
+import os
+import io
+import time
+import threading
+import contextlib
 import configparser
+import hashlib
+import json
 import uuid
+import collections
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import promptrun
+import advbin
 
 obj_types = ["actor", "room", "exit", "thing", "scenery", "vehicle", "text",
 	"action", "spell", "topic"]
 lock_types = ["?", "!", "+", "-", "@", "^", "#", "~"]
+runner_marker = "var game_data = null;"
+# Added to bundles served by --serve, so they reload after each rebuild.
+reload_script = """<script>
+new EventSource("/events").onmessage = function () { location.reload(); };
+</script>
+"""
+# Bump this whenever the shape of parsed sources changes.
+cache_version = "2"
 
 def new_meta():
 	return {
@@ -48,106 +69,557 @@ def new_game():
 	game["objects"]["limbo"]["description"] = "You are in limbo."
 	return game
 
-def merge_data(config, output):
-	if "META" in config:
-		for i in config["META"]:
-			output["meta"][i] = config["META"][i]
-	if "CONFIG" in config:
-		for i in config["CONFIG"]:
-			if i == "max_score":
-				output["config"][i] = int(config["CONFIG"][i])
-			elif i == "use_score":
-				output["config"][i] = config.getboolean(
-					"CONFIG", i)
+class Profile(object):
+	"""Running total of time spent in each phase of a build."""
+	
+	def __init__(self):
+		self.times = collections.OrderedDict()
+	
+	@contextlib.contextmanager
+	def phase(self, name):
+		start = time.perf_counter()
+		try:
+			yield
+		finally:
+			elapsed = time.perf_counter() - start
+			self.times[name] = self.times.get(name, 0) + elapsed
+	
+	def report(self, f):
+		print("Phase         Seconds", file=f)
+		for i in self.times:
+			print("{0:10s} {1:10.4f}".format(i, self.times[i]), file=f)
+		print("{0:10s} {1:10.4f}".format(
+			"total", sum(self.times.values())), file=f)
+
+def parse_bool(value):
+	states = configparser.ConfigParser.BOOLEAN_STATES
+	if value.lower() not in states:
+		raise ValueError("Not a boolean: " + value)
+	return states[value.lower()]
+
+class RawValues(object):
+	"""Just enough of a ConfigParser for BasicInterpolation to work with."""
+	
+	def __init__(self, values):
+		self.values = values
+	
+	def optionxform(self, option):
+		return option.lower()
+	
+	def get(self, section, option, raw=False, fallback=None):
+		return self.values.get(option.lower(), fallback)
+
+def parse_ini(text, name="<string>"):
+	"""Parse config text the same as configparser, keeping line numbers.
+	
+	Gives the same sections as parse_configparser, raises the same errors
+	for the same input, and also returns the line where each section
+	header (as option "") and option was found.
+	"""
+	sectcre = configparser.ConfigParser.SECTCRE
+	sections = {}
+	defaults = {}
+	section_lines = {}
+	default_lines = {}
+	added = set()
+	cursect = None
+	curlines = None
+	sectname = None
+	optname = None
+	indent_level = 0
+	e = None
+	lines = text.split("\n")
+	if lines[-1] == "":
+		lines.pop()
+	for lineno, line in enumerate(lines, 1):
+		value = line.strip()
+		if value == "" or value[0] == "#" or value[0] == ";":
+			if (value == "" and cursect != None and optname
+					and cursect[optname] != None):
+				cursect[optname].append("")
+			continue
+		cur_indent_level = len(line) - len(line.lstrip())
+		if cursect != None and optname and cur_indent_level > indent_level:
+			cursect[optname].append(value)
+			continue
+		indent_level = cur_indent_level
+		mo = sectcre.match(value) if value[0] == "[" else None
+		if mo:
+			sectname = mo.group("header")
+			if sectname in sections:
+				raise configparser.DuplicateSectionError(
+					sectname, name, lineno)
+			elif sectname == "DEFAULT":
+				cursect = defaults
+				curlines = default_lines
 			else:
-				output["config"][i] = config["CONFIG"][i]
-	flags = ["ending", "dark", "light", "sticky", "visited"]
-	for i in config:
-		if i in ["DEFAULT", "CONFIG", "META"]:
+				cursect = {}
+				sections[sectname] = cursect
+				curlines = {"": lineno}
+				section_lines[sectname] = curlines
+			optname = None
 			continue
-
-		if i not in output["objects"]:
-			output["objects"][i] = {}
-		inobj = config[i]
-		outobj = output["objects"][i]
-		for j in inobj:
-			if j == "score":
-				outobj[j] = int(inobj[j])
-			elif j in flags:
-				outobj[j] = config.getboolean(i, j)
+		elif cursect == None:
+			raise configparser.MissingSectionHeaderError(
+				name, lineno, line_text(text, lines, lineno))
+		equals = value.find("=")
+		colon = value.find(":")
+		if equals < 0 or 0 <= colon < equals:
+			equals = colon
+		if equals < 0:
+			if e == None:
+				e = configparser.ParsingError(name)
+			e.append(lineno, repr(line_text(text, lines, lineno)))
+			continue
+		elif equals == 0:
+			if e == None:
+				e = configparser.ParsingError(name)
+			e.append(lineno, repr(line_text(text, lines, lineno)))
+		optname = value[:equals].rstrip().lower()
+		if (sectname, optname) in added:
+			raise configparser.DuplicateOptionError(
+				sectname, optname, name, lineno)
+		added.add((sectname, optname))
+		cursect[optname] = [value[equals + 1:].strip()]
+		curlines[optname] = lineno
+	
+	for options in [defaults] + list(sections.values()):
+		for i in options:
+			if len(options[i]) == 1:
+				options[i] = options[i][0]
 			else:
-				outobj[j] = inobj[j]
+				options[i] = "\n".join(options[i]).rstrip()
+	if e != None:
+		raise e
+	
+	interpolation = configparser.BasicInterpolation()
+	for i in sections:
+		section = sections[i]
+		values = collections.ChainMap(section, defaults)
+		found = {}
+		for j in list(section) + [k for k in defaults if k not in section]:
+			value = values[j]
+			if "%" in value:
+				value = interpolation.before_get(
+					RawValues(values), i, j, value, values)
+			found[j] = value
+			if j not in section:
+				section_lines[i][j] = default_lines[j]
+		sections[i] = found
+	return sections, section_lines
+
+def line_text(text, lines, lineno):
+	"""A line as configparser would show it in errors."""
+	if lineno == len(lines) and not text.endswith("\n"):
+		return lines[-1]
+	else:
+		return lines[lineno - 1] + "\n"
+
+def parse_configparser(text, name="<string>"):
+	config = configparser.ConfigParser()
+	config.read_string(text, name)
+	sections = {}
+	for i in config:
+		if i != "DEFAULT": # Defaults are already merged into sections.
+			sections[i] = dict(config[i])
+	return sections
+
+def parse_source(text, name="<string>", fast=True):
+	"""Parse a source file into sections and the lines they came from.
+	
+	Line numbers are only known with the fast parser; otherwise the
+	"lines" are empty.
+	"""
+	if fast:
+		sections, lines = parse_ini(text, name)
+	else:
+		sections, lines = parse_configparser(text, name), {}
+	return {"file": name, "sections": sections, "lines": lines}
 
-def sanity_check(game_data):
+def parse_job(job):
+	return parse_source(*job)
+
+def cache_path(text, cache_dir, fast=True):
+	# Only the fast parser knows line numbers, so keep them apart.
+	version = cache_version + ("" if fast else "c")
+	data = text.encode("utf-8")
+	key = hashlib.sha256(version.encode("ascii") + data).hexdigest()
+	return os.path.join(cache_dir, key + ".json")
+
+def load_cached(path):
+	try:
+		with open(path, "r") as f:
+			return json.load(f)
+	except (IOError, OSError, ValueError):
+		return None # Missing or damaged; just parse again.
+
+def store_cached(path, sections):
+	cache_dir = os.path.dirname(path)
+	if not os.path.isdir(cache_dir):
+		os.makedirs(cache_dir)
+	tmp_path = "{0}.{1}.tmp".format(path, os.getpid())
+	with open(tmp_path, "w") as f:
+		json.dump(sections, f)
+	os.replace(tmp_path, path)
+
+def read_sources(files, cache_dir=None, jobs=1, profile=None, fast=True):
+	if profile == None:
+		profile = Profile()
+	jobs_list = []
+	with profile.phase("read"):
+		for i in files:
+			jobs_list.append((i.read(), i.name, fast))
+			i.close()
+	parsed = [None] * len(jobs_list)
+	paths = [None] * len(jobs_list)
+	todo = []
+	with profile.phase("cache"):
+		for i in range(len(jobs_list)):
+			if cache_dir != None:
+				paths[i] = cache_path(jobs_list[i][0], cache_dir, fast)
+				parsed[i] = load_cached(paths[i])
+				if parsed[i] != None:
+					# Another file with the same text may have
+					# stored it; report errors against this one.
+					parsed[i]["file"] = jobs_list[i][1]
+			if parsed[i] == None:
+				todo.append(i)
+	
+	with profile.phase("parse"):
+		if jobs > 1 and len(todo) > 1:
+			# Results come back in submission order, so merging
+			# them afterwards gives the same overrides as parsing
+			# serially.
+			chunk = max(1, len(todo) // (jobs * 4))
+			with ProcessPoolExecutor(jobs) as pool:
+				results = list(pool.map(parse_job,
+					[jobs_list[i] for i in todo],
+					chunksize=chunk))
+		else:
+			results = [parse_job(jobs_list[i]) for i in todo]
+	
+	with profile.phase("cache"):
+		for i, sections in zip(todo, results):
+			parsed[i] = sections
+			if cache_dir != None:
+				store_cached(paths[i], sections)
+	return parsed
+
+def merge_data(config, output, lines=None, file_name=None, origins=None):
+	"""Merge parsed sections into a story.
+	
+	Given the lines from parse_source, errors in values say where they
+	are, and origins (if any) gets the position of each object property.
+	"""
+	if lines == None:
+		lines = {}
+	section = option = None
+	try:
+		if "META" in config:
+			for i in config["META"]:
+				output["meta"][i] = config["META"][i]
+		if "CONFIG" in config:
+			section = "CONFIG"
+			for option in config[section]:
+				value = config[section][option]
+				if option == "max_score":
+					output["config"][option] = int(value)
+				elif option == "use_score":
+					output["config"][option] = parse_bool(value)
+				else:
+					output["config"][option] = value
+		flags = ["ending", "dark", "light", "sticky", "visited"]
+		for section in config:
+			if section in ["DEFAULT", "CONFIG", "META"]:
+				continue
+
+			if section not in output["objects"]:
+				output["objects"][section] = {}
+			inobj = config[section]
+			outobj = output["objects"][section]
+			for option in inobj:
+				if option == "score":
+					outobj[option] = int(inobj[option])
+				elif option in flags:
+					outobj[option] = parse_bool(inobj[option])
+				else:
+					outobj[option] = inobj[option]
+			if origins != None and section in lines:
+				where = origins.setdefault(section, {})
+				for i in lines[section]:
+					where[i] = "{0}:{1}".format(
+						file_name, lines[section][i])
+	except ValueError as e:
+		if section in lines and option in lines[section]:
+			raise ValueError("{0}:{1}: [{2}] {3}: {4}".format(
+				file_name, lines[section][option], section, option, e))
+		raise
+
+def merge_source(source, output, origins=None):
+	"""Merge a source from parse_source into a story."""
+	merge_data(source["sections"], output, source["lines"],
+		source["file"], origins)
+
+def sanity_check(game_data, origins=None):
 	errcount = 0
 	db = game_data["objects"]
 	linked = set()
+	def at(obj_id, prop=""):
+		if origins == None or prop not in origins.get(obj_id, {}):
+			return ""
+		return origins[obj_id][prop] + ": "
 	for i in db:
 		if "link" in db[i]:
 			if db[i]["link"] in db:
 				linked.add(db[i]["link"])
 			else:
-				report_bad_link(i, db[i]["link"])
+				report_bad_link(i, db[i]["link"], at(i, "link"))
 				errcount += 1
 		if "location" in db[i]:
 			if db[i]["location"] in db:
 				linked.add(db[i]["location"])
 			else: # Not really a problem unless it's the hero.
-				report_bad_parent(i, db[i]["location"])
+				report_bad_parent(i, db[i]["location"],
+					at(i, "location"))
 				errcount += 1
 		if "lock" in db[i]:
 			lock = db[i]["lock"][0]
 			key = db[i]["lock"][1:]
 			if lock not in lock_types:
-				report_bad_lock(i, lock)
+				report_bad_lock(i, lock, at(i, "lock"))
 				errcount += 1
 			if key in db:
 				linked.add(key)
 			else:
-				report_bad_key(i, key)
+				report_bad_key(i, key, at(i, "lock"))
 				errcount += 1
 	for i in list(db.keys()): # Allow for deleting keys within the loop.
 		if "type" not in db[i]:
 			db[i]["type"] = "thing"
-			report_default_type(i)
+			report_default_type(i, at(i))
 		elif db[i]["type"] not in obj_types:
-			report_bad_type(i, db[i]["type"])
+			report_bad_type(i, db[i]["type"], at(i, "type"))
 		elif db[i]["type"] == "room":
 			if i not in linked:
 				if i == "limbo":
 					 # It's probably the unused default.
 					del db[i]
 				else:
-					report_unlinked_room(i)
+					report_unlinked_room(i, at(i))
 	return errcount == 0
 
-def report_bad_link(obj_id, link):
+def report_bad_link(obj_id, link, where=""):
 	e = "Error: {0} links to non-existent object {1}."
-	print(e.format(obj_id, link), file=sys.stderr)
+	print(where + e.format(obj_id, link), file=sys.stderr)
 
-def report_bad_parent(obj_id, link):
+def report_bad_parent(obj_id, link, where=""):
 	e = "Error: {0} located in non-existent object {1}."
-	print(e.format(obj_id, link), file=sys.stderr)
+	print(where + e.format(obj_id, link), file=sys.stderr)
 
-def report_default_type(obj_id):
+def report_default_type(obj_id, where=""):
 	e = "Warning: Object {0} has no type, was set to 'thing'."
-	print(e.format(obj_id), file=sys.stderr)
+	print(where + e.format(obj_id), file=sys.stderr)
 
-def report_bad_type(obj_id, type_id):
+def report_bad_type(obj_id, type_id, where=""):
 	e = "Warning: Object {0} has unknown type {1}."
-	print(e.format(obj_id, type_id), file=sys.stderr)
+	print(where + e.format(obj_id, type_id), file=sys.stderr)
 
-def report_bad_lock(obj_id, lock):
+def report_bad_lock(obj_id, lock, where=""):
 	e = "Error: Bad key type {0} in object {1}."
-	print(e.format(lock, obj_id), file=sys.stderr)
+	print(where + e.format(lock, obj_id), file=sys.stderr)
 
-def report_bad_key(obj_id, key_id):
+def report_bad_key(obj_id, key_id, where=""):
 	e = "Error: {0} locked to non-existent object {1}."
-	print(e.format(obj_id, key_id), file=sys.stderr)
+	print(where + e.format(obj_id, key_id), file=sys.stderr)
 
-def report_unlinked_room(obj_id):
+def report_unlinked_room(obj_id, where=""):
 	e = "Warning: room {0} has no links pointing to it."
-	print(e.format(obj_id), file=sys.stderr)
+	print(where + e.format(obj_id), file=sys.stderr)
+
+def solve_story(game_data, max_states=200000):
+	"""Play every possible way through the story, breadth first.
+	
+	Returns a dictionary with the number of states explored, whether the
+	search finished, the first state found for each ending, and the best
+	score seen together with its state; plus the game and parent links
+	needed to turn any of these states into a walkthrough."""
+	game = promptrun.Game(json.loads(json.dumps(game_data)))
+	game.journal = []
+	start = game.snapshot()
+	parents = {start: None}
+	queue = collections.deque([start])
+	endings = {}
+	best = start
+	complete = True
+	while len(queue) > 0:
+		state = queue.popleft()
+		game.restore(state)
+		for action in game.actions():
+			game.apply(action)
+			after = game.snapshot()
+			game.rollback(game.journal, state)
+			if after in parents:
+				continue
+			parents[after] = (state, action)
+			if after[1] > best[1]:
+				best = after
+			if after[2] == None:
+				queue.append(after)
+			elif after[2] not in endings:
+				endings[after[2]] = after
+		if len(parents) >= max_states:
+			complete = len(queue) == 0
+			break
+	return {
+		"game": game,
+		"parents": parents,
+		"states": len(parents),
+		"complete": complete,
+		"endings": endings,
+		"best": best
+	}
+
+def load_compiled(path):
+	"""Load a story compiled earlier, or return None for a source file."""
+	with open(path, "rb") as f:
+		data = f.read()
+	if advbin.is_binary(data) or data.lstrip()[:1] == b"{":
+		return advbin.load_any(data)
+	else:
+		return None
+
+def walkthrough(solution, state):
+	game = solution["game"]
+	parents = solution["parents"]
+	steps = []
+	while parents[state] != None:
+		state, action = parents[state]
+		steps.append(game.action_text(action))
+	steps.reverse()
+	return steps
+
+def report_solution(game_data, solution):
+	db = game_data["objects"]
+	print("Explored {0} game states{1}.".format(solution["states"],
+		"" if solution["complete"] else " (search cut short)"))
+	shortest = None
+	for i in db:
+		if not db[i].get("ending"):
+			continue
+		elif i in solution["endings"]:
+			steps = walkthrough(solution, solution["endings"][i])
+			print("Ending {0} reachable in {1} moves.".format(
+				i, len(steps)))
+			if shortest == None or len(steps) < len(shortest):
+				shortest = steps
+		elif solution["complete"]:
+			print("Ending {0} can't be reached.".format(i))
+		else:
+			print("Ending {0} not reached yet.".format(i))
+	max_score = game_data["config"].get("max_score", 0)
+	best = solution["best"][1]
+	print("Highest score: {0} of {1}.".format(
+		number_text(best), number_text(max_score)))
+	if best < max_score and solution["complete"]:
+		print("Warning: the maximum score can't be reached.")
+	elif best > max_score:
+		print("Warning: scores above the maximum are possible.")
+	if shortest != None:
+		print("Shortest walkthrough:")
+		for i in range(len(shortest)):
+			print("{0:4d}. {1}".format(i + 1, shortest[i]))
+
+def short_ids():
+	n = 0
+	digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+	while True:
+		token = ""
+		i = n
+		while True:
+			token = digits[i % 36] + token
+			i = i // 36
+			if i == 0:
+				break
+		n += 1
+		if token == "hero": # The runner refers to this one by name.
+			continue
+		elif token.isdigit():
+			continue # Browsers list such keys first, out of story order.
+		yield token
+
+def number_text(value):
+	"""Text for a number found in a text field, as the runner shows it."""
+	if type(value) is float and value.is_integer():
+		return str(int(value))
+	else:
+		return str(value)
+
+def minify_story(game_data):
+	"""Shorten ids, share repeated text and drop default-valued fields.
+	
+	Returns a new story; repeated text goes in a top-level "strings" list,
+	which the runner resolves at load time, so any numbers already in text
+	fields are turned into text first."""
+	db = game_data["objects"]
+	refs = collections.Counter(db.keys())
+	texts = collections.Counter()
+	for i in db:
+		obj = db[i]
+		for j in ("location", "link"):
+			if obj.get(j) in db:
+				refs[obj[j]] += 1
+		if obj.get("lock"):
+			refs[obj["lock"][1:]] += 1
+		for j in promptrun.text_fields:
+			value = obj.get(j)
+			if type(value) in (int, float):
+				value = number_text(value)
+			if isinstance(value, str) and value != "":
+				texts[value] += 1
+
+	new_ids = {"hero": "hero"}
+	tokens = short_ids()
+	for i, count in refs.most_common():
+		if i != "hero":
+			new_ids[i] = next(tokens)
+	strings = []
+	shared = {}
+	for i, count in texts.most_common():
+		index = str(len(strings))
+		if count > 1 and len(json.dumps(i)) > len(index):
+			shared[i] = len(strings)
+			strings.append(i)
+
+	objects = {}
+	for i in db:
+		obj = {}
+		for j, value in db[i].items():
+			if value is None or value is False:
+				continue
+			elif j in promptrun.text_fields and type(value) in (int, float):
+				# Numbers stand for shared strings once minified.
+				value = number_text(value)
+			elif j in promptrun.text_fields and j != "name":
+				if value == "":
+					continue
+			if j in ("location", "link") and value in new_ids:
+				value = new_ids[value]
+			elif j == "lock" and value[1:] in new_ids:
+				value = value[0] + new_ids[value[1:]]
+			elif j in promptrun.text_fields and value in shared:
+				value = shared[value]
+			obj[j] = value
+		objects[new_ids[i]] = obj
+
+	output = {}
+	for i in game_data:
+		if i == "objects":
+			output[i] = objects
+		else:
+			output[i] = game_data[i]
+	if len(strings) > 0:
+		output["strings"] = strings
+	return output
 
 def story_stats(game_data):
 	type_count = {}
@@ -183,8 +655,473 @@ def game2config(game):
 
 	return output
 
+def write_section(name, items, f, interpolation):
+	section = {}
+	for i, value in items:
+		if "%" in value: # Same check ConfigParser does on assignment.
+			interpolation.before_set(None, name, i, value)
+		section[i.lower()] = value
+	f.write("[{0}]\n".format(name))
+	for i in section:
+		f.write("{0} = {1}\n".format(i, section[i].replace("\n", "\n\t")))
+	f.write("\n")
+
+def config_value(value):
+	if type(value) == float:
+		return str(int(value))
+	else:
+		return str(value)
+
+def write_config(game, f):
+	"""Same output as game2config(game).write(f), one object at a time."""
+	interpolation = configparser.BasicInterpolation()
+	meta = game["meta"]
+	write_section("META",
+		[(i, str(meta[i])) for i in meta], f, interpolation)
+	config = game["config"]
+	write_section("CONFIG",
+		[(i, config_value(config[i])) for i in config], f, interpolation)
+	for i in game["objects"]:
+		obj = game["objects"][i]
+		write_section(i,
+			[(j, config_value(obj[j])) for j in obj], f, interpolation)
+
+def write_story(game, f, separators=(", ", ": "), default=None):
+	"""Same output as json.dump(game, f), one object at a time."""
+	comma, colon = separators
+	f.write("{")
+	sep = ""
+	for i in game:
+		f.write(sep + json.dumps(i) + colon)
+		if i == "objects":
+			objs = game[i]
+			f.write("{")
+			sep2 = ""
+			for j in objs:
+				f.write(sep2 + json.dumps(j) + colon)
+				f.write(json.dumps(objs[j], separators=separators,
+					default=default))
+				sep2 = comma
+			f.write("}")
+		else:
+			f.write(json.dumps(game[i], separators=separators,
+				default=default))
+		sep = comma
+	f.write("}")
+
+def split_template(tpl):
+	head, marker, tail = tpl.partition(runner_marker)
+	if marker == "":
+		raise RuntimeError("runner template has no game data placeholder")
+	return head, tail
+
+def write_bundle(game, template, f, separators=(", ", ": ")):
+	f.write(template[0])
+	f.write("var game_data = ")
+	write_story(game, f, separators)
+	f.write(";")
+	f.write(template[1])
+
+def write_output(path, writer, *args, binary=False, **options):
+	if path == None and binary:
+		sys.stdout.flush()
+		writer(*(args + (sys.stdout.buffer,)), **options)
+	elif path == None:
+		writer(*(args + (sys.stdout,)), **options)
+	else: # Don't leave a half-written file behind on errors.
+		tmp_path = path + ".tmp"
+		try:
+			if binary:
+				f = open(tmp_path, "wb")
+			else:
+				f = open(tmp_path, "w", encoding="utf-8")
+			with f:
+				writer(*(args + (f,)), **options)
+			os.replace(tmp_path, path)
+		except BaseException:
+			if os.path.exists(tmp_path):
+				os.remove(tmp_path)
+			raise
+
+def emit_story(output, path, merge=False, minify=False, binary=False,
+		template=None, profile=None, index=False):
+	"""Write a checked story in whichever form was asked for."""
+	if profile == None:
+		profile = Profile()
+	if merge:
+		with profile.phase("serialize"):
+			write_output(path, write_config, output)
+		return
+	separators = (", ", ": ")
+	if minify:
+		with profile.phase("minify"):
+			output = minify_story(output)
+		separators = (",", ":")
+	if index: # After minifying, which changes the ids.
+		with profile.phase("index"):
+			output = dict(output,
+				index=promptrun.make_index(output["objects"]))
+	with profile.phase("serialize"):
+		if binary:
+			write_output(path, advbin.dump, output, binary=True)
+		elif template != None:
+			write_output(path, write_bundle, output, template,
+				separators=separators)
+		else:
+			write_output(path, write_story, output,
+				separators=separators)
+
+def file_stamp(path):
+	try:
+		st = os.stat(path)
+		return (st.st_mtime_ns, st.st_size)
+	except OSError:
+		return None # Editors often replace files by renaming.
+
+class SourceSet(object):
+	"""Source files kept parsed in memory, re-read only when changed."""
+	
+	def __init__(self, paths, fast=True):
+		self.paths = list(paths)
+		self.fast = fast
+		self.texts = {}
+		self.parsed = {}
+	
+	def refresh(self, paths=None):
+		"""Parse the given files again if their text changed.
+		
+		Returns how many were parsed; raises on the first bad file,
+		keeping the last good version of it.
+		"""
+		count = 0
+		for i in self.paths if paths == None else paths:
+			with open(i, "r") as f:
+				text = f.read()
+			if self.texts.get(i) != text:
+				self.parsed[i] = parse_source(text, i, self.fast)
+				self.texts[i] = text
+				count += 1
+		return count
+	
+	def sources(self):
+		return [self.parsed[i] for i in self.paths]
+
+def watch_files(paths, callback, interval=0.1, settle=0.2):
+	"""Call back with the list of changed files whenever some change.
+	
+	A burst of saves only triggers one call, once the files have stayed
+	the same for the settle time. Runs until interrupted.
+	"""
+	stamps = dict((i, file_stamp(i)) for i in paths)
+	while True:
+		time.sleep(interval)
+		if all(file_stamp(i) == stamps[i] for i in paths):
+			continue
+		while True:
+			latest = dict((i, file_stamp(i)) for i in paths)
+			time.sleep(settle)
+			if all(file_stamp(i) == latest[i] for i in paths):
+				break
+		changed = [i for i in paths if latest[i] != stamps[i]]
+		stamps = latest
+		if len(changed) > 0:
+			callback(changed)
+
+class LiveBuild(object):
+	"""Sources and runner template kept in memory for repeated builds."""
+	
+	def __init__(self, source_paths, template_path=None, fast=True):
+		self.sources = SourceSet(source_paths, fast)
+		self.template_path = template_path
+		self.template = None
+		self.paths = list(source_paths)
+		if template_path != None:
+			self.paths.append(template_path)
+		self.parsed = 0
+	
+	def update(self, changed):
+		"""Re-read changed files, then return the merged story.
+		
+		Returns None if the story doesn't pass the sanity check; the
+		diagnostics go to standard error as usual.
+		"""
+		self.parsed = self.sources.refresh(
+			[i for i in changed if i in self.sources.paths])
+		if self.template_path in changed:
+			with open(self.template_path, "r") as f:
+				self.template = split_template(f.read())
+		output = new_game()
+		origins = {}
+		for i in self.sources.sources():
+			merge_source(i, output, origins)
+		if sanity_check(output, origins):
+			return output
+		print("Errors found; keeping the last good build.", file=sys.stderr)
+		return None
+	
+	def run(self, callback):
+		"""Build now and on every change, until interrupted."""
+		def rebuild(changed):
+			start = time.perf_counter()
+			try:
+				output = self.update(changed)
+				if output != None:
+					name = callback(output)
+					print("[{0}] Built {1} ({2} parsed) in {3:.3f}s."
+						.format(time.strftime("%H:%M:%S"), name,
+							self.parsed,
+							time.perf_counter() - start),
+						file=sys.stderr)
+			except Exception as e:
+				print("Error compiling story file: " + str(e),
+					file=sys.stderr)
+		
+		rebuild(self.paths)
+		print("Watching {0} files; press Ctrl-C to stop.".format(
+			len(self.paths)), file=sys.stderr)
+		try:
+			watch_files(self.paths, rebuild)
+		except KeyboardInterrupt:
+			pass
+
+def watch_build(source_paths, output_path, template_path=None, fast=True,
+		**options):
+	"""Rebuild the output every time a source or the template changes."""
+	build = LiveBuild(source_paths, template_path, fast)
+	def write(output):
+		emit_story(output, output_path, template=build.template, **options)
+		return output_path
+	build.run(write)
+
+def find_projects(top):
+	"""List (name, sources) for each directory under top with INI files."""
+	projects = []
+	for path, dirs, files in os.walk(top):
+		dirs.sort()
+		sources = sorted(i for i in files if i.endswith(".ini"))
+		if len(sources) > 0:
+			name = os.path.relpath(path, top)
+			if name == ".":
+				name = os.path.basename(os.path.abspath(top))
+			projects.append(
+				(name, [os.path.join(path, i) for i in sources]))
+	return projects
+
+batch_template = None # Set once in each worker process.
+
+def init_batch(template):
+	global batch_template
+	batch_template = template
+
+def build_project(job):
+	"""Compile one project of a batch, capturing its diagnostics."""
+	name, paths, output_path, options = job
+	start = time.perf_counter()
+	result = {"project": name, "output": output_path, "ok": False,
+		"objects": 0}
+	log = io.StringIO()
+	with contextlib.redirect_stderr(log):
+		try:
+			files = [open(i, "r") for i in paths]
+			output = new_game()
+			origins = {}
+			for i in read_sources(files, options["cache"],
+					fast=options["fast"]):
+				merge_source(i, output, origins)
+			result["objects"] = len(output["objects"])
+			if sanity_check(output, origins):
+				if output_path != None:
+					emit_story(output, output_path,
+						merge=options["merge"],
+						minify=options["minify"],
+						binary=options["binary"],
+						index=options["index"],
+						template=batch_template)
+				result["ok"] = True
+		except ValueError as e:
+			print("Error in game data: " + str(e), file=sys.stderr)
+		except Exception as e:
+			print("Error compiling story file: " + str(e),
+				file=sys.stderr)
+	result["log"] = log.getvalue()
+	result["seconds"] = time.perf_counter() - start
+	return result
+
+def batch_build(top, output_dir=None, template=None, jobs=None, **options):
+	"""Compile every project under top across a pool of processes."""
+	if output_dir == None:
+		output_dir = top
+	if options["merge"]:
+		ext = ".ini"
+	elif options["binary"]:
+		ext = ".advb"
+	elif template != None:
+		ext = ".html"
+	else:
+		ext = ".json"
+	check = options.pop("check")
+	projects = find_projects(top)
+	if options["merge"] and not check:
+		# Merged configs from an earlier run are INI files too, and
+		# could be in the tree; don't take them for sources.
+		written = set(os.path.abspath(os.path.join(output_dir, i[0] + ext))
+			for i in projects)
+		projects = [(name, [i for i in paths
+				if os.path.abspath(i) not in written])
+			for name, paths in projects]
+		projects = [i for i in projects if len(i[1]) > 0]
+	job_list = []
+	for name, paths in projects:
+		output_path = None
+		if not check:
+			output_path = os.path.join(output_dir, name + ext)
+			if not os.path.isdir(os.path.dirname(output_path)):
+				os.makedirs(os.path.dirname(output_path))
+		job_list.append((name, paths, output_path, options))
+	
+	start = time.perf_counter()
+	with ProcessPoolExecutor(jobs, initializer=init_batch,
+			initargs=(template,)) as pool:
+		results = list(pool.map(build_project, job_list))
+	elapsed = time.perf_counter() - start
+	return results, elapsed
+
+def report_batch(results, elapsed, f):
+	failed = 0
+	for i in results:
+		if not i["ok"]:
+			failed += 1
+		print("{0:4s} {1} ({2} objects, {3:.3f}s)".format(
+			"ok" if i["ok"] else "FAIL", i["project"], i["objects"],
+			i["seconds"]), file=f)
+		for line in i["log"].splitlines():
+			print("     " + line, file=f)
+	print("{0} projects, {1} failed, {2:.3f}s total, {3:.3f}s of work."
+		.format(len(results), failed, elapsed,
+			sum(i["seconds"] for i in results)), file=f)
+	return failed == 0
+
+class StoryHandler(BaseHTTPRequestHandler):
+	def do_GET(self):
+		path = self.path.split("?")[0]
+		if path == "/" or path == "/index.html":
+			self.send_page("bundle", "text/html; charset=utf-8")
+		elif path == "/story.json":
+			self.send_page("story", "application/json")
+		elif path == "/events":
+			self.send_events()
+		else:
+			self.send_error(404)
+	
+	def send_page(self, name, content_type):
+		with self.server.changed:
+			page = self.server.pages.get(name)
+		if page == None:
+			self.send_error(503, "No successful build yet")
+			return
+		data, etag = page
+		wanted = self.headers.get("If-None-Match", "").split(",")
+		if etag in [i.strip() for i in wanted]:
+			self.send_response(304)
+			self.send_header("ETag", etag)
+			self.end_headers()
+			return
+		self.send_response(200)
+		self.send_header("Content-Type", content_type)
+		self.send_header("Content-Length", str(len(data)))
+		self.send_header("ETag", etag)
+		self.send_header("Cache-Control", "no-cache")
+		self.end_headers()
+		self.wfile.write(data)
+	
+	def send_events(self):
+		# Before answering, or a build done meanwhile would go unnoticed.
+		seen = self.server.generation
+		self.send_response(200)
+		self.send_header("Content-Type", "text/event-stream")
+		self.send_header("Cache-Control", "no-cache")
+		self.end_headers()
+		try:
+			while True:
+				with self.server.changed:
+					self.server.changed.wait_for(
+						lambda: self.server.generation != seen,
+						timeout=15)
+					latest = self.server.generation
+				if latest != seen:
+					seen = latest
+					self.wfile.write(b"data: reload\n\n")
+				else: # Find out if the browser went away.
+					self.wfile.write(b": ping\n\n")
+				self.wfile.flush()
+		except (IOError, OSError):
+			pass
+	
+	def log_message(self, format, *args):
+		pass # Every reload would make noise otherwise.
+
+class StoryServer(ThreadingHTTPServer):
+	"""Serve the latest bundle, telling open pages when it changes."""
+	
+	daemon_threads = True
+	
+	def __init__(self, address):
+		ThreadingHTTPServer.__init__(self, address, StoryHandler)
+		self.pages = {}
+		self.generation = 0
+		self.changed = threading.Condition()
+	
+	def publish(self, output, template, minify=False, index=False):
+		separators = (", ", ": ")
+		if minify:
+			output = minify_story(output)
+			separators = (",", ":")
+		if index:
+			output = dict(output,
+				index=promptrun.make_index(output["objects"]))
+		story = io.StringIO()
+		write_story(output, story, separators)
+		story = story.getvalue()
+		head, tail = template
+		body, marker, end = tail.rpartition("</body>")
+		if marker == "": # Not quite HTML, but do what we can.
+			body, end = tail, ""
+		bundle = "".join([head, "var game_data = ", story, ";",
+			body, reload_script, marker, end])
+		pages = {}
+		for name, text in [("story", story), ("bundle", bundle)]:
+			data = text.encode("utf-8")
+			etag = '"{0}"'.format(hashlib.sha1(data).hexdigest())
+			pages[name] = (data, etag)
+		with self.changed:
+			self.pages = pages
+			self.generation += 1
+			self.changed.notify_all()
+
+def parse_address(text):
+	host, colon, port = text.rpartition(":")
+	return (host if colon != "" else "localhost", int(port))
+
+def serve_build(source_paths, address, template_path, minify=False,
+		fast=True, index=False):
+	"""Serve a live-reloading bundle, rebuilt whenever sources change."""
+	build = LiveBuild(source_paths, template_path, fast)
+	server = StoryServer(address)
+	thread = threading.Thread(target=server.serve_forever)
+	thread.daemon = True
+	thread.start()
+	print("Serving on http://{0}:{1}/".format(*server.server_address[:2]),
+		file=sys.stderr)
+	def publish(output):
+		server.publish(output, build.template, minify, index)
+		return "bundle"
+	try:
+		build.run(publish)
+	finally:
+		server.shutdown()
+		server.server_close()
+
 if __name__ == "__main__":
-	import json
 	import argparse
 
 	pargs = argparse.ArgumentParser(prog="advc.py",
@@ -199,22 +1136,119 @@ if __name__ == "__main__":
 		help="output statistics instead of a story file")
 	group.add_argument("-m", "--merge", action="store_true",
 		help="output a merged configuration instead of a story file")
+	group.add_argument("--solve", action="store_true",
+		help="play through every game state to check for winnability"
+			+ " (also takes a compiled story)")
 	group.add_argument("-r", "--runner",
 		type=argparse.FileType('r'), nargs=1,
 		help="bundle a stand-alone game using the given runner")
+	group.add_argument("-b", "--binary", action="store_true",
+		help="output a compact binary story file instead of JSON")
+	pargs.add_argument("--cache", metavar="DIR",
+		help="reuse sources parsed in earlier runs, kept in DIR")
+	pargs.add_argument("-j", "--jobs", type=int, metavar="N",
+		help="parse source files using N worker processes")
+	pargs.add_argument("-o", "--output", metavar="FILE",
+		help="write the story, bundle or merged config to FILE")
+	pargs.add_argument("-z", "--minify", action="store_true",
+		help="shorten ids and share repeated text to make output smaller")
+	pargs.add_argument("--index", action="store_true",
+		help="add precomputed lookups so big stories play faster")
+	pargs.add_argument("--max-states", type=int, default=200000,
+		metavar="N", help="give up solving after N game states")
+	pargs.add_argument("--profile", action="store_true",
+		help="report the time spent in each phase on standard error")
+	pargs.add_argument("--configparser", action="store_true",
+		help="parse sources with the slower, standard configparser")
+	pargs.add_argument("-w", "--watch", action="store_true",
+		help="keep rebuilding the output whenever the sources change")
+	pargs.add_argument("--serve", metavar="[HOST:]PORT", nargs="?",
+		const="8000", help="serve a live-reloading bundle over HTTP")
+	pargs.add_argument("--batch", metavar="DIR",
+		help="compile each directory of INI files under DIR "
+			+ "(output goes to -o as a directory, or else DIR)")
 	pargs.add_argument("source", type=argparse.FileType('r'), nargs='*',
 		help="configuration files to use as input")
 	args = pargs.parse_args()
 
-	output = new_game()
-	try:
+	if args.index and (args.check or args.stats or args.solve
+			or args.merge):
+		pargs.error("--index only works when writing a story")
+
+	if args.batch != None:
+		if args.stats or args.solve or args.serve or args.watch \
+				or len(args.source) > 0:
+			pargs.error("--batch only works with the output options")
+		elif args.merge and args.output == None:
+			pargs.error("--batch --merge needs an output directory (-o)")
+		template = None
+		if args.runner != None:
+			template = split_template(args.runner[0].read(-1))
+			args.runner[0].close()
+		results, elapsed = batch_build(args.batch, args.output,
+			template, args.jobs, check=args.check, merge=args.merge,
+			minify=args.minify, binary=args.binary, cache=args.cache,
+			index=args.index, fast=not args.configparser)
+		sys.exit(0 if report_batch(results, elapsed, sys.stderr) else 1)
+	elif args.serve != None:
+		if args.check or args.stats or args.solve or args.merge \
+				or args.binary or args.watch:
+			pargs.error("--serve only works with bundles")
+		for i in args.source:
+			i.close()
+		if args.runner != None:
+			template_path = args.runner[0].name
+			args.runner[0].close()
+		else:
+			template_path = os.path.join(
+				os.path.dirname(os.path.abspath(__file__)),
+				"promptrun.html")
+		try:
+			address = parse_address(args.serve)
+		except ValueError:
+			pargs.error("bad address to serve on: " + args.serve)
+		serve_build([i.name for i in args.source], address,
+			template_path, minify=args.minify,
+			fast=not args.configparser, index=args.index)
+		sys.exit(0)
+	elif args.watch:
+		if args.output == None:
+			pargs.error("--watch needs an output file (-o)")
+		elif args.check or args.stats or args.solve:
+			pargs.error("--watch only works when writing output")
 		for i in args.source:
-			config = configparser.ConfigParser()
-			config.read_file(i)
 			i.close()
-			merge_data(config, output)
+		template_path = None
+		if args.runner != None:
+			template_path = args.runner[0].name
+			args.runner[0].close()
+		watch_build([i.name for i in args.source], args.output,
+			template_path, fast=not args.configparser, merge=args.merge,
+			minify=args.minify, binary=args.binary, index=args.index)
+		sys.exit(0)
+
+	output = new_game()
+	profile = Profile()
+	try:
+		compiled = None
+		if args.solve and len(args.source) == 1:
+			# Solving works just as well on a finished story.
+			with profile.phase("read"):
+				compiled = load_compiled(args.source[0].name)
+		origins = {}
+		if compiled != None:
+			args.source[0].close()
+			output = compiled
+		else:
+			sources = read_sources(args.source, args.cache,
+				args.jobs or 1, profile, not args.configparser)
+			with profile.phase("merge"):
+				for i in sources:
+					merge_source(i, output, origins)
 
-		if not sanity_check(output):
+		with profile.phase("sanity"):
+			sane = sanity_check(output, origins)
+		if not sane:
 			pass # Should this say something to cap the errors?
 		elif args.check:
 			pass
@@ -224,17 +1258,23 @@ if __name__ == "__main__":
 			for i in stats:
 				print("{0:10s}: {1:3d}".format(i, stats[i]))
 			print("Total:    {0:5d}".format(sum(stats.values())))
-		elif args.merge:
-			game2config(output).write(sys.stdout)
-		elif args.runner != None:
-			tpl = args.runner[0].read(-1)
-			args.runner[0].close()
-			place = "var game_data = null;"
-			text = "var game_data = " + json.dumps(output) + ";"
-			print(tpl.replace(place, text), end='')
+		elif args.solve:
+			with profile.phase("solve"):
+				solution = solve_story(output, args.max_states)
+			report_solution(output, solution)
 		else:
-			print(json.dumps(output), end='')
+			template = None
+			if args.runner != None:
+				with profile.phase("splice"):
+					template = split_template(
+						args.runner[0].read(-1))
+					args.runner[0].close()
+			emit_story(output, args.output, merge=args.merge,
+				minify=args.minify, binary=args.binary,
+				template=template, profile=profile, index=args.index)
 	except ValueError as e:
 		print("Error in game data: " + str(e), file=sys.stderr)
 	except Exception as e:
 		print("Error compiling story file: " + str(e), file=sys.stderr)
+	if args.profile:
+		profile.report(sys.stderr)
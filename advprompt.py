@@ -11,12 +11,23 @@ try:
 except ImportError as e:
 	print("(Command line editing is unavailable.)\n")
 
+import sys
+import os
+import io
+import contextlib
+import bisect
 import cmd
+import collections
+import collections.abc
+import re
+import time
 import shlex
 import json
 import uuid
 import glob
 
+import advbin
+
 app_banner = """
 Welcome to Adventure Prompt, a system for authoring interactive fiction
 interactively, version 2018-03-21. Type HELP or ? to see a list of commands.
@@ -48,7 +59,8 @@ The command line supports shortcuts to the most common commands:
 
 - `l` for look;
 - `ex` for examine;
-- `tel` for teleport.
+- `tel` for teleport;
+- `grep` for search.
 
 In addition, typing the name of an object in the current room by itself
 will move the author's viewpoint to the exit's destination.
@@ -228,13 +240,428 @@ object_keys = ["type", "name", "description", "success", "failure",
 	"drop", "nodrop", "link", "location", "lock",
 	"dark", "sticky", "visited", "light", "ending"]
 config_keys = ["banner", "use_score", "max_score"]
+# Properties holding text for players to read, which search looks through,
+# and how much a match in each counts for when ranking results.
+text_weights = {"name": 3, "description": 1, "success": 1, "failure": 1,
+	"drop": 1, "nodrop": 1, "initial": 1}
+# Properties worth indexing up front, as look and friends query them a lot.
+indexed_keys = ["location", "type", "link"]
+# Properties kept in slots of their own by Record, and the flags packed
+# into one number, two bits each: present and value.
+record_fields = ("type", "name", "description", "location", "link", "lock")
+record_flags = {"dark": 0, "sticky": 2, "visited": 4, "light": 6, "ending": 8}
+# Values shared by many objects, worth keeping a single copy of.
+interned_fields = frozenset(["type", "name", "location", "link", "lock"])
+record_slots = frozenset(record_fields)
+# How many commands can be undone.
+undo_limit = 100
+# How many different key layouts records share before starting over.
+layout_limit = 4096
+
+missing = object() # Stands for a property or field that isn't there.
+
+# Shortcuts handled by Editor.default, and the commands they stand for.
+command_aliases = {"l": "look", "ex": "examine", "tel": "teleport",
+	"grep": "search"}
+
+lock_types = ["?", "!", "+", "-", "@", "^", "#", "~"]
+
+# What to complete for each argument of each command, by position.
+completions = {
+	"look": ["object"],
+	"l": ["object"],
+	"examine": ["object"],
+	"ex": ["object"],
+	"say": ["object", "property"],
+	"teleport": ["object", "room"],
+	"tel": ["object", "room"],
+	"name": ["object"],
+	"desc": ["object"],
+	"succ": ["object"],
+	"fail": ["object"],
+	"drop": ["object"],
+	"open": [None, None, "room"],
+	"link": ["object", "room"],
+	"unlink": ["object"],
+	"lock": ["object", "key"],
+	"unlock": ["object"],
+	"clone": ["object"],
+	"set": ["object", "property", "value"],
+	"find": ["property", "value"],
+	"recycle": ["object"],
+	"unrecycle": ["trash"],
+	"meta": ["meta"],
+	"config": ["config"],
+	"timing": ["timing"]
+}
+
+# Lines made only of bare words and plain double-quoted strings, which is
+# nearly all of them, can be split without going through shlex. Only the
+# whitespace shlex knows about counts, not the rest of Unicode's.
+bare_word = re.compile(r'[^ \t\r\n]+')
+simple_line = re.compile(
+	r'[ \t\r\n]*(?:(?:"[^"\'\\]*"|[^ \t\r\n"\'\\]+)(?:[ \t\r\n]+|$))*$')
+simple_token = re.compile(r'"([^"\'\\]*)"|([^ \t\r\n"\'\\]+)')
+
+class QuoteError(ValueError):
+	"""A command line that shlex can't split, such as one missing a quote."""
 
 def shell_parse(text):
+	if '"' not in text and "'" not in text and "\\" not in text:
+		return bare_word.findall(text)
+	elif simple_line.match(text):
+		return [q or w for q, w in simple_token.findall(text)]
 	try:
 		return shlex.split(text)
 	except ValueError as e:
-		print(e)
-		return []
+		raise QuoteError(e)
+
+def percentile(samples, p):
+	"""Nearest-rank percentile of an already sorted, non-empty list."""
+	rank = max(1, -(-len(samples) * p // 100))
+	return samples[int(rank) - 1]
+
+def index_insert(table, value, obj_id):
+	try:
+		bucket = table.setdefault(value, {})
+	except TypeError:
+		return # Unhashable values can't be looked up anyway.
+	bucket[obj_id] = True
+
+def index_delete(table, value, obj_id):
+	try:
+		bucket = table.get(value)
+	except TypeError:
+		return
+	if bucket != None:
+		bucket.pop(obj_id, None)
+		if len(bucket) == 0:
+			del table[value]
+
+class PrefixIndex(object):
+	"""Sorted list of words, for quickly finding all with a given prefix."""
+	
+	def __init__(self, words=()):
+		self.words = sorted(set(words))
+	
+	def __contains__(self, word):
+		i = bisect.bisect_left(self.words, word)
+		return i < len(self.words) and self.words[i] == word
+	
+	def add(self, word):
+		i = bisect.bisect_left(self.words, word)
+		if i == len(self.words) or self.words[i] != word:
+			self.words.insert(i, word)
+	
+	def remove(self, word):
+		i = bisect.bisect_left(self.words, word)
+		if i < len(self.words) and self.words[i] == word:
+			del self.words[i]
+	
+	def complete(self, prefix):
+		start = bisect.bisect_left(self.words, prefix)
+		end = bisect.bisect_left(self.words, prefix + "\U0010ffff", start)
+		return self.words[start:end]
+
+word_pattern = re.compile(r"\w+")
+
+def text_words(text):
+	return word_pattern.findall(text.lower())
+
+def shown_text(value):
+	"""Text as the editor shows it, or None if the value isn't any."""
+	if type(value) is str:
+		return value
+	elif type(value) in (int, float): # As "set ball name 42" makes.
+		return str(value)
+	else:
+		return None
+
+def query_pattern(term):
+	"""Regex for a search term: a word, phrase, or prefix ending in *."""
+	words = text_words(term)
+	if len(words) < 1:
+		return None, words
+	parts = r"\W+".join(re.escape(i) for i in words)
+	if term.endswith("*"):
+		return re.compile(r"(?<!\w)" + parts + r"\w*"), words
+	else:
+		return re.compile(r"(?<!\w)" + parts + r"(?!\w)"), words
+
+class TextIndex(object):
+	"""Inverted index from words to the objects whose text contains them.
+	
+	Each word maps to a dict of object ids and how many times the word is in
+	their text properties, so it can be taken out again one property at a
+	time. All the words are also kept in a PrefixIndex, for prefix queries.
+	"""
+	
+	def __init__(self, objects=None):
+		self.postings = {}
+		if objects != None:
+			for i in objects:
+				self.add_words(i, objects[i])
+		self.words = PrefixIndex(self.postings)
+	
+	def add_words(self, obj_id, obj):
+		postings = self.postings
+		for prop in text_weights:
+			text = shown_text(obj.get(prop))
+			if text == None:
+				continue
+			for word in text_words(text):
+				bucket = postings.get(word)
+				if bucket == None:
+					postings[word] = {obj_id: 1}
+				else:
+					bucket[obj_id] = bucket.get(obj_id, 0) + 1
+	
+	def add(self, obj_id, prop, value):
+		text = shown_text(value)
+		if prop not in text_weights or text == None:
+			return
+		for word in text_words(text):
+			bucket = self.postings.get(word)
+			if bucket == None:
+				bucket = self.postings[word] = {}
+				self.words.add(word)
+			bucket[obj_id] = bucket.get(obj_id, 0) + 1
+	
+	def remove(self, obj_id, prop, value):
+		text = shown_text(value)
+		if prop not in text_weights or text == None:
+			return
+		for word in text_words(text):
+			bucket = self.postings[word]
+			if bucket[obj_id] > 1:
+				bucket[obj_id] -= 1
+			else:
+				del bucket[obj_id]
+				if len(bucket) == 0:
+					del self.postings[word]
+					self.words.remove(word)
+	
+	def add_object(self, obj_id, obj):
+		for i in obj:
+			self.add(obj_id, i, obj[i])
+	
+	def remove_object(self, obj_id, obj):
+		for i in obj:
+			self.remove(obj_id, i, obj[i])
+	
+	def candidates(self, words, prefix):
+		"""Objects having all the given words, the last maybe as a prefix."""
+		groups = [self.postings.get(i, {}) for i in words]
+		if prefix:
+			groups[-1] = set()
+			for i in self.words.complete(words[-1]):
+				groups[-1].update(self.postings[i])
+		groups.sort(key=len) # Rarest first, to keep the set small.
+		found = set(groups[0])
+		for i in groups[1:]:
+			if len(found) == 0:
+				break
+			found.intersection_update(i)
+		return found
+	
+	def search(self, objects, terms):
+		"""Find objects matching all terms, best first, with where they did.
+		
+		Returns (obj_id, score, props) tuples. The index narrows it down to
+		objects having every word in a term; their text is then checked for
+		the term as a whole, which also gives the score: matches in each
+		property, weighted as per text_weights.
+		"""
+		scores = None
+		where = {}
+		for term in terms:
+			pattern, words = query_pattern(term)
+			if pattern == None:
+				continue
+			prefix = term.endswith("*")
+			found = {}
+			for obj_id in self.candidates(words, prefix):
+				obj = objects[obj_id]
+				score = 0
+				for prop in text_weights:
+					text = shown_text(obj.get(prop))
+					if text == None:
+						continue
+					count = len(pattern.findall(text.lower()))
+					if count > 0:
+						score += count * text_weights[prop]
+						where.setdefault(obj_id, set()).add(prop)
+				if score > 0:
+					found[obj_id] = score
+			if scores == None:
+				scores = found
+			else:
+				scores = {i: scores[i] + found[i]
+					for i in scores if i in found}
+			if len(scores) == 0:
+				break
+		if scores == None:
+			return []
+		results = [(i, scores[i], [j for j in text_weights if j in where[i]])
+			for i in scores]
+		results.sort(key=lambda i: (-i[1], i[0]))
+		return results
+
+record_layouts = {}
+
+def share_layout(layout):
+	"""The one copy of a tuple of keys that records with them all use.
+	
+	Edits can make up new layouts for as long as the editor runs, so past
+	the limit the table is emptied; records keep the tuples they have.
+	"""
+	found = record_layouts.get(layout)
+	if found != None:
+		return found
+	elif len(record_layouts) >= layout_limit:
+		record_layouts.clear()
+	record_layouts[layout] = layout
+	return layout
+
+class Record(collections.abc.MutableMapping):
+	"""A story object that works like a dict, but takes less memory.
+	
+	Common properties get slots, true/false flags share one number, and
+	anything else goes in an overflow dict. Records with the same keys in
+	the same order share one tuple of them, so they print and save in the
+	order they came in, just like a dict would.
+	
+	They aren't dicts, though, so the json module needs to be told how to
+	write them out: json.dump(game, f, default=Record.as_dict).
+	"""
+	
+	__slots__ = record_fields + ("_flags", "_layout", "_extra")
+	
+	def __init__(self, obj=()):
+		if type(obj) is not dict:
+			obj = dict(obj)
+		flags = 0
+		extra = None
+		for key, value in obj.items():
+			if key in record_slots:
+				if type(value) is str and key in interned_fields:
+					value = sys.intern(value)
+				setattr(self, key, value)
+			elif type(value) is bool and key in record_flags:
+				flags |= (1 | value << 1) << record_flags[key]
+			elif extra == None:
+				extra = {key: value}
+			else:
+				extra[key] = value
+		self._flags = flags
+		self._extra = extra
+		self._layout = share_layout(tuple(obj))
+	
+	def _store(self, key, value):
+		if key in interned_fields and type(value) is str:
+			value = sys.intern(value)
+		if key in record_slots:
+			setattr(self, key, value)
+		elif key in record_flags and type(value) is bool:
+			self._flags |= (1 | value << 1) << record_flags[key]
+		elif self._extra == None:
+			self._extra = {key: value}
+		else:
+			self._extra[key] = value
+	
+	def _drop(self, key):
+		if key in record_slots:
+			delattr(self, key)
+		elif key in record_flags and self._flags >> record_flags[key] & 1:
+			self._flags &= ~(3 << record_flags[key])
+		else:
+			del self._extra[key]
+			if len(self._extra) == 0:
+				self._extra = None
+	
+	def __getitem__(self, key):
+		if key not in self._layout:
+			raise KeyError(key)
+		elif key in record_slots:
+			return getattr(self, key)
+		elif self._extra != None and key in self._extra:
+			return self._extra[key]
+		else:
+			return self._flags >> record_flags[key] & 2 != 0
+	
+	def __setitem__(self, key, value):
+		if key in self._layout:
+			self._drop(key)
+		else:
+			self._layout = share_layout(self._layout + (key,))
+		self._store(key, value)
+	
+	def __delitem__(self, key):
+		if key not in self._layout:
+			raise KeyError(key)
+		self._drop(key)
+		self._layout = share_layout(
+			tuple(i for i in self._layout if i != key))
+	
+	def __contains__(self, key):
+		return key in self._layout
+	
+	def __iter__(self):
+		return iter(self._layout)
+	
+	def __len__(self):
+		return len(self._layout)
+	
+	def __repr__(self):
+		return repr(dict(self))
+	
+	def get(self, key, default=None):
+		if key not in self._layout:
+			return default
+		elif key in record_slots:
+			return getattr(self, key)
+		elif self._extra != None and key in self._extra:
+			return self._extra[key]
+		else:
+			return self._flags >> record_flags[key] & 2 != 0
+	
+	def copy(self):
+		return Record(self)
+	
+	def as_dict(self):
+		"""A plain dict of the same, e.g. for json.dump(default=...)."""
+		found = {}
+		extra = self._extra or {}
+		for key in self._layout:
+			if key in record_slots:
+				found[key] = getattr(self, key)
+			elif key in extra:
+				found[key] = extra[key]
+			else:
+				found[key] = self._flags >> record_flags[key] & 2 != 0
+		return found
+
+def record_hook(pairs):
+	"""Turn objects into records as the JSON decoder reads them."""
+	for key, value in pairs:
+		if type(value) is dict or type(value) is Record:
+			return dict(pairs) # A container, not an object.
+	return Record(pairs)
+
+def load_story(data):
+	"""Load a story from bytes, JSON or binary, with objects as records."""
+	if advbin.is_binary(data):
+		game = advbin.loads(data)
+		objs = game["objects"]
+		for i in objs:
+			objs[i] = Record(objs[i])
+	else:
+		game = json.loads(data.decode("utf-8"),
+			object_pairs_hook=record_hook)
+		for i in game:
+			if type(game[i]) is Record: # Meta and config, mostly.
+				game[i] = game[i].as_dict()
+	return game
 
 def parse_value(text):
 	low = text.lower()
@@ -297,6 +724,20 @@ class Editor(cmd.Cmd):
 	
 	def __init__(self):
 		cmd.Cmd.__init__(self)
+		self.index = {}
+		self.text = None
+		self.order = {}
+		self.next_order = 0
+		self.ids = PrefixIndex()
+		self.props = PrefixIndex(object_keys)
+		self.trash_ids = PrefixIndex()
+		self.journal = None
+		self.quiet = False
+		self.line_number = None
+		self.failed = False
+		self.timings = None
+		self.undo_log = collections.deque(maxlen=undo_limit)
+		self.redo_log = collections.deque(maxlen=undo_limit)
 		self.new_game()
 		self.trash = {}
 
@@ -304,19 +745,256 @@ class Editor(cmd.Cmd):
 		self.game = {
 			"meta": new_meta(),
 			"objects": {
-				"limbo": new_room("Limbo"),
-				"hero": new_actor("me", "limbo")
+				"limbo": Record(new_room("Limbo")),
+				"hero": Record(new_actor("me", "limbo"))
 			},
 			"config": new_config()
 		}
+		self.reindex()
 		self.setprop("limbo", "description", "You are in limbo.")
 	
 		self.here = "limbo"
 		self.modified = False
+		self.forget_history()
+	
+	def forget_history(self):
+		self.undo_log.clear()
+		self.redo_log.clear()
+		if self.journal != None:
+			self.journal = []
+	
+	def onecmd(self, line):
+		self.journal = []
+		try:
+			return self.timed_cmd(line)
+		finally:
+			if self.journal:
+				self.undo_log.append((line, self.journal))
+				self.redo_log.clear()
+			self.journal = None
+	
+	def report(self, msg):
+		"""Confirm that a command did its job, unless told to be quiet."""
+		if not self.quiet:
+			print(msg)
+	
+	def error(self, msg):
+		"""Complain about a command, noting where it was in a script."""
+		self.failed = True
+		if self.line_number != None:
+			print("Line {0}: {1}".format(self.line_number, msg),
+				file=sys.stderr)
+		else:
+			print(msg)
+	
+	def run_script(self, lines):
+		"""Run editor commands in bulk, stopping at the first error.
+		
+		Blank lines and comments starting with # are skipped. There is no
+		undo history, since a failed script isn't meant to be saved anyway.
+		"""
+		self.failed = False
+		for number, line in enumerate(lines, 1):
+			line = line.strip()
+			if line == "" or line.startswith("#"):
+				continue
+			self.line_number = number
+			try:
+				stop = self.timed_cmd(line)
+			except Exception as e:
+				self.error(e)
+				stop = False
+			if self.failed:
+				break
+			elif stop:
+				break
+		self.line_number = None
+		return not self.failed
+	
+	def timed_cmd(self, line):
+		"""Run a command, noting how long it took if timing is on."""
+		if self.timings == None:
+			return self.parsed_cmd(line)
+		start = time.perf_counter()
+		try:
+			return self.parsed_cmd(line)
+		finally:
+			elapsed = time.perf_counter() - start
+			name = self.timing_key(line)
+			if name != "timing":
+				self.timings.setdefault(name, []).append(elapsed)
+	
+	def parsed_cmd(self, line):
+		"""Run a command, failing it if its arguments don't parse."""
+		try:
+			return cmd.Cmd.onecmd(self, line)
+		except QuoteError as e:
+			self.error(e)
+	
+	def timing_key(self, line):
+		"""Which command a line counts as, lumping exits and typos together."""
+		name = self.parseline(line)[0]
+		if name in command_aliases:
+			return command_aliases[name]
+		elif name != None and hasattr(self, "do_" + name):
+			return name
+		elif name != None and len(line.split()) == 1:
+			return "go" # The name of an exit, or so default assumes.
+		else:
+			return "default"
+	
+	def timing_stats(self):
+		stats = collections.OrderedDict()
+		for i in sorted(self.timings):
+			samples = sorted(self.timings[i])
+			stats[i] = collections.OrderedDict([
+				("count", len(samples)),
+				("p50", percentile(samples, 50)),
+				("p99", percentile(samples, 99)),
+				("max", samples[-1]),
+				("total", sum(samples))
+			])
+		return stats
+	
+	def record(self, *op):
+		"""Note down how to reverse a change, if a command is running."""
+		if self.journal != None:
+			self.journal.append(op)
+	
+	def replay(self, ops):
+		"""Apply recorded operations backwards, recording their inverse."""
+		for i in range(len(ops) - 1, -1, -1):
+			getattr(self, ops[i][0])(*ops[i][1:])
+		self.modified = True
+		if self.here not in self.game["objects"]:
+			self.here = self.fallback_room()
+			self.report("The room you were in is gone; now at {0}.".format(
+				self.here))
+	
+	def fallback_room(self):
+		"""Somewhere for the viewpoint to go if its room disappears."""
+		objs = self.game["objects"]
+		if "hero" in objs and objs["hero"].get("location") in objs:
+			return objs["hero"]["location"]
+		elif "limbo" in objs:
+			return "limbo"
+		else:
+			return next(iter(objs))
+	
+	def reindex(self):
+		"""Rebuild secondary indexes from scratch, e.g. after a restore."""
+		self.index = {}
+		self.text = None # Built when first searched, which might be never.
+		for i in indexed_keys:
+			self.build_index(i)
+		obj = self.game["objects"]
+		# Where each object comes in the story, as buckets in the index
+		# are in the order objects went in, not the order they're in.
+		self.order = dict(zip(obj, range(len(obj))))
+		self.next_order = len(obj)
+		self.ids = PrefixIndex(obj)
+		props = set(object_keys)
+		for i in obj:
+			props.update(obj[i])
+		self.props = PrefixIndex(props)
+	
+	def build_index(self, prop):
+		table = {}
+		obj = self.game["objects"]
+		for i in obj:
+			value = obj[i].get(prop, missing)
+			if value is not missing:
+				index_insert(table, value, i)
+		self.index[prop] = table
+		return table
+	
+	def text_index(self):
+		if self.text == None:
+			self.text = TextIndex(self.game["objects"])
+		return self.text
 	
 	def find(self, prop, val):
 		obj = self.game["objects"]
-		return [o for o in obj if obj[o].get(prop) == val]
+		if val == None: # Also matches objects without the property.
+			return [o for o in obj if obj[o].get(prop) == val]
+		elif prop in self.index:
+			table = self.index[prop]
+		else:
+			table = self.build_index(prop)
+		try:
+			found = list(table.get(val, ()))
+		except TypeError:
+			return [o for o in obj if obj[o].get(prop) == val]
+		found.sort(key=self.order.__getitem__)
+		return found
+	
+	def add_object(self, obj_id, obj):
+		if type(obj) is dict:
+			obj = Record(obj)
+		self.game["objects"][obj_id] = obj
+		self.order[obj_id] = self.next_order # Goes in last, like a dict.
+		self.next_order += 1
+		for i in obj:
+			if i in self.index:
+				index_insert(self.index[i], obj[i], obj_id)
+		if self.text != None:
+			self.text.add_object(obj_id, obj)
+		self.ids.add(obj_id)
+		self.record("remove_object", obj_id)
+	
+	def remove_object(self, obj_id):
+		obj = self.game["objects"].pop(obj_id)
+		for i in obj:
+			if i in self.index:
+				index_delete(self.index[i], obj[i], obj_id)
+		del self.order[obj_id]
+		if self.text != None:
+			self.text.remove_object(obj_id, obj)
+		self.ids.remove(obj_id)
+		self.record("add_object", obj_id, obj)
+		return obj
+	
+	def assign(self, obj, prop, val):
+		"""Set a property as given, or delete it if val is missing."""
+		target = self.game["objects"][obj]
+		old = target.get(prop, missing)
+		table = self.index.get(prop)
+		if table != None and old is not missing:
+			index_delete(table, old, obj)
+		if self.text != None and old is not missing:
+			self.text.remove(obj, prop, old)
+		if val is missing:
+			del target[prop]
+		else:
+			target[prop] = val
+			if table != None:
+				index_insert(table, val, obj)
+			if self.text != None:
+				self.text.add(obj, prop, val)
+			if old is missing:
+				self.props.add(prop)
+		self.record("assign", obj, prop, old)
+	
+	def set_field(self, section, key, val):
+		"""Set a meta or config field, or delete it if val is missing."""
+		fields = self.game[section]
+		old = fields.get(key, missing)
+		if val is missing:
+			del fields[key]
+		else:
+			fields[key] = val
+		self.record("set_field", section, key, old)
+	
+	def trash_put(self, obj_id, obj):
+		self.trash[obj_id] = obj
+		self.trash_ids.add(obj_id)
+		self.record("trash_take", obj_id)
+	
+	def trash_take(self, obj_id):
+		obj = self.trash.pop(obj_id)
+		self.trash_ids.remove(obj_id)
+		self.record("trash_put", obj_id, obj)
+		return obj
 	
 	def examine(self, obj_id):
 		obj = self.game["objects"][obj_id]
@@ -328,18 +1006,19 @@ class Editor(cmd.Cmd):
 		if obj in self.game["objects"]:
 			target = self.game["objects"][obj]
 			if val != False and val != None and val != "":
-				target[prop] = val
+				self.assign(obj, prop, val)
 			elif prop in target:
-				del target[prop]
+				self.assign(obj, prop, missing)
 		else:
-			print("No such object: {0}".format(obj))
+			self.error("No such object: {0}".format(obj))
 
 	def goto(self, room):
 		if room in self.game["objects"]:
 			self.here = room
-			self.look(self.here)
+			if not self.quiet:
+				self.look(self.here)
 		else:
-			print("Can't go to {0}: no such object".format(room))
+			self.error("Can't go to {0}: no such object".format(room))
 	
 	def look(self, room):
 		where = self.game["objects"][room]
@@ -375,25 +1054,23 @@ class Editor(cmd.Cmd):
 			self.look(self.here)
 		elif args[0] in self.game["objects"]:
 			print(self.game["objects"][args[0]]["description"])
-			for i in self.game["objects"]:
+			for i in self.find("location", args[0]):
 				obj = self.game["objects"][i]
-				if obj["location"] == args[0]:
-					print("\t{0} ({1})".format(obj["name"], i))
-					
+				print("\t{0} ({1})".format(obj["name"], i))
 		else:
-			print("No such object: {0}".format(args[0]))
+			self.error("No such object: {0}".format(args[0]))
 	
 	def do_examine(self, args):
 		"""List all properties of the named object."""
 		args = shell_parse(args)
 		if len(args) < 1:
-			print('Usage: examine here|object-id')
+			self.error('Usage: examine here|object-id')
 		elif args[0] == "here":
 			self.examine(self.here)
 		elif args[0] in self.game["objects"]:
 			self.examine(args[0])
 		else:
-			print("No such object: {0}".format(args[0]))
+			self.error("No such object: {0}".format(args[0]))
 
 	def do_say(self, args):
 		"""Print a newline, message, or an object's property value."""
@@ -411,108 +1088,110 @@ class Editor(cmd.Cmd):
 			if args[1] in obj:
 				print(obj[args[1]], end="")
 		else:
-			print("No such object: {0}".format(args[0]))
+			self.error("No such object: {0}".format(args[0]))
 	
 	def do_dig(self, args):
 		"""Create a new room with given name and ID."""
 		args = shell_parse(args)
 		if len(args) < 2:
-			print('Usage: dig "Room name" room-id')
+			self.error('Usage: dig "Room name" room-id')
 		elif args[1] in self.game["objects"]:
-			print("ID {0} already in use.".format(args[1]))
+			self.error("ID {0} already in use.".format(args[1]))
 		elif args[1] == "here" or args[1] == "me":
-			print("{0} is a reserved word.".format(args[1]))
+			self.error("{0} is a reserved word.".format(args[1]))
 		else:
-			self.game["objects"][args[1]] = new_room(args[0])
+			self.add_object(args[1], new_room(args[0]))
 			self.modified = True
-			print("Room created.")
+			self.report("Room created.")
 	
 	def do_teleport(self, args):
 		"""Move the viewpoint or an object to another location."""
 		args = shell_parse(args)
 		if len(args) < 1:
-			print('Usage: tel [object-id] here|room-id')
+			self.error('Usage: tel [object-id] here|room-id')
 		elif len(args) < 2:
 			if args[0] in self.game["objects"]:
 				self.here = args[0]
-				self.look(self.here)
+				if not self.quiet:
+					self.look(self.here)
 			elif args[0] == "here":
-				print("Nothing to do")
+				self.report("Nothing to do")
 			else:
-				print("No such object: {0}".format(args[0]))
+				self.error("No such object: {0}".format(args[0]))
 		elif args[0] in self.game["objects"]:
 			if args[1] in self.game["objects"]:
 				self.setprop(args[0], "location", args[1])
 				self.modified = True
-				print("Obj. {0} moved to {1}.".format(*args))
+				self.report("Obj. {0} moved to {1}.".format(*args))
 			elif args[1] == "here":
 				self.setprop(args[0], "location", self.here)
 				self.modified = True
-				print("Obj. {0} brought here.".format(args[0]))
+				self.report("Obj. {0} brought here.".format(args[0]))
 			else:
-				print("No such object: {0}.".format(args[1]))
+				self.error("No such object: {0}.".format(args[1]))
 		else:
-			print("No such object: {0}.".format(args[0]))
+			self.error("No such object: {0}.".format(args[0]))
 	
 	def do_name(self, args):
 		"""Change the name of a room or other object."""
 		args = shell_parse(args)
 		if len(args) < 2:
-			print('Usage: name here|object-id "New name"')
+			self.error('Usage: name here|object-id "New name"')
 		elif args[0] == "here":
 			self.setprop(self.here, "name", args[1])
 			self.modified = True
-			print("Room name changed.")
+			self.report("Room name changed.")
 		elif args[0] in self.game["objects"]:
 			self.setprop(args[0], "name", args[1])
 			self.modified = True
-			print("Name of {0} changed.".format(args[0]))
+			self.report("Name of {0} changed.".format(args[0]))
 		else:
-			print("No such object: {0}.".format(args[0]))
+			self.error("No such object: {0}.".format(args[0]))
 	
 	def do_desc(self, args):
 		"""Change the description of a room or other object."""
 		args = shell_parse(args)
 		if len(args) < 2:
-			print('Usage: desc here|object-id "New description"')
+			self.error('Usage: desc here|object-id "New description"')
 		elif args[0] == "here":
 			self.setprop(self.here, "description", args[1])
 			self.modified = True
-			print("Room description changed.")
+			self.report("Room description changed.")
 		elif args[0] in self.game["objects"]:
 			self.setprop(args[0], "description", args[1])
 			self.modified = True
-			print("Description of {0} changed.".format(args[0]))
+			self.report("Description of {0} changed.".format(args[0]))
 		else:
-			print("No such object: {0}.".format(args[0]))
+			self.error("No such object: {0}.".format(args[0]))
 
 	def do_open(self, args):
 		"""Create an exit to another room at the current location."""
 		objs = self.game["objects"]
 		args = shell_parse(args)
 		if len(args) < 2:
-			print('Usage: open "Exit name" exit-id [dest-id]')
+			self.error('Usage: open "Exit name" exit-id [dest-id]')
 		elif args[1] in objs:
-			print("Object {0} already exists.".format(args[1]))
+			self.error("Object {0} already exists.".format(args[1]))
 		elif args[1] == "here" or args[1] == "me":
-			print("{0} is a reserved word.".format(args[1]))
+			self.error("{0} is a reserved word.".format(args[1]))
 		elif len(args) < 3:
-			objs[args[1]] = new_exit(args[0], self.here)
+			self.add_object(args[1], new_exit(args[0], self.here))
 			self.modified = True
-			print("Exit created.")
+			self.report("Exit created.")
 		elif args[2] in objs:
-			objs[args[1]] = new_exit(args[0], self.here)
-			objs[args[1]]["link"] = args[2]
+			exit_obj = new_exit(args[0], self.here)
+			exit_obj["link"] = args[2]
+			self.add_object(args[1], exit_obj)
 			self.modified = True
-			print("Exit created and linked.")
+			self.report("Exit created and linked.")
 		else:
-			print("No such object: {0}.".format(args[2]))
+			self.error("No such object: {0}.".format(args[2]))
 	
 	def do_go(self, args):
 		"""Follow an exit to its destination."""
 		args = shell_parse(args)
 		if len(args) < 1:
-			print('Usage: go exit-name')
+			self.error('Usage: go exit-name')
 			return
 
 		allhere = self.find("location", self.here)
@@ -523,192 +1202,190 @@ class Editor(cmd.Cmd):
 				self.goto(obj["link"])
 				return
 
-		print("You can't go that way.")
+		self.error("You can't go that way.")
 	
 	def do_link(self, args):
 		"""Change the destination of an existing exit or room."""
-		here = self.game["objects"][self.here]
 		args = shell_parse(args)
 		if len(args) < 2:
-			print('Usage: link source-id|here target-id')
+			self.error('Usage: link source-id|here target-id')
 		elif args[1] not in self.game["objects"]:
-			print("No such object: {0}.".format(args[1]))
+			self.error("No such object: {0}.".format(args[1]))
 		elif args[0] == "here":
-			here["link"] = args[1]
+			self.setprop(self.here, "link", args[1])
 			self.modified = True
-			print("Room relinked.")
+			self.report("Room relinked.")
 		elif args[0] in self.game["objects"]:
-			self.game["objects"][args[0]]["link"] = args[1]
+			self.setprop(args[0], "link", args[1])
 			self.modified = True
-			print("Object relinked.")
+			self.report("Object relinked.")
 		else:
-			print("No such object: {0}.".format(args[0]))
+			self.error("No such object: {0}.".format(args[0]))
 	
 	def do_unlink(self, args):
 		"""Remove an exit or room destination."""
-		here = self.game["objects"][self.here]
 		args = shell_parse(args)
 		if len(args) < 1:
-			print('Usage: unlink exit-id|here|room-id')
+			self.error('Usage: unlink exit-id|here|room-id')
 		elif args[0] == "here":
-			del here["link"]
+			self.setprop(self.here, "link", None)
 			self.modified = True
-			print("Room unlinked.")
+			self.report("Room unlinked.")
 		elif args[0] in self.game["objects"]:
-			del self.game["objects"][args[0]]["link"]
+			self.setprop(args[0], "link", None)
 			self.modified = True
-			print("Object unlinked.")
+			self.report("Object unlinked.")
 		else:
-			print("No such object: {0}.".format(args[0]))
+			self.error("No such object: {0}.".format(args[0]))
 	
 	def do_lock(self, args):
 		"""Set a lock on the given object."""
 		args = shell_parse(args)
 		if len(args) < 1:
-			print('Usage 1: lock object-id')
-			print('Usage 2: lock object-id ?vehicleID')
-			print('Usage 3: lock object-id !vehicleID')
-			print('Usage 4: lock object-id +thingID')
-			print('Usage 5: lock object-id -thingID')
-			print('Usage 6: lock object-id @thingID')
-			print('Usage 7: lock object-id ^thingID')
-			print('Usage 8: lock object-id #thingID')
-			print('Usage 9: lock object-id ~thingID')
+			self.error('Usage 1: lock object-id')
+			self.error('Usage 2: lock object-id ?vehicleID')
+			self.error('Usage 3: lock object-id !vehicleID')
+			self.error('Usage 4: lock object-id +thingID')
+			self.error('Usage 5: lock object-id -thingID')
+			self.error('Usage 6: lock object-id @thingID')
+			self.error('Usage 7: lock object-id ^thingID')
+			self.error('Usage 8: lock object-id #thingID')
+			self.error('Usage 9: lock object-id ~thingID')
 		elif args[0] not in self.game["objects"]:
-			print("No such object: {0}.".format(args[1]))
+			self.error("No such object: {0}.".format(args[0]))
 		elif len(args) < 2:
 			self.setprop(args[0], "lock", "+" + args[0])
 			self.modified = True
-			print("Object locked unconditionally.")
+			self.report("Object locked unconditionally.")
 		elif len(args) < 3:
 			keys = ["?", "!", "+", "-", "@", "^", "#", "~"]
 			key_id = args[1][0]
 			obj_id = args[1][1:]
 			
 			if obj_id not in self.game["objects"]:
-				print("No such object: {0}.".format(obj_id))
+				self.error("No such object: {0}.".format(obj_id))
 			elif args[0] not in self.game["objects"]:
-				print("No such object: {0}.".format(args[0]))
+				self.error("No such object: {0}.".format(args[0]))
 			elif key_id not in keys:
-				print("Bad key type: {0}.".format(key_id))
+				self.error("Bad key type: {0}.".format(key_id))
 			else:
 				self.setprop(args[0], "lock", args[1])
-				print("Object locked to given key.")
+				self.report("Object locked to given key.")
 		else:
-			print("Too many lock expressions.")
+			self.error("Too many lock expressions.")
 	
 	def do_unlock(self, args):
 		"""Remove any lock from the given object."""
 		args = shell_parse(args)
 		if len(args) < 1:
-			print('Usage: unlock object-id')
+			self.error('Usage: unlock object-id')
 		elif args[0] in self.game["objects"]:
-			del self.game["objects"][args[0]]["lock"]
+			self.setprop(args[0], "lock", None)
 			self.modified = True
-			print("Object unlocked.")
+			self.report("Object unlocked.")
 		else:
-			print("No such object: {0}.".format(args[0]))
+			self.error("No such object: {0}.".format(args[0]))
 	
 	def do_succ(self, args):
 		"""Change the success message of a room or other object."""
 		args = shell_parse(args)
 		if len(args) < 2:
-			print('Usage: succ here|object-id "New message"')
+			self.error('Usage: succ here|object-id "New message"')
 		elif args[0] == "here":
 			self.setprop(self.here, "success", args[1])
 			self.modified = True
-			print("Room success message changed.")
+			self.report("Room success message changed.")
 		elif args[0] in self.game["objects"]:
 			self.setprop(args[0], "success", args[1])
 			self.modified = True
-			print("Success msg. of {0} changed.".format(args[0]))
+			self.report("Success msg. of {0} changed.".format(args[0]))
 		else:
-			print("No such object: {0}.".format(args[0]))
+			self.error("No such object: {0}.".format(args[0]))
 	
 	def do_fail(self, args):
 		"""Change the failure message of a room or other object."""
 		args = shell_parse(args)
 		if len(args) < 2:
-			print('Usage: fail here|object-id "New message"')
+			self.error('Usage: fail here|object-id "New message"')
 		elif args[0] == "here":
 			self.setprop(self.here, "failure", args[1])
 			self.modified = True
-			print("Room failure message changed.")
+			self.report("Room failure message changed.")
 		elif args[0] in self.game["objects"]:
 			self.setprop(args[0], "failure", args[1])
 			self.modified = True
-			print("Failure msg. of {0} changed.".format(args[0]))
+			self.report("Failure msg. of {0} changed.".format(args[0]))
 		else:
-			print("No such object: {0}.".format(args[0]))
+			self.error("No such object: {0}.".format(args[0]))
 	
 	def do_drop(self, args):
 		"""Change the drop message of a room or other object."""
 		args = shell_parse(args)
 		if len(args) < 2:
-			print('Usage: drop here|object-id "New message"')
+			self.error('Usage: drop here|object-id "New message"')
 		elif args[0] == "here":
 			self.setprop(self.here, "drop", args[1])
 			self.modified = True
-			print("Room drop message changed.")
+			self.report("Room drop message changed.")
 		elif args[0] in self.game["objects"]:
 			self.setprop(args[0], "drop", args[1])
 			self.modified = True
-			print("Drop msg. of {0} changed.".format(args[0]))
+			self.report("Drop msg. of {0} changed.".format(args[0]))
 		else:
-			print("No such object: {0}.".format(args[0]))
+			self.error("No such object: {0}.".format(args[0]))
 	
 	def do_create(self, args):
 		"""Create a thing here."""
 		objs = self.game["objects"]
 		args = shell_parse(args)
 		if len(args) < 2:
-			print('Usage: create "Thing name" thing-id')
+			self.error('Usage: create "Thing name" thing-id')
 		elif args[1] in objs:
-			print("Object {0} already exists.".format(args[1]))
+			self.error("Object {0} already exists.".format(args[1]))
 		elif args[1] == "here" or args[1] == "me":
-			print("{0} is a reserved word.".format(args[1]))
+			self.error("{0} is a reserved word.".format(args[1]))
 		else:
-			objs[args[1]] = new_thing(args[0], self.here)
+			self.add_object(args[1], new_thing(args[0], self.here))
 			self.modified = True
-			print("Thing created.")
+			self.report("Thing created.")
 	
 	def do_clone(self, args):
 		"""Clone an existing object with a different ID."""
 		objs = self.game["objects"]
 		args = shell_parse(args)
 		if len(args) < 2:
-			print('Usage: clone old-id new-id')
+			self.error('Usage: clone old-id new-id')
 		elif args[0] not in self.game["objects"]:
-			print("No such object: {0}.".format(args[0]))
+			self.error("No such object: {0}.".format(args[0]))
 		elif args[1] in objs:
-			print("Object {0} already exists.".format(args[1]))
+			self.error("Object {0} already exists.".format(args[1]))
 		elif args[1] == "here" or args[1] == "me":
-			print("{0} is a reserved word.".format(args[1]))
+			self.error("{0} is a reserved word.".format(args[1]))
 		else:
-			objs[args[1]] = objs[args[0]].copy()
+			self.add_object(args[1], objs[args[0]].copy())
 			self.modified = True
-			print("Object cloned.")
+			self.report("Object cloned.")
 	
 	def do_set(self, args):
 		"""Set a certain flag or property on a given object."""
 		objs = self.game["objects"]
 		args = shell_parse(args)
 		if len(args) < 2:
-			print('Usage 1: set object-id [!]flag-name')
-			print('Usage 2: set object-id prop-name prop-value')
+			self.error('Usage 1: set object-id [!]flag-name')
+			self.error('Usage 2: set object-id prop-name prop-value')
 		elif args[0] not in objs:
-			print("No such object: {0}.".format(args[0]))
+			self.error("No such object: {0}.".format(args[0]))
 		elif len(args) < 3:
 			if args[1][0] != "!":
 				self.setprop(args[0], args[1], True)
-				print("Flag set.")
+				self.report("Flag set.")
 			else:
 				self.setprop(args[0], args[1][1:], False)
-				print("Flag reset.")
+				self.report("Flag reset.")
 			self.modified = True
 		else:
 			self.setprop(args[0], args[1], parse_value(args[2]))
-			print("Property changed.")
+			self.report("Property changed.")
 			self.modified = True
 	
 	def do_find(self, args):
@@ -716,8 +1393,8 @@ class Editor(cmd.Cmd):
 		objs = self.game["objects"]
 		args = shell_parse(args)
 		if len(args) < 1:
-			print('Usage 1: find [!]flag-name')
-			print('Usage 2: find prop-name prop-value')
+			self.error('Usage 1: find [!]flag-name')
+			self.error('Usage 2: find prop-name prop-value')
 		elif len(args) < 2:
 			if args[0][0] != "!":
 				found = self.find(args[0], True)
@@ -732,35 +1409,46 @@ class Editor(cmd.Cmd):
 				name = objs[i]["name"]
 				print("{0} (id: {1})".format(name, i))
 	
+	def do_search(self, args):
+		"""Find objects mentioning words, phrases or prefixes in their text."""
+		args = shell_parse(args)
+		if len(args) < 1:
+			self.error('Usage: search word "some phrase" prefix* ...')
+			return
+		objs = self.game["objects"]
+		for obj_id, score, where in self.text_index().search(objs, args):
+			print("{0} (id: {1}) in {2}".format(
+				objs[obj_id].get("name"), obj_id, ", ".join(where)))
+	
 	def do_recycle(self, args):
 		"""Move an object to the recycle bin."""
 		args = shell_parse(args)
 		if len(args) < 1:
-			print('Usage: recycle object-id')
+			self.error('Usage: recycle object-id')
 		elif args[0] == "here" or args[0] == self.here:
-			print("Can't recycle the room you're in right now.")
+			self.error("Can't recycle the room you're in right now.")
 		elif args[0] == "hero":
-			print("Can't recycle the hero of the story.")
+			self.error("Can't recycle the hero of the story.")
 		elif args[0] == self.game["objects"]["hero"]["location"]:
-			print("Can't recycle the hero's current location.")
+			self.error("Can't recycle the hero's current location.")
 		elif args[0] in self.game["objects"]:
-			self.trash[args[0]] = self.game["objects"][args[0]]
-			del self.game["objects"][args[0]]
+			self.trash_put(args[0], self.remove_object(args[0]))
 			self.modified = True
-			print("Object moved to recycle bin.")
+			self.report("Object moved to recycle bin.")
+		else:
+			self.error("No such object: {0}.".format(args[0]))
 	
 	def do_unrecycle(self, args):
 		"""Bring an object back from the recycle bin."""
 		args = shell_parse(args)
 		if len(args) < 1:
-			print('Usage: unrecycle object-id')
+			self.error('Usage: unrecycle object-id')
 		elif args[0] in self.trash:
-			self.game["objects"][args[0]] = self.trash[args[0]]
-			del self.trash[args[0]]
+			self.add_object(args[0], self.trash_take(args[0]))
 			self.modified = True
-			print("Object brought back from recycle bin.")
+			self.report("Object brought back from recycle bin.")
 		else:
-			print("No such object in the recycle bin.")
+			self.error("No such object in the recycle bin.")
 	
 	def do_meta(self, args):
 		"""List or change game metadata such as title and author."""
@@ -771,15 +1459,15 @@ class Editor(cmd.Cmd):
 				print("{0}: {1}".format(i, meta[i]))
 		elif len(args) < 2:
 			if args[0] in self.game["meta"]:
-				del self.game["meta"][args[0]]
+				self.set_field("meta", args[0], missing)
 				self.modified = True
-				print("Field deleted.")
+				self.report("Field deleted.")
 			else:
-				print("No such field; nothing to do.")
+				self.error("No such field; nothing to do.")
 		else:
-			self.game["meta"][args[0]] = args[1]
+			self.set_field("meta", args[0], args[1])
 			self.modified = True
-			print("Field value changed.")
+			self.report("Field value changed.")
 	
 	def do_config(self, args):
 		"""List or change configuration settings like the banner."""
@@ -793,54 +1481,134 @@ class Editor(cmd.Cmd):
 				print("{0}: {1}".format(
 					args[0], config[args[0]]))
 			else:
-				print("No such setting.")
+				self.error("No such setting.")
 		else:
-			self.game["config"][args[0]] = parse_value(args[1])
+			self.set_field("config", args[0], parse_value(args[1]))
 			self.modified = True
-			print("Field value changed.")
+			self.report("Field value changed.")
 	
 	def do_new(self, args):
 		"""Start over with a blank game."""
 		args = shell_parse(args)
 		if not self.modified:
 			self.new_game();
-			print("New game initialized.")
+			self.report("New game initialized.")
 		elif len(args) > 0 and args[0] == "forced":
 			self.new_game();
-			print("New game initialized.")
+			self.report("New game initialized.")
+		else:
+			self.error("You have an unsaved game in progress.")
+			self.error("Type NEW FORCED to override.")
+	
+	def save_game(self, filename):
+		if filename.endswith(".advb"):
+			with open(filename, "wb") as f:
+				advbin.dump(self.game, f)
 		else:
-			print("You have an unsaved game in progress.")
-			print("Type NEW FORCED to override.")
+			import advc # Brings in its web server too, so not up front.
+			with open(filename, "w") as f:
+				advc.write_story(self.game, f, default=Record.as_dict)
+		self.modified = False
+	
+	def restore_game(self, filename):
+		with open(filename, "rb") as f:
+			game = load_story(f.read())
+		# TO DO: sanity checks
+		game.pop("index", None) # Edits would make it stale.
+		self.game = game
+		self.reindex()
+		self.forget_history()
+		self.here = game["objects"]["hero"]["location"]
+		self.modified = False
 	
 	def do_save(self, args):
 		"""Save current game to disk."""
 		args = shell_parse(args)
 		if len(args) < 1:
-			print('Usage: save <filename>')
+			self.error('Usage: save <filename>')
+		elif self.line_number != None:
+			# Only a script that ran to the end should get saved.
+			self.error("Can't save from a script; use --output instead.")
 		else:
 			try:
-				with open(args[0], "w") as f:
-					json.dump(self.game, f)
-				self.modified = False
-				print("Game saved.")
+				self.save_game(args[0])
+				self.report("Game saved.")
 			except Exception as e:
-				print("Couldn't save game: " + str(e))
+				self.error("Couldn't save game: " + str(e))
 	
 	def do_restore(self, args):
 		"""Restore a game from disk."""
 		args = shell_parse(args)
 		if len(args) < 1:
-			print('Usage: restore <filename>')
+			self.error('Usage: restore <filename>')
 		else:
 			try:
-				with open(args[0], "r") as f:
-					game = json.load(f)
-					# TO DO: sanity checks
-					self.game = game
-					self.here = game["objects"]["hero"]["location"]
-				print("Game restored.")
+				self.restore_game(args[0])
+				self.report("Game restored.")
 			except Exception as e:
-				print("Couldn't restore game: " + str(e))
+				self.error("Couldn't restore game: " + str(e))
+	
+	def do_undo(self, args):
+		"""Take back the last change made to the game."""
+		if len(self.undo_log) < 1:
+			self.error("Nothing to undo.")
+		else:
+			line, ops = self.undo_log.pop()
+			self.journal = []
+			self.replay(ops)
+			self.redo_log.append((line, self.journal))
+			self.journal = []
+			self.report("Undone: {0}".format(line))
+	
+	def do_redo(self, args):
+		"""Make again the last change taken back with undo."""
+		if len(self.redo_log) < 1:
+			self.error("Nothing to redo.")
+		else:
+			line, ops = self.redo_log.pop()
+			self.journal = []
+			self.replay(ops)
+			self.undo_log.append((line, self.journal))
+			self.journal = []
+			self.report("Redone: {0}".format(line))
+	
+	def do_timing(self, args):
+		"""Time commands: timing on|off|show|reset|export <filename>."""
+		args = shell_parse(args)
+		if len(args) < 1 or args[0] not in [
+				"on", "off", "show", "reset", "export"]:
+			self.error('Usage: timing on|off|show|reset|export <filename>')
+		elif args[0] == "on":
+			if self.timings == None:
+				self.timings = {}
+			self.report("Timing on.")
+		elif args[0] == "off":
+			self.timings = None
+			self.report("Timing off.")
+		elif args[0] == "reset":
+			if self.timings != None:
+				self.timings = {}
+			self.report("Timings cleared.")
+		elif self.timings == None:
+			self.error("Timing is off; type TIMING ON first.")
+		elif args[0] == "show":
+			stats = self.timing_stats()
+			print("{0:12s} {1:>7s} {2:>9s} {3:>9s} {4:>9s}".format(
+				"command", "count", "p50 ms", "p99 ms", "max ms"))
+			for i in stats:
+				s = stats[i]
+				print("{0:12s} {1:7d} {2:9.3f} {3:9.3f} {4:9.3f}".format(
+					i, s["count"], s["p50"] * 1000,
+					s["p99"] * 1000, s["max"] * 1000))
+		elif len(args) < 2:
+			self.error('Usage: timing export <filename>')
+		else:
+			try:
+				with open(args[1], "w") as f:
+					json.dump(self.timing_stats(), f, indent=1)
+				self.report("Timings exported.")
+			except Exception as e:
+				self.error("Couldn't export timings: " + str(e))
 	
 	def do_quit(self, args):
 		"""Quit the editor and return to the operating system."""
@@ -850,15 +1618,15 @@ class Editor(cmd.Cmd):
 		elif len(args) > 0 and args[0] == "forced":
 			return True
 		else:
-			print("You have an unsaved game in progress.")
-			print("Type QUIT FORCED to override.")
+			self.error("You have an unsaved game in progress.")
+			self.error("Type QUIT FORCED to override.")
 	
 	def do_shell(self, args):
 		"""Run Python code in a global context, for debugging."""
 		try:
 			exec(args, globals())
 		except Exception as e:
-			print(e)
+			self.error(e)
 	
 	def default(self, line):
 		args = shell_parse(line)
@@ -877,64 +1645,76 @@ class Editor(cmd.Cmd):
 					args[1] + " " + args[2])
 		elif args[0] == "ex":
 			return self.do_examine(args[1])
+		elif args[0] == "grep":
+			return self.do_search(line.partition(" ")[2])
 		elif len(args) == 1:
 			return self.do_go(args[0])
 		else:
-			print("Unknown command: {0}.".format(args[0]))
-	
-	def complete_name(self, text, line, begidx, endidx):
-		return [i for i in self.game["objects"] if i.startswith(text)]
-	
-	def complete_desc(self, text, line, begidx, endidx):
-		return [i for i in self.game["objects"] if i.startswith(text)]
-	
-	def complete_succ(self, text, line, begidx, endidx):
-		return [i for i in self.game["objects"] if i.startswith(text)]
-	
-	def complete_fail(self, text, line, begidx, endidx):
-		return [i for i in self.game["objects"] if i.startswith(text)]
-	
-	def complete_drop(self, text, line, begidx, endidx):
-		return [i for i in self.game["objects"] if i.startswith(text)]
-	
-	def complete_link(self, text, line, begidx, endidx):
-		return [i for i in self.game["objects"] if i.startswith(text)]
-	
-	def complete_unlink(self, text, line, begidx, endidx):
-		return [i for i in self.game["objects"] if i.startswith(text)]
-	
-	def complete_lock(self, text, line, begidx, endidx):
-		return [i for i in self.game["objects"] if i.startswith(text)]
-	
-	def complete_unlock(self, text, line, begidx, endidx):
-		return [i for i in self.game["objects"] if i.startswith(text)]
-	
-	def complete_clone(self, text, line, begidx, endidx):
-		return [i for i in self.game["objects"] if i.startswith(text)]
-	
-	def complete_look(self, text, line, begidx, endidx):
-		return [i for i in self.game["objects"] if i.startswith(text)]
-	
-	def complete_examine(self, text, line, begidx, endidx):
-		return [i for i in self.game["objects"] if i.startswith(text)]
-	
-	def complete_teleport(self, text, line, begidx, endidx):
-		return [i for i in self.game["objects"] if i.startswith(text)]
-	
-	def complete_recycle(self, text, line, begidx, endidx):
-		return [i for i in self.game["objects"] if i.startswith(text)]
-	
-	def complete_unrecycle(self, text, line, begidx, endidx):
-		return [i for i in self.trash if i.startswith(text)]
-	
-	def complete_find(self, text, line, begidx, endidx):
-		return [i for i in object_keys if i.startswith(text)]
-	
-	def complete_meta(self, text, line, begidx, endidx):
-		return [i for i in meta_keys if i.startswith(text)]
-	
-	def complete_config(self, text, line, begidx, endidx):
-		return [i for i in config_keys if i.startswith(text)]
+			self.error("Unknown command: {0}.".format(args[0]))
+	
+	def completedefault(self, text, line, begidx, endidx):
+		args = line[:begidx].split()
+		if len(args) < 1 or args[0] not in completions:
+			return []
+		kinds = completions[args[0]]
+		if len(args) > len(kinds):
+			return []
+		else:
+			return self.complete_arg(kinds[len(args) - 1], text, args[1:])
+	
+	def complete_arg(self, kind, text, args):
+		if kind == "object":
+			found = self.ids.complete(text)
+			if "here".startswith(text):
+				found.append("here")
+			return found
+		elif kind == "room":
+			found = self.complete_type(text, "room")
+			if "here".startswith(text):
+				found.append("here")
+			return found
+		elif kind == "key":
+			if len(text) > 0 and text[0] in lock_types:
+				return [text[0] + i for i in self.ids.complete(text[1:])]
+			else:
+				return [i for i in lock_types if i.startswith(text)]
+		elif kind == "property":
+			if text.startswith("!"):
+				return ["!" + i for i in self.props.complete(text[1:])]
+			else:
+				return self.props.complete(text)
+		elif kind == "value":
+			return self.complete_value(text, args[-1])
+		elif kind == "timing":
+			return [i for i in ["on", "off", "show", "reset", "export"]
+				if i.startswith(text)]
+		elif kind == "trash":
+			return self.trash_ids.complete(text)
+		elif kind == "meta" or kind == "config":
+			keys = set(self.game[kind])
+			keys.update(meta_keys if kind == "meta" else config_keys)
+			return sorted(i for i in keys if i.startswith(text))
+		else:
+			return []
+	
+	def complete_type(self, text, obj_type):
+		"""Complete ids of one type, scanning the smaller of two sets."""
+		found = self.ids.complete(text)
+		of_type = self.index["type"].get(obj_type, {})
+		if len(found) <= len(of_type):
+			return [i for i in found if i in of_type]
+		else:
+			return sorted(i for i in of_type if i.startswith(text))
+	
+	def complete_value(self, text, prop):
+		if prop in ["location", "link"]:
+			return self.ids.complete(text)
+		elif prop in self.index: # Only offer what's there already.
+			return sorted(i for i in self.index[prop]
+				if isinstance(i, str) and i.startswith(text)
+					and len(i.split()) == 1)
+		else:
+			return []
 	
 	def complete_save(self, text, line, begidx, endidx):
 		return glob.glob(text + "*")
@@ -993,6 +1773,591 @@ class Editor(cmd.Cmd):
 	def help_meta(self):
 		print(help_text["meta"])
 
+def run_batch(editor, args):
+	if args.batch == "-":
+		ok = editor.run_script(sys.stdin)
+	else:
+		with open(args.batch) as f:
+			ok = editor.run_script(f)
+	if not ok:
+		print("Script failed; nothing saved.", file=sys.stderr)
+		return 1
+	output = args.output if args.output != None else args.story
+	if output != None:
+		editor.save_game(output)
+	return 0
+
+# Commands a remote client can't use: one runs arbitrary Python, the other
+# would only end the session the server is there to keep.
+rpc_disabled = ["shell", "quit"]
+# On a shared server, also those that would pull the world from under
+# everyone else, or take back changes others have built upon since.
+shared_disabled = rpc_disabled + ["new", "restore", "undo", "redo",
+	"timing"] # Shared by everyone, and can write anywhere.
+
+def capture_command(editor, line):
+	"""Run a command line, returning whether it worked and what it printed."""
+	editor.failed = False
+	output = io.StringIO()
+	stdout = editor.stdout
+	editor.stdout = output # Where cmd.Cmd prints help.
+	try:
+		with contextlib.redirect_stdout(output), \
+				contextlib.redirect_stderr(output):
+			try:
+				editor.onecmd(line)
+			except Exception as e:
+				editor.error(e)
+	finally:
+		editor.stdout = stdout
+	return not editor.failed, output.getvalue()
+
+class RpcError(Exception):
+	def __init__(self, code, message):
+		Exception.__init__(self, message)
+		self.code = code
+
+def rpc_params(params, names):
+	"""Positional or named JSON-RPC parameters, as a list in order."""
+	if params == None:
+		params = []
+	if isinstance(params, list):
+		if len(params) > len(names):
+			raise RpcError(-32602, "Too many parameters")
+		return params + [None] * (len(names) - len(params))
+	elif isinstance(params, dict):
+		for i in params:
+			if i not in names:
+				raise RpcError(-32602, "Unknown parameter: " + i)
+		return [params.get(i) for i in names]
+	else:
+		raise RpcError(-32602, "Parameters must be an array or object")
+
+class EditorService(object):
+	"""Answer JSON-RPC 2.0 requests about the world held by an Editor.
+	
+	Each editor command is a method of the same name, taking its arguments
+	as an array of strings, or the whole line as {"line": ...}; the result
+	says whether it worked and what it printed. The objects.* and fields.*
+	methods answer with data instead of text.
+	"""
+	
+	def __init__(self, editor):
+		self.editor = editor
+		self.queries = {
+			"objects.get": self.get_object,
+			"objects.find": self.find_objects,
+			"objects.list": self.list_objects,
+			"fields.get": self.get_fields
+		}
+	
+	def commands(self):
+		return sorted(i[3:] for i in dir(self.editor)
+			if i.startswith("do_") and i[3:] not in rpc_disabled)
+	
+	def run_command(self, name, params):
+		if isinstance(params, dict) and list(params) == ["line"]:
+			line = name + " " + str(params["line"])
+		elif isinstance(params, list) or params == None:
+			line = " ".join([name] + [shlex.quote(str(i))
+				for i in params or []])
+		else:
+			raise RpcError(-32602, "Expected an array of arguments")
+		ok, output = capture_command(self.editor, line)
+		return {"ok": ok, "output": output}
+	
+	def get_object(self, params):
+		obj_id, = rpc_params(params, ["id"])
+		objs = self.editor.game["objects"]
+		if obj_id == "here":
+			obj_id = self.editor.here
+		if obj_id not in objs:
+			raise RpcError(1, "No such object: {0}".format(obj_id))
+		return {"id": obj_id, "properties": objs[obj_id]}
+	
+	def find_objects(self, params):
+		prop, value = rpc_params(params, ["property", "value"])
+		if not isinstance(prop, str):
+			raise RpcError(-32602, "Property name must be a string")
+		return sorted(self.editor.find(prop, value))
+	
+	def list_objects(self, params):
+		obj_type, location = rpc_params(params, ["type", "location"])
+		objs = self.editor.game["objects"]
+		if location == "here":
+			location = self.editor.here
+		if obj_type != None:
+			found = self.editor.find("type", obj_type)
+			if location != None:
+				found = [i for i in found
+					if objs[i].get("location") == location]
+		elif location != None:
+			found = self.editor.find("location", location)
+		else:
+			found = list(objs)
+		return [{
+			"id": i,
+			"type": objs[i].get("type"),
+			"name": objs[i].get("name"),
+			"location": objs[i].get("location")
+		} for i in sorted(found)]
+	
+	def get_fields(self, params):
+		section, = rpc_params(params, ["section"])
+		if section not in ["meta", "config"]:
+			raise RpcError(-32602, "Section must be meta or config")
+		return self.editor.game[section]
+	
+	def call(self, method, params):
+		if method in self.queries:
+			return self.queries[method](params)
+		elif method in rpc_disabled:
+			raise RpcError(-32601, "Not allowed remotely: " + method)
+		elif method == "commands":
+			return self.commands()
+		elif hasattr(self.editor, "do_" + method):
+			return self.run_command(method, params)
+		else:
+			raise RpcError(-32601, "Method not found: " + method)
+	
+	def handle(self, request):
+		"""The response to one request object, or None for notifications."""
+		if not isinstance(request, dict) or request.get("jsonrpc") != "2.0" \
+				or not isinstance(request.get("method"), str):
+			return {"jsonrpc": "2.0", "id": None, "error": {
+				"code": -32600, "message": "Invalid request"}}
+		try:
+			response = {"jsonrpc": "2.0", "id": request.get("id"),
+				"result": self.call(request["method"],
+					request.get("params"))}
+		except RpcError as e:
+			response = {"jsonrpc": "2.0", "id": request.get("id"),
+				"error": {"code": e.code, "message": str(e)}}
+		except Exception as e:
+			response = {"jsonrpc": "2.0", "id": request.get("id"),
+				"error": {"code": -32603, "message": str(e)}}
+		if "id" not in request:
+			return None
+		return response
+	
+	def handle_line(self, line):
+		"""Reply to one line of JSON text, which may hold a batch."""
+		try:
+			request = json.loads(line)
+		except ValueError as e:
+			reply = {"jsonrpc": "2.0", "id": None, "error": {
+				"code": -32700, "message": "Parse error: " + str(e)}}
+		else:
+			if isinstance(request, list) and len(request) > 0:
+				reply = [self.handle(i) for i in request]
+				reply = [i for i in reply if i != None] or None
+			else:
+				reply = self.handle(request)
+		if reply == None:
+			return None
+		return json.dumps(reply, default=Record.as_dict)
+
+async def rpc_session(service, reader, writer):
+	try:
+		while True:
+			line = await reader.readline()
+			if not line:
+				break
+			elif line.strip() == b"":
+				continue
+			reply = service.handle_line(line)
+			if reply != None:
+				writer.write(reply.encode("utf-8") + b"\n")
+				await writer.drain()
+	except ConnectionError:
+		pass
+	finally:
+		writer.close()
+
+# Only the servers need these, so a plain editor session starts up without.
+async def open_server(address, session):
+	import asyncio
+	import advc
+	if address.startswith("unix:"):
+		return await asyncio.start_unix_server(session,
+			address[5:], limit=2**24)
+	else:
+		host, port = advc.parse_address(address)
+		return await asyncio.start_server(session,
+			host, port, limit=2**24)
+
+def run_server(address, session, background=None):
+	"""Serve on [HOST:]PORT or unix:PATH until interrupted.
+	
+	Open sessions are closed on the way out. If given, background is a
+	coroutine function to run alongside, passed an event set on stopping,
+	and the server waits for it to finish."""
+	import asyncio
+	import signal
+	writers = set()
+	async def tracked(reader, writer):
+		writers.add(writer)
+		try:
+			await session(reader, writer)
+		finally:
+			writers.discard(writer)
+	async def main():
+		server = await open_server(address, tracked)
+		for i in server.sockets:
+			print("Listening on {0}".format(i.getsockname()),
+				file=sys.stderr)
+		stop = asyncio.Event()
+		for i in [signal.SIGINT, signal.SIGTERM]:
+			try:
+				asyncio.get_running_loop().add_signal_handler(i, stop.set)
+			except NotImplementedError:
+				pass # Not on Windows; Ctrl-C still works.
+		task = None
+		if background != None:
+			task = asyncio.ensure_future(background(stop))
+		async with server:
+			await stop.wait()
+			for i in list(writers): # Or newer Pythons wait for them.
+				i.close()
+		if task != None:
+			await task
+	try:
+		asyncio.run(main())
+	except KeyboardInterrupt:
+		pass
+	finally:
+		if address.startswith("unix:") and os.path.exists(address[5:]):
+			os.remove(address[5:])
+
+def serve_rpc(editor, address):
+	"""Keep the editor loaded, answering JSON-RPC over a socket.
+	
+	The address is unix:PATH for a Unix socket, or else [HOST:]PORT, with
+	requests and responses one per line."""
+	service = EditorService(editor)
+	run_server(address,
+		lambda reader, writer: rpc_session(service, reader, writer))
+
+class SharedEditor(Editor):
+	"""An editor for a world that many authors change; see BuildServer.
+	
+	What each command changed is left in self.changes, instead of the undo
+	history. While a snapshot is being saved, objects are copied into it
+	before they change, so it keeps the world as it was when it was taken.
+	"""
+	
+	def __init__(self):
+		self.snapshot = None
+		self.changes = []
+		Editor.__init__(self)
+	
+	def onecmd(self, line):
+		self.journal = []
+		try:
+			return self.timed_cmd(line)
+		finally:
+			self.changes = self.journal
+			self.journal = None
+	
+	def assign(self, obj, prop, val):
+		if self.snapshot != None:
+			self.snapshot.preserve(obj, self.game["objects"][obj])
+		Editor.assign(self, obj, prop, val)
+
+class Snapshot(object):
+	"""The world at one moment, for saving while it goes on changing."""
+	
+	def __init__(self, game):
+		self.order = list(game)
+		self.fields = {}
+		for i in game:
+			if i != "objects":
+				self.fields[i] = game[i].copy() \
+					if isinstance(game[i], dict) else game[i]
+		self.pending = dict(game["objects"])
+		self.frozen = {}
+	
+	def preserve(self, obj_id, obj):
+		"""Keep a copy of an object that's about to change, if needed."""
+		if obj_id not in self.frozen and self.pending.get(obj_id) is obj:
+			self.frozen[obj_id] = obj.copy()
+	
+	def take(self, obj_id):
+		obj = self.pending.pop(obj_id)
+		return self.frozen.pop(obj_id, obj)
+	
+	async def write(self, f, chunk=1000):
+		"""Same output as json.dump, pausing for other tasks now and then."""
+		import asyncio
+		f.write("{")
+		sep = ""
+		for i in self.order:
+			f.write(sep + json.dumps(i) + ": ")
+			if i == "objects":
+				f.write("{")
+				sep2 = ""
+				for n, j in enumerate(list(self.pending)):
+					f.write(sep2 + json.dumps(j) + ": " + json.dumps(
+						self.take(j), default=Record.as_dict))
+					sep2 = ", "
+					if n % chunk == chunk - 1:
+						await asyncio.sleep(0)
+				f.write("}")
+			else:
+				f.write(json.dumps(self.fields[i], default=Record.as_dict))
+			sep = ", "
+		f.write("}")
+
+def write_bytes(path, data):
+	with open(path, "wb") as f:
+		f.write(data)
+
+def changed_ids(ops):
+	"""Objects (or meta and config) touched by a journal of changes."""
+	found = []
+	for i in ops:
+		if i[1] not in found:
+			found.append(i[1])
+	return found
+
+class Author(object):
+	def __init__(self, name, writer, here):
+		self.name = name
+		self.writer = writer
+		self.here = here
+		self.prefix = ""
+		self.suffix = ""
+
+class BuildServer(object):
+	"""Let many authors build one world at the same time, MUSH-style.
+	
+	Authors connect with telnet or a MUD client, and each gets their own
+	viewpoint to run editor commands from. Commands run one at a time, so
+	none sees another half done, and everyone else hears what changed.
+	Changes are saved every so often, a chunk at a time between commands.
+	"""
+	
+	welcome = "Welcome to the Adventure Prompt build server.\n" \
+		+ "Type WHO to see who's here, QUIT to leave.\nYour name? "
+	
+	def __init__(self, editor, path=None, interval=60):
+		import asyncio
+		self.editor = editor
+		self.path = path
+		self.interval = interval
+		self.home = editor.here
+		self.authors = {}
+		self.save_lock = asyncio.Lock()
+	
+	def send(self, author, text):
+		if text == "":
+			return
+		elif author.writer.transport.get_write_buffer_size() > 2**22:
+			author.writer.close() # Not reading; don't wait up for them.
+		else:
+			author.writer.write(text.replace("\n", "\r\n").encode("utf-8"))
+	
+	def tell_others(self, author, text):
+		for i in list(self.authors.values()):
+			if i is not author:
+				self.send(i, text)
+	
+	def who(self):
+		objs = self.editor.game["objects"]
+		lines = []
+		for i in sorted(self.authors):
+			here = self.authors[i].here
+			lines.append("{0}: {1} ({2})".format(
+				i, objs[here].get("name"), here))
+		return "\n".join(lines) + "\n"
+	
+	def check_viewpoints(self):
+		"""Move anyone whose viewpoint was recycled somewhere else."""
+		objs = self.editor.game["objects"]
+		for i in list(self.authors.values()):
+			if i.here not in objs:
+				i.here = self.fallback()
+				self.send(i, "The place you were in is gone. " +
+					"You're now at {0}.\n".format(i.here))
+	
+	def fallback(self):
+		objs = self.editor.game["objects"]
+		if self.home in objs:
+			return self.home
+		elif "hero" in objs and objs["hero"].get("location") in objs:
+			return objs["hero"]["location"]
+		else:
+			return next(iter(objs))
+	
+	def command(self, author, line):
+		"""Run a line from an author, returning what to tell them."""
+		import asyncio
+		editor = self.editor
+		name = (editor.parseline(line)[0] or "").lower()
+		if name in shared_disabled:
+			return "That's not available on a shared server.\n"
+		elif name == "who":
+			return self.who()
+		elif name == "save":
+			asyncio.ensure_future(self.save(author))
+			return "Saving the world.\n"
+		elif name == "outputprefix":
+			author.prefix = line.partition(" ")[2]
+			return ""
+		elif name == "outputsuffix":
+			author.suffix = line.partition(" ")[2]
+			return ""
+		editor.here = author.here
+		ok, output = capture_command(editor, line)
+		author.here = editor.here
+		changed = changed_ids(editor.changes)
+		if len(changed) > 0:
+			self.tell_others(author, "[{0}] {1} (changed: {2})\n".format(
+				author.name, line, ", ".join(changed)))
+			self.check_viewpoints()
+		return output
+	
+	def reply(self, author, text):
+		for i in [author.prefix, text, author.suffix]:
+			if i != "":
+				self.send(author, i if i.endswith("\n") else i + "\n")
+	
+	async def session(self, reader, writer):
+		author = None
+		try:
+			writer.write(self.welcome.replace("\n", "\r\n").encode("utf-8"))
+			while author == None:
+				line = await reader.readline()
+				if not line:
+					return
+				name = line.decode("utf-8", "replace").strip()
+				if len(name.split()) != 1:
+					writer.write(b"One word, please. Your name? ")
+				elif name in self.authors:
+					writer.write(b"Someone by that name is here. Another? ")
+				else:
+					author = Author(name, writer, self.fallback())
+			self.authors[name] = author
+			self.tell_others(author, "{0} has connected.\n".format(name))
+			self.reply(author, self.command(author, "look"))
+			while True:
+				line = await reader.readline()
+				if not line:
+					break
+				line = line.decode("utf-8", "replace").strip()
+				if line == "":
+					continue
+				elif line.lower() in ["quit", "logout"]:
+					break
+				self.reply(author, self.command(author, line))
+				await writer.drain()
+		except ConnectionError:
+			pass
+		finally:
+			if author != None and self.authors.get(author.name) is author:
+				del self.authors[author.name]
+				self.tell_others(author,
+					"{0} has disconnected.\n".format(author.name))
+			writer.close()
+	
+	async def save(self, author=None):
+		"""Save the world, if changed, letting commands run meanwhile."""
+		import asyncio
+		editor = self.editor
+		if self.path == None:
+			if author != None:
+				self.send(author, "There's nowhere to save to.\n")
+			return
+		async with self.save_lock:
+			if not editor.modified:
+				pass
+			else:
+				editor.modified = False
+				tmp_path = self.path + ".tmp"
+				try:
+					if self.path.endswith(".advb"):
+						# Encoded in one go; written out meanwhile.
+						data = advbin.dumps(editor.game)
+						await asyncio.get_running_loop().run_in_executor(
+							None, write_bytes, tmp_path, data)
+					else:
+						editor.snapshot = Snapshot(editor.game)
+						with open(tmp_path, "w") as f:
+							await editor.snapshot.write(f)
+					os.replace(tmp_path, self.path)
+				except Exception as e:
+					editor.modified = True
+					if os.path.exists(tmp_path):
+						os.remove(tmp_path)
+					print("Couldn't save game:", e, file=sys.stderr)
+					return
+				finally:
+					editor.snapshot = None
+		if author != None and author.name in self.authors:
+			self.send(author, "World saved.\n")
+	
+	async def autosave(self, stop):
+		"""Save every so often, and once more on the way out."""
+		import asyncio
+		while not stop.is_set():
+			try:
+				await asyncio.wait_for(stop.wait(), self.interval)
+			except asyncio.TimeoutError:
+				pass
+			await self.save()
+
+def serve_shared(editor, address, path=None, interval=60):
+	"""Run a build server for the world in editor; see BuildServer."""
+	server = BuildServer(editor, path, interval)
+	run_server(address, server.session, server.autosave)
+
 if __name__ == "__main__":
-	editor = Editor()
+	import argparse
+	
+	parser = argparse.ArgumentParser(
+		description="Author interactive fiction interactively.")
+	parser.add_argument("story", nargs="?",
+		help="story file to restore before starting")
+	parser.add_argument("-b", "--batch", metavar="SCRIPT",
+		help="run editor commands from a file (- for stdin) and exit")
+	parser.add_argument("-o", "--output", metavar="FILE",
+		help="where to save after a batch, or while sharing "
+			+ "(default: the story file)")
+	parser.add_argument("-v", "--verbose", action="store_true",
+		help="show confirmations while running a batch")
+	parser.add_argument("--rpc", metavar="ADDRESS",
+		help="serve JSON-RPC requests on [HOST:]PORT or unix:PATH")
+	parser.add_argument("--share", metavar="ADDRESS",
+		help="let many authors build at once, telnet to [HOST:]PORT")
+	parser.add_argument("--autosave", type=float, default=60,
+		metavar="SECONDS", help="how often a shared world is saved")
+	args = parser.parse_args()
+	if [args.batch, args.rpc, args.share].count(None) < 2:
+		parser.error("--batch, --rpc and --share don't go together")
+	
+	editor = Editor() if args.share == None else SharedEditor()
+	try:
+		if args.story != None:
+			editor.restore_game(args.story)
+		if args.batch != None:
+			editor.quiet = not args.verbose
+			sys.exit(run_batch(editor, args))
+		elif args.rpc != None:
+			serve_rpc(editor, args.rpc)
+			sys.exit(0)
+		elif args.share != None:
+			output = args.output if args.output != None else args.story
+			if output == None:
+				print("Warning: no story file, so nothing will be saved.",
+					file=sys.stderr)
+			serve_shared(editor, args.share, output, args.autosave)
+			sys.exit(0)
+	except Exception as e:
+		print("Error:", e, file=sys.stderr)
+		sys.exit(1)
+	
+	try: # Allow completing ids with dashes and lock expressions.
+		readline.set_completer_delims(" \t\n\"'")
+	except NameError:
+		pass
 	editor.cmdloop()
@@ -3,8 +3,381 @@
 
 from __future__ import print_function
 
+import io
+import re
+import json
+import hashlib
 import configparser
 
+import advc
+import advbin
+
+# Bump this whenever the delta save format changes.
+delta_version = 1
+
+whitespace = re.compile(r"[ \t\n\r]*")
+
+class StoryReader(object):
+	"""Decode a JSON story a piece at a time from a text file.
+	
+	Only as much of the file as the value being decoded is kept in memory,
+	so objects can be handled one by one however big the story is.
+	"""
+	
+	def __init__(self, f, chunk_size=65536):
+		self.f = f
+		self.chunk_size = chunk_size
+		self.buf = ""
+		self.pos = 0
+		self.start = 0
+		self.eof = False
+		self.decoder = json.JSONDecoder()
+	
+	def fill(self):
+		# Read at least as much as we have, so retrying the decoding of
+		# a big value doesn't take quadratic time.
+		size = max(self.chunk_size, len(self.buf) - self.pos)
+		data = self.f.read(size)
+		if data == "":
+			self.eof = True
+		self.buf = self.buf[self.pos:] + data
+		self.pos = 0
+	
+	def peek(self):
+		while True:
+			self.pos = whitespace.match(self.buf, self.pos).end()
+			if self.pos < len(self.buf):
+				return self.buf[self.pos]
+			elif self.eof:
+				return ""
+			self.fill()
+	
+	def expect(self, chars):
+		c = self.peek()
+		if c == "" or c not in chars:
+			raise ValueError("Expected {0} but found {1}".format(
+				" or ".join(repr(i) for i in chars),
+				repr(c) if c != "" else "the end"))
+		self.pos += 1
+		return c
+	
+	def value(self):
+		self.peek()
+		while True:
+			self.start = self.pos
+			try:
+				value, end = self.decoder.raw_decode(self.buf, self.pos)
+				# A number might go on in the next chunk.
+				if end < len(self.buf) or self.eof:
+					self.pos = end
+					return value
+			except ValueError:
+				if self.eof:
+					raise
+			self.fill()
+	
+	def text(self):
+		"""The source text of the value just decoded."""
+		return self.buf[self.start:self.pos]
+	
+	def members(self):
+		"""Yield the keys of an object, leaving the reader at each value."""
+		self.expect("{")
+		if self.peek() == "}":
+			self.pos += 1
+			return
+		while True:
+			key = self.value()
+			if type(key) != str:
+				raise ValueError("Object keys must be strings")
+			self.expect(":")
+			yield key
+			if self.expect(",}") == "}":
+				return
+
+def iter_story(f, fingerprints=False):
+	"""Yield (section, obj_id, value) for a JSON story, in file order.
+	
+	Each object in the story comes as ("objects", obj_id, obj); every
+	other top-level field as (name, None, value). With fingerprints, a
+	hash of the value's source text is added to each.
+	"""
+	reader = StoryReader(f)
+	for i in reader.members():
+		if i == "objects" and reader.peek() == "{":
+			for j in reader.members():
+				value = reader.value()
+				if fingerprints:
+					yield (i, j, value, fingerprint(reader.text()))
+				else:
+					yield (i, j, value)
+		else:
+			value = reader.value()
+			if fingerprints:
+				yield (i, None, value, fingerprint(reader.text()))
+			else:
+				yield (i, None, value)
+	if reader.peek() != "":
+		raise ValueError("Extra data after the story")
+
+def fingerprint(text):
+	return hashlib.sha1(text.encode("utf-8")).digest()
+
+def iter_game(game):
+	"""Same as iter_story, for a story already in memory."""
+	for i in game:
+		if i == "objects":
+			for j in game[i]:
+				yield (i, j, game[i][j])
+		else:
+			yield (i, None, game[i])
+
+def open_story(f):
+	"""Events for a story file opened in binary mode, JSON or not."""
+	if advbin.is_binary(f.peek(len(advbin.magic))):
+		return iter_game(advbin.load(f))
+	else:
+		return iter_story(io.TextIOWrapper(f, encoding="utf-8"))
+
+def story_fingerprints(path):
+	"""Yield (section, obj_id, value, fingerprint) from a story file.
+	
+	Equal fingerprints mean equal values; different ones might still
+	turn out equal when compared, e.g. if one file was minified.
+	"""
+	with open(path, "rb") as f:
+		if advbin.is_binary(f.peek(len(advbin.magic))):
+			for i in iter_game(advbin.load(f)):
+				yield i + (fingerprint(json.dumps(i[2])),)
+		else:
+			text = io.TextIOWrapper(f, encoding="utf-8")
+			for i in iter_story(text, fingerprints=True):
+				yield i
+			text.detach()
+
+def same_value(a, b):
+	"""Compare story values like JSON does, telling 1 from 1.0 and true."""
+	if type(a) is not type(b):
+		return False
+	elif type(a) is dict:
+		return a.keys() == b.keys() and all(same_value(a[i], b[i]) for i in a)
+	elif type(a) is list:
+		return len(a) == len(b) and all(map(same_value, a, b))
+	else:
+		return a == b
+
+def diff_dicts(old, new):
+	"""Keys added, removed and changed between two dictionaries."""
+	diff = {"added": {}, "removed": {}, "changed": {}}
+	for i in old:
+		if i not in new:
+			diff["removed"][i] = old[i]
+		elif not same_value(old[i], new[i]):
+			diff["changed"][i] = [old[i], new[i]]
+	for i in new:
+		if i not in old:
+			diff["added"][i] = new[i]
+	return diff
+
+def diff_stories(old_path, new_path):
+	"""Compare two stories, reading each object of the old one twice.
+	
+	The first pass only keeps a fingerprint per object, so unchanged
+	objects are skipped without comparing them and without holding the
+	old story in memory. The second fetches the old version of objects
+	that changed or went away.
+	"""
+	old_prints = {}
+	old_fields = {}
+	for section, obj_id, value, print_ in story_fingerprints(old_path):
+		if obj_id != None:
+			old_prints[obj_id] = print_
+		else:
+			old_fields[section] = value
+	added = {}
+	changed = {}
+	new_fields = {}
+	for section, obj_id, value, print_ in story_fingerprints(new_path):
+		if obj_id == None:
+			new_fields[section] = value
+		elif obj_id not in old_prints:
+			added[obj_id] = value
+		elif old_prints.pop(obj_id) != print_:
+			changed[obj_id] = value
+		# else unchanged; the remaining prints are for removed objects
+	removed = {}
+	if len(changed) > 0 or len(old_prints) > 0:
+		for section, obj_id, value, print_ in story_fingerprints(old_path):
+			if obj_id in old_prints:
+				removed[obj_id] = value
+			elif obj_id in changed:
+				obj_diff = diff_dicts(value, changed[obj_id])
+				if obj_diff == diff_dicts({}, {}):
+					del changed[obj_id] # Same, written differently.
+				else:
+					changed[obj_id] = obj_diff
+	
+	diff = {}
+	for i in ["meta", "config"]:
+		diff[i] = diff_dicts(old_fields.pop(i, {}), new_fields.pop(i, {}))
+	old_fields.pop("objects", None)
+	new_fields.pop("objects", None)
+	diff["other"] = diff_dicts(old_fields, new_fields)
+	diff["objects"] = {"added": added, "removed": removed, "changed": changed}
+	return diff
+
+def write_diff(diff, f):
+	"""Describe a story diff for people, one line per change."""
+	for i in ["meta", "config", "other"]:
+		section = diff[i]
+		for j in section["added"]:
+			print("{0}: +{1}: {2!r}".format(
+				i, j, section["added"][j]), file=f)
+		for j in section["removed"]:
+			print("{0}: -{1} (was {2!r})".format(
+				i, j, section["removed"][j]), file=f)
+		for j in section["changed"]:
+			print("{0}: {1}: {2!r} -> {3!r}".format(
+				i, j, *section["changed"][j]), file=f)
+	objs = diff["objects"]
+	for i in objs["added"]:
+		print("+ {0} ({1}: {2})".format(i, objs["added"][i].get("type"),
+			objs["added"][i].get("name")), file=f)
+	for i in objs["removed"]:
+		print("- {0} ({1}: {2})".format(i, objs["removed"][i].get("type"),
+			objs["removed"][i].get("name")), file=f)
+	for i in objs["changed"]:
+		obj = objs["changed"][i]
+		for j in obj["added"]:
+			print("~ {0}: +{1}: {2!r}".format(
+				i, j, obj["added"][j]), file=f)
+		for j in obj["removed"]:
+			print("~ {0}: -{1} (was {2!r})".format(
+				i, j, obj["removed"][j]), file=f)
+		for j in obj["changed"]:
+			print("~ {0}: {1}: {2!r} -> {3!r}".format(
+				i, j, *obj["changed"][j]), file=f)
+	print("{0} objects added, {1} removed, {2} changed.".format(
+		len(objs["added"]), len(objs["removed"]), len(objs["changed"])),
+		file=f)
+
+def story_id(path):
+	"""Identify a story by its IFID and a hash of its whole content.
+	
+	The hash covers every field and object in file order, written out in
+	a canonical way, so JSON and binary copies of a story hash the same.
+	"""
+	h = hashlib.sha256()
+	ifid = None
+	for section, obj_id, value, print_ in story_fingerprints(path):
+		if section == "meta" and obj_id == None:
+			ifid = value.get("ifid")
+		h.update(json.dumps([section, obj_id, value], sort_keys=True,
+			separators=(",", ":")).encode("utf-8"))
+	return {"ifid": ifid, "sha256": h.hexdigest()}
+
+def delta_section(diff):
+	section = {}
+	values = dict(diff["added"])
+	for i in diff["changed"]:
+		values[i] = diff["changed"][i][1]
+	if len(values) > 0:
+		section["set"] = values
+	if len(diff["removed"]) > 0:
+		section["unset"] = list(diff["removed"])
+	return section
+
+def make_delta(base_path, save_path):
+	"""Describe a save file by how it differs from the base story."""
+	diff = diff_stories(base_path, save_path)
+	delta = {"delta": delta_version, "base": story_id(base_path)}
+	for i, j in [("meta", "meta"), ("config", "config"), ("other", "fields")]:
+		section = delta_section(diff[i])
+		if len(section) > 0:
+			delta[j] = section
+	objs = diff["objects"]
+	values = dict(objs["added"])
+	unset = {}
+	for i in objs["changed"]:
+		obj = objs["changed"][i]
+		props = dict(obj["added"])
+		for j in obj["changed"]:
+			props[j] = obj["changed"][j][1]
+		if len(props) > 0:
+			values[i] = props
+		if len(obj["removed"]) > 0:
+			unset[i] = list(obj["removed"])
+	delta["objects"] = {"set": values, "unset": unset,
+		"removed": list(objs["removed"])}
+	return delta
+
+def apply_delta(game, delta):
+	"""Change a base story in place into the save described by delta."""
+	for i in ["meta", "config"]:
+		if i in delta:
+			fields = game.setdefault(i, {})
+			fields.update(delta[i].get("set", {}))
+			for j in delta[i].get("unset", []):
+				fields.pop(j, None)
+	if "fields" in delta:
+		game.update(delta["fields"].get("set", {}))
+		for i in delta["fields"].get("unset", []):
+			game.pop(i, None)
+	objs = game["objects"]
+	changes = delta.get("objects", {})
+	for i in changes.get("removed", []):
+		objs.pop(i, None)
+	values = changes.get("set", {})
+	for i in values:
+		objs.setdefault(i, {}).update(values[i])
+	unset = changes.get("unset", {})
+	for i in unset:
+		for j in unset[i]:
+			objs[i].pop(j, None)
+	return game
+
+def check_base(delta, base_path):
+	if type(delta) != dict or delta.get("delta") != delta_version:
+		raise ValueError("not a delta save, or an unsupported version")
+	found = story_id(base_path)
+	if found["ifid"] != delta["base"]["ifid"]:
+		raise ValueError("delta save is for another story (IFID {0})"
+			.format(delta["base"]["ifid"]))
+	elif found["sha256"] != delta["base"]["sha256"]:
+		raise ValueError("story has changed since the delta was made")
+
+def expand_delta(base_path, delta):
+	"""Rebuild the full save from a delta, after checking the base."""
+	check_base(delta, base_path)
+	with open(base_path, "rb") as f:
+		game = advbin.load_any(f.read())
+	return apply_delta(game, delta)
+
+def stream_stats(events):
+	type_count = {}
+	for section, obj_id, obj in events:
+		if obj_id != None:
+			t = obj["type"]
+			type_count[t] = type_count.get(t, 0) + 1
+	return type_count
+
+def write_events(events, f):
+	"""Write a story as config sections, one object at a time.
+	
+	Gives the same sections as game2config, but in file order.
+	"""
+	interpolation = configparser.BasicInterpolation()
+	for section, obj_id, value in events:
+		if obj_id != None:
+			advc.write_section(obj_id, [(i, advc.config_value(value[i]))
+				for i in value], f, interpolation)
+		elif section == "meta":
+			advc.write_section("META", [(i, str(value[i]))
+				for i in value], f, interpolation)
+		elif section == "config":
+			advc.write_section("CONFIG", [(i, advc.config_value(value[i]))
+				for i in value], f, interpolation)
+
 def story_stats(game_data):
 	type_count = {}
 	for i in game_data["objects"]:
@@ -41,32 +414,67 @@ def game2config(game):
 
 if __name__ == "__main__":
 	import sys
-	import json
 	import argparse
 
 	pargs = argparse.ArgumentParser(prog="disadvent.py",
 		description="Decompile Adventure Prompt story files.")
 	pargs.add_argument("-v", "--version", action="version",
 		version="%(prog)s version 2018-03-22")
-	pargs.add_argument("-s", "--stats", action="store_true",
+	group = pargs.add_mutually_exclusive_group()
+	group.add_argument("-s", "--stats", action="store_true",
 		help="output statistics instead of decompiling")
-	pargs.add_argument("story", type=argparse.FileType('r'), nargs=1,
-		help="story file to decompile")
+	group.add_argument("-j", "--json", action="store_true",
+		help="output the story as JSON, e.g. to convert a binary one")
+	pargs.add_argument("-d", "--diff", nargs=2, metavar=("OLD", "NEW"),
+		help="compare two stories or saves instead (--json for JSON)")
+	pargs.add_argument("--delta", nargs=2, metavar=("BASE", "SAVE"),
+		help="output the difference between a save and its story")
+	pargs.add_argument("--expand", nargs=2, metavar=("BASE", "DELTA"),
+		help="turn a delta save back into a full save file")
+	pargs.add_argument("story", type=argparse.FileType('rb'), nargs="?",
+		help="story file to decompile, either JSON or binary")
 	args = pargs.parse_args()
+	modes = [i for i in [args.diff, args.delta, args.expand] if i != None]
+	if len(modes) > 1:
+		pargs.error("--diff, --delta and --expand don't go together")
+	elif len(modes) > 0:
+		if args.story != None or args.stats:
+			pargs.error("give only the files for the option")
+		elif args.json and args.diff == None:
+			pargs.error("--delta and --expand always output JSON")
+	elif args.story == None:
+		pargs.error("a story file is required")
 
 	try:
-		game_data = json.load(args.story[0])
-		args.story[0].close()
-
 		# TO DO: sanity checks?
-		if args.stats:
-			stats = story_stats(game_data)
+		if args.diff != None:
+			diff = diff_stories(*args.diff)
+			if args.json:
+				json.dump(diff, sys.stdout, indent=1)
+				print()
+			else:
+				write_diff(diff, sys.stdout)
+			sys.exit(0)
+		elif args.delta != None:
+			json.dump(make_delta(*args.delta), sys.stdout,
+				separators=(",", ":"))
+			sys.exit(0)
+		elif args.expand != None:
+			with open(args.expand[1], "r", encoding="utf-8") as f:
+				delta = json.load(f)
+			json.dump(expand_delta(args.expand[0], delta), sys.stdout)
+			sys.exit(0)
+		elif args.stats:
+			stats = stream_stats(open_story(args.story))
 			print("Object count by type:")
 			for i in stats:
 				print("{0:10s}: {1:3d}".format(i, stats[i]))
 			print("Total:    {0:5d}".format(sum(stats.values())))
+		elif args.json:
+			game_data = advbin.load_any(args.story.read())
+			json.dump(game_data, sys.stdout)
 		else:
-			output = game2config(game_data)
-			output.write(sys.stdout)
+			write_events(open_story(args.story), sys.stdout)
+		args.story.close()
 	except Exception as e:
 		print("Couldn't read story file: " + str(e), file=sys.stderr)
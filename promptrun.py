@@ -0,0 +1,650 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""Play Adventure Prompt stories without a browser, by promptrun.html rules."""
+
+from __future__ import print_function
+
+import json
+import collections
+
+Action = collections.namedtuple("Action", "verb target actor label")
+
+absent = object() # Marks properties an object didn't have to begin with.
+
+text_fields = ["name", "description", "initial",
+	"success", "failure", "drop", "nodrop"]
+
+def unpack_strings(game_data):
+	"""Put back text that advc.py --minify moved to a shared table."""
+	strings = game_data.pop("strings", None)
+	if strings == None:
+		return
+	for i in game_data["objects"].values():
+		for j in text_fields:
+			if type(i.get(j)) in (int, float):
+				i[j] = strings[int(i[j])]
+
+def index_group(obj):
+	if obj.get("type") == "exit":
+		return "exits"
+	elif obj.get("type") == "action":
+		return "actions"
+	else:
+		return "contents"
+
+def make_index(objects):
+	"""Precompute what promptrun.html would search every object for.
+	
+	Lists contents, exits and actions by location, in story order, and the
+	light sources, which can't stop being ones in play. The runner keeps it
+	up to date as objects move, so it's valid in save files too."""
+	index = {"contents": {}, "exits": {}, "actions": {}, "lights": []}
+	for i in objects:
+		obj = objects[i]
+		group = index_group(obj)
+		if obj.get("location") != None:
+			index[group].setdefault(obj["location"], []).append(i)
+		if group == "contents" and obj.get("light"):
+			index["lights"].append(i)
+	return index
+
+def success_message(obj):
+	if obj.get("ending"):
+		if obj.get("success"):
+			return "*** " + obj["success"] + " ***"
+		else:
+			return "*** The End ***"
+	else:
+		return obj.get("success") or ""
+
+class Game(object):
+	def __init__(self, game_data):
+		unpack_strings(game_data)
+		# Same job as self.children; made again on saving.
+		self.indexed = game_data.pop("index", None) != None
+		self.game = game_data
+		self.objects = game_data["objects"]
+		self.order = {}
+		self.children = {}
+		for i in self.objects:
+			self.order[i] = len(self.order)
+			loc = self.objects[i].get("location")
+			self.children.setdefault(loc, {})[i] = True
+
+		self.base = {}
+		self.changes = {}
+		self.journal = None
+		self.ending = None
+		self.described = None
+		self.verso = []
+		self.recto = []
+
+		meta = game_data["meta"]
+		if "turns" in meta: # A save file; carry on from there.
+			meta["turns"] = int(meta["turns"])
+			meta["score"] = int(meta.get("score", 0))
+			self.refresh()
+		else:
+			config = game_data["config"]
+			if config.get("max_score"):
+				config["max_score"] = int(config["max_score"])
+			meta["turns"] = 0
+			meta["score"] = 0
+			self.refresh(config.get("banner"))
+
+	def assign(self, obj_id, prop, val):
+		"""Change a property, keeping track of what differs from the start."""
+		obj = self.objects[obj_id]
+		key = (obj_id, prop)
+		if key not in self.base:
+			self.base[key] = obj.get(prop, absent)
+		if self.journal != None:
+			self.journal.append((key, obj.get(prop, absent)))
+		if prop == "location":
+			old = obj.get("location")
+			if old in self.children:
+				self.children[old].pop(obj_id, None)
+			self.children.setdefault(
+				None if val is absent else val, {})[obj_id] = True
+		if val is absent:
+			obj.pop(prop, None)
+		else:
+			obj[prop] = val
+		old = self.base[key]
+		if val is old or (val == old and type(val) == type(old)):
+			self.changes.pop(key, None)
+		else:
+			self.changes[key] = val
+
+	def save_data(self):
+		"""The game data to save, indexed if the story came that way."""
+		if not self.indexed:
+			return self.game
+		data = dict(self.game)
+		data["index"] = make_index(self.objects)
+		return data
+
+	def move(self, obj_id, loc):
+		self.assign(obj_id, "location", loc)
+
+	def setprop(self, obj_id, prop, val):
+		self.assign(obj_id, prop, val)
+
+	def snapshot(self):
+		"""Return a compact, hashable encoding of the game state.
+		
+		The turn counter isn't part of it, so the same situation reached
+		along different paths gives the same snapshot."""
+		return (frozenset(self.changes.items()),
+			self.game["meta"]["score"], self.ending, self.described)
+
+	def restore(self, state):
+		"""Go back to a snapshot, at a cost proportional to the changes."""
+		changes, score, ending, described = state
+		target = dict(changes)
+		for key in list(self.changes):
+			if key not in target:
+				self.assign(key[0], key[1], self.base[key])
+		for key in target:
+			if self.changes.get(key, absent) is not target[key]:
+				self.assign(key[0], key[1], target[key])
+		self.game["meta"]["score"] = score
+		self.ending = ending
+		self.described = described
+		if self.journal != None:
+			del self.journal[:]
+
+	def rollback(self, journal, state):
+		"""Undo recent changes, as recorded in the journal, to a snapshot.
+		
+		Cheaper than restore when only a few properties changed."""
+		for i in range(len(journal) - 1, -1, -1):
+			key, val = journal[i]
+			self.assign(key[0], key[1], val)
+		del journal[:]
+		self.game["meta"]["score"] = state[1]
+		self.ending = state[2]
+		self.described = state[3]
+
+	def find_children(self, loc):
+		found = self.children.get(loc, ())
+		return sorted(found, key=self.order.get)
+
+	def find_objects_in(self, loc):
+		objs = self.objects
+		return [i for i in self.find_children(loc)
+			if objs[i].get("type") not in ("exit", "action")]
+
+	def room_here(self):
+		me = self.objects["hero"]
+		if self.objects[me["location"]].get("type") == "vehicle":
+			return self.objects[me["location"]]["location"]
+		else:
+			return me["location"]
+
+	def room_has_light(self, room_id):
+		if not self.objects[room_id].get("dark"):
+			return True
+		for i in self.find_objects_in("hero"):
+			if self.objects[i].get("light"):
+				return True
+		for i in self.find_objects_in(room_id):
+			if self.objects[i].get("light"):
+				return True
+		return False
+
+	def pass_lock(self, actor_id, obj):
+		if "lock" not in obj:
+			return True
+		lock = obj["lock"]
+		if not isinstance(lock, str) or len(lock) < 1:
+			raise ValueError("Bad lock: " + str(lock))
+		key_id = lock[1:]
+		if lock[0] == "?":
+			return key_id == actor_id
+		elif lock[0] == "!":
+			return key_id != actor_id
+		key = self.objects[key_id]
+		if lock[0] == "+":
+			return key.get("location") == actor_id
+		elif lock[0] == "-":
+			return key.get("location") != actor_id
+		elif lock[0] == "@":
+			return bool(key.get("visited"))
+		elif lock[0] == "^":
+			return not key.get("visited")
+		elif lock[0] == "#":
+			return not key.get("dark")
+		elif lock[0] == "~":
+			return bool(key.get("dark"))
+		else:
+			raise ValueError("Bad lock type: " + lock[0])
+
+	def score_object(self, obj_id):
+		obj = self.objects[obj_id]
+		if obj.get("score") and not obj.get("visited"):
+			self.game["meta"]["score"] += int(obj["score"])
+
+	def refresh(self, verso_msg=None, recto_msg=None):
+		"""Redraw the pages, including side effects of looking around."""
+		self.verso = [verso_msg] if verso_msg else []
+		self.described = None
+		self.recto = [recto_msg] if recto_msg else []
+		room_id = self.room_here()
+		self.lit = self.room_has_light(room_id)
+		if self.lit:
+			self.score_object(room_id)
+			self.first_look = not self.objects[room_id].get("visited")
+			self.setprop(room_id, "visited", True)
+
+	def room_text(self, room_id):
+		here = self.objects[room_id]
+		if not self.lit:
+			return (here.get("failure")
+				or "It's too dark to see much at all.")
+		elif self.first_look and here.get("initial"):
+			text = [here["initial"]]
+		else:
+			text = [here.get("description") or ""]
+		text.append(success_message(here))
+		return "\n\n".join(i for i in text if i)
+
+	def object_description(self, obj_id):
+		obj = self.objects[obj_id]
+		if not obj.get("visited") and obj.get("initial"):
+			return obj["initial"]
+		elif obj.get("description"):
+			return obj["description"]
+		else:
+			return "You see nothing special."
+
+	def object_actions(self, obj_id):
+		obj = self.objects[obj_id]
+		hero = self.objects["hero"]
+		found = []
+		t = obj.get("type")
+		if t == "thing":
+			found.append(Action("look", obj_id, None, "look"))
+			if obj.get("location") == "hero":
+				found.append(Action("drop", obj_id, None, "drop"))
+			else:
+				found.append(Action("take", obj_id, None, "take"))
+		elif t == "scenery":
+			found.append(Action("look", obj_id, None, "look"))
+			if obj.get("link"):
+				found.append(Action("exit", obj_id, "hero", "enter"))
+		elif t == "vehicle":
+			found.append(Action("look", obj_id, None, "look"))
+			if hero["location"] == obj_id:
+				found.append(Action(
+					"get_off", obj_id, None, "get off"))
+			else:
+				found.append(Action(
+					"get_on", obj_id, None, "get on"))
+		elif t == "text":
+			found.append(Action("read", obj_id, None, "read"))
+		elif t == "spell":
+			if obj.get("location") == "hero":
+				found.append(Action("cast", obj_id, None, "cast"))
+			else:
+				found.append(Action("learn", obj_id, None, "learn"))
+		for i in self.find_children(obj_id):
+			obj2 = self.objects[i]
+			if obj2.get("type") == "action" and not obj2.get("dark"):
+				found.append(Action(
+					"action", i, None, obj2.get("name")))
+		return found
+
+	def exit_actions(self, room_id):
+		objs = self.objects
+		if objs[room_id].get("type") == "vehicle":
+			actor = room_id
+			room_id = objs[room_id]["location"]
+		else:
+			actor = "hero"
+		is_dark = not self.room_has_light(room_id)
+		found = []
+		for i in self.find_children(room_id):
+			obj = objs[i]
+			if obj.get("type") != "exit":
+				continue
+			elif obj.get("dark"):
+				continue
+			elif is_dark and not obj.get("light"):
+				continue
+			found.append(Action("exit", i, actor, obj.get("name")))
+		return found
+
+	def actions(self):
+		"""List everything the player could click on right now."""
+		if self.ending != None:
+			return []
+		found = []
+		room_id = self.room_here()
+		here = self.objects[room_id]
+		if self.room_has_light(room_id):
+			for i in self.find_objects_in(room_id):
+				if i != "hero":
+					found.extend(self.object_actions(i))
+		if not here.get("ending"):
+			found.extend(self.exit_actions(
+				self.objects["hero"]["location"]))
+		if self.described != None:
+			for i in self.find_objects_in(self.described):
+				if self.objects[i].get("type") != "topic":
+					found.extend(self.object_actions(i))
+			for i in self.find_objects_in(self.described):
+				if self.objects[i].get("type") == "topic":
+					found.append(Action("topic", i, None,
+						self.objects[i].get("name")))
+		use_spells = self.game["config"].get("use_spells")
+		for i in self.find_objects_in("hero"):
+			if self.objects[i].get("type") != "spell":
+				found.extend(self.object_actions(i))
+		if use_spells:
+			for i in self.find_objects_in("hero"):
+				if self.objects[i].get("type") == "spell":
+					found.extend(self.object_actions(i))
+		return found
+
+	def apply(self, action):
+		"""Apply an action as returned by actions()."""
+		getattr(self, "handle_" + action.verb)(action.target, action.actor)
+
+	def perform(self, action):
+		"""Apply an action and return the resulting text."""
+		self.apply(action)
+		return self.text()
+
+	def action_text(self, action):
+		if action.verb in ("exit", "action", "topic"):
+			return action.label
+		else:
+			name = self.objects[action.target].get("name")
+			return "{0} {1}".format(action.label, name)
+
+	def end_game(self, obj_id):
+		self.ending = obj_id
+
+	def handle_look(self, obj_id, actor_id):
+		self.game["meta"]["turns"] += 1
+		if self.room_has_light(self.room_here()):
+			msg = self.object_description(obj_id)
+			self.refresh(None, msg)
+			self.described = obj_id
+		else:
+			self.refresh(None, "It's too dark to see much at all.")
+
+	def handle_take(self, obj_id, actor_id):
+		obj = self.objects[obj_id]
+		if self.pass_lock("hero", obj):
+			self.score_object(obj_id)
+			self.move(obj_id, "hero")
+			self.setprop(obj_id, "visited", True)
+			msg = obj.get("success") or "Taken."
+		elif obj.get("failure"):
+			msg = obj["failure"]
+		else:
+			msg = "You can't seem to pick that up."
+		self.game["meta"]["turns"] += 1
+		self.refresh(None, msg)
+
+	def handle_drop(self, obj_id, actor_id):
+		obj = self.objects[obj_id]
+		room_id = self.objects["hero"]["location"]
+		here = self.objects[room_id]
+		if obj.get("sticky"):
+			msg = (obj.get("nodrop")
+				or "You try to drop that, but can't seem to.")
+		elif here.get("sticky"):
+			msg = (here.get("nodrop")
+				or "You try to drop that, but can't seem to.")
+		else:
+			self.move(obj_id, here.get("link") or room_id)
+			msg = obj.get("drop") or "Dropped."
+			if here.get("drop"):
+				msg += " " + here["drop"]
+		self.game["meta"]["turns"] += 1
+		self.refresh(None, msg)
+
+	def handle_get_on(self, obj_id, actor_id):
+		obj = self.objects[obj_id]
+		if self.pass_lock("hero", obj):
+			self.score_object(obj_id)
+			self.move("hero", obj_id)
+			self.setprop(obj_id, "visited", True)
+			msg = (obj.get("success")
+				or "You get on the {0}.".format(obj.get("name")))
+		elif obj.get("failure"):
+			msg = obj["failure"]
+		else:
+			msg = "You can't seem to get on the {0}.".format(
+				obj.get("name"))
+		self.game["meta"]["turns"] += 1
+		self.refresh(None, msg)
+
+	def handle_get_off(self, obj_id, actor_id):
+		obj = self.objects[obj_id]
+		self.move("hero", obj["location"])
+		self.game["meta"]["turns"] += 1
+		self.refresh(None, "You get off the {0}.".format(obj.get("name")))
+
+	def handle_read(self, obj_id, actor_id):
+		obj = self.objects[obj_id]
+		self.game["meta"]["turns"] += 1
+		if self.room_has_light(self.room_here()):
+			self.score_object(obj_id)
+			self.setprop(obj_id, "visited", True)
+			if obj.get("link"):
+				self.setprop(obj["link"], "dark", False)
+			msg = "\n\n".join(i for i in
+				[obj.get("description"), success_message(obj)] if i)
+		else:
+			msg = "It's too dark in here to read."
+		self.refresh(None, msg)
+		if obj.get("ending"):
+			self.end_game(obj_id)
+
+	def handle_action(self, obj_id, actor_id):
+		obj = self.objects[obj_id]
+		self.game["meta"]["turns"] += 1
+		if self.pass_lock("hero", obj):
+			self.score_object(obj_id)
+			self.setprop(obj_id, "visited", True)
+			if obj.get("link"):
+				target = self.objects[obj["link"]]
+				self.setprop(obj["link"], "dark",
+					not target.get("dark"))
+			if not obj.get("sticky"):
+				self.setprop(obj_id, "dark", True)
+			msg = success_message(obj)
+		else:
+			msg = obj.get("failure")
+		self.refresh(None, msg)
+
+	def handle_learn(self, obj_id, actor_id):
+		self.score_object(obj_id)
+		self.move(obj_id, "hero")
+		self.setprop(obj_id, "visited", True)
+		self.game["meta"]["turns"] += 1
+		self.refresh(None, "You seem to have learned a new spell!")
+
+	def handle_cast(self, obj_id, actor_id):
+		obj = self.objects[obj_id]
+		if self.pass_lock("hero", obj):
+			if obj.get("link"):
+				target = self.objects[obj["link"]]
+				if target.get("type") == "room":
+					self.score_object(obj["link"])
+					self.move("hero", obj["link"])
+				else:
+					self.move(obj["link"], self.room_here())
+			self.setprop(obj_id, "visited", True)
+			msg = success_message(obj)
+		else:
+			msg = obj.get("failure")
+		self.game["meta"]["turns"] += 1
+		self.refresh(None, msg)
+
+	def handle_topic(self, obj_id, actor_id):
+		obj = self.objects[obj_id]
+		described = None
+		if self.pass_lock("hero", obj):
+			self.score_object(obj_id)
+			self.setprop(obj_id, "visited", True)
+			if obj.get("link"):
+				self.setprop(obj["link"], "dark", False)
+			msg = self.object_description(obj_id)
+			described = obj_id
+		else:
+			msg = obj.get("failure")
+		self.game["meta"]["turns"] += 1
+		self.refresh(None, msg)
+		self.described = described
+
+	def handle_exit(self, exit_id, actor_id):
+		exit_obj = self.objects[exit_id]
+		if exit_obj.get("visited") and exit_obj.get("sticky"):
+			self.pass_through(exit_id, actor_id)
+		elif self.pass_lock(actor_id, exit_obj):
+			self.pass_through(exit_id, actor_id)
+		elif exit_obj.get("failure"): # Nothing else changes on screen.
+			self.verso.append(exit_obj["failure"])
+
+	def pass_through(self, exit_id, actor_id):
+		exit_obj = self.objects[exit_id]
+		self.move(actor_id, exit_obj["link"])
+		self.setprop(exit_id, "visited", True)
+		self.game["meta"]["turns"] += 1
+		self.refresh(success_message(exit_obj))
+		link = self.objects[exit_obj["link"]]
+		if exit_obj.get("ending"):
+			self.end_game(exit_id)
+		elif link.get("ending"):
+			self.end_game(exit_obj["link"])
+
+	def status_line(self):
+		meta = self.game["meta"]
+		config = self.game["config"]
+		line = "Moves: {0}".format(meta["turns"])
+		if config.get("use_score"):
+			line = "Score: {0}/{1}  {2}".format(
+				meta["score"], config.get("max_score") or "?", line)
+		return line
+
+	def name_list(self, ids):
+		if len(ids) > 0:
+			return ", ".join(self.objects[i].get("name") for i in ids)
+		else:
+			return "Nothing."
+
+	def text(self):
+		"""Render both pages of the book as plain text."""
+		objs = self.objects
+		me = objs["hero"]
+		room_id = self.room_here()
+		here = objs[room_id]
+		page = [self.status_line()] + self.verso
+		if room_id != me["location"]:
+			page.append("{0} (on the {1})".format(
+				here.get("name"), objs[me["location"]].get("name")))
+		else:
+			page.append(here.get("name"))
+		page.append(self.room_text(room_id))
+		if self.room_has_light(room_id):
+			found = [i for i in self.find_objects_in(room_id)
+				if i != "hero"]
+			if len(found) > 0:
+				page.append("You see: " + self.name_list(found))
+		if not here.get("ending"):
+			page.append("Which way now? " + ", ".join(a.label
+				for a in self.exit_actions(me["location"])))
+
+		page.extend(self.recto)
+		if self.described != None:
+			found = [i for i in self.find_objects_in(self.described)
+				if objs[i].get("type") != "topic"]
+			if len(found) > 0:
+				page.append(self.name_list(found))
+		page.append("{0}: {1}".format(me.get("name"), me.get("description")))
+		carried = self.find_objects_in("hero")
+		page.append("You are carrying: " + self.name_list([i for i in
+			carried if objs[i].get("type") != "spell"]))
+		if self.game["config"].get("use_spells"):
+			page.append("Spells you know: " + self.name_list([i for i in
+				carried if objs[i].get("type") == "spell"]))
+		return "\n\n".join(i for i in page if i)
+
+def load(f):
+	return Game(json.load(f))
+
+def benchmark(game_text, turns, seed=None):
+	import random
+	import time
+
+	rng = random.Random(seed)
+	game = Game(json.loads(game_text))
+	start = time.time()
+	for i in range(turns):
+		choices = game.actions()
+		if len(choices) == 0: # Story ended; play it again.
+			game = Game(json.loads(game_text))
+			choices = game.actions()
+		game.perform(rng.choice(choices))
+	return turns / (time.time() - start)
+
+if __name__ == "__main__":
+	import sys
+	import argparse
+
+	pargs = argparse.ArgumentParser(prog="promptrun.py",
+		description="Play an Adventure Prompt story in the terminal.")
+	pargs.add_argument("-b", "--bench", type=int, metavar="TURNS",
+		help="time random play for the given number of turns instead")
+	pargs.add_argument("--seed", type=int,
+		help="random seed for the benchmark")
+	pargs.add_argument("story", type=argparse.FileType('r'), nargs=1,
+		help="story or save file to play")
+	args = pargs.parse_args()
+
+	try:
+		game_text = args.story[0].read()
+		args.story[0].close()
+		if args.bench != None:
+			speed = benchmark(game_text, args.bench, args.seed)
+			print("{0:.0f} turns per second".format(speed))
+			sys.exit(0)
+		game = Game(json.loads(game_text))
+	except Exception as e:
+		print("Couldn't load story file: " + str(e), file=sys.stderr)
+		sys.exit(1)
+
+	print(game.text())
+	while True:
+		choices = game.actions()
+		print()
+		for i in range(len(choices)):
+			print("{0:3d}. {1}".format(
+				i + 1, game.action_text(choices[i])))
+		if game.ending != None:
+			print("The story is over. (Type SAVE <file> or QUIT.)")
+		try:
+			line = input("\n> ").split()
+		except EOFError:
+			break
+		if len(line) < 1:
+			continue
+		elif line[0] == "quit":
+			break
+		elif line[0] == "save" and len(line) > 1:
+			with open(line[1], "w") as f:
+				json.dump(game.save_data(), f)
+			print("Game saved.")
+		elif line[0] == "restart":
+			game = Game(json.loads(game_text))
+			print(game.text())
+		elif line[0].isdigit() and 0 < int(line[0]) <= len(choices):
+			print(game.perform(choices[int(line[0]) - 1]))
+		else:
+			print("Type the number of an action, SAVE, RESTART or QUIT.")
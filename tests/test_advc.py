@@ -0,0 +1,346 @@
+import os
+import sys
+import io
+import json
+import shutil
+import contextlib
+import configparser
+import tempfile
+import threading
+import http.client
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import advc
+import promptrun
+import advbin
+
+top = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+def source_file(text, name):
+	f = io.StringIO(text)
+	f.name = name
+	return f
+
+def compile_sources(sources):
+	game = advc.new_game()
+	for i in sources:
+		advc.merge_source(i, game)
+	return game
+
+class ParserTest(unittest.TestCase):
+	def test_same_as_configparser(self):
+		for name in ["wizard-away.ini", "advprompt-book.ini"]:
+			with open(os.path.join(top, "wizard-away", name)) as f:
+				text = f.read()
+			sections, lines = advc.parse_ini(text, name)
+			self.assertEqual(sections,
+				advc.parse_configparser(text, name), name)
+	
+	def test_continuation_and_comments(self):
+		text = "# comment\n[room]\nname = Hall\n; another\n" + \
+			"description = One\n\tTwo\n\n\tThree\n"
+		sections, lines = advc.parse_ini(text)
+		self.assertEqual(sections, advc.parse_configparser(text))
+		self.assertEqual(lines["room"]["description"], 5)
+	
+	def test_error_has_line_number(self):
+		with self.assertRaises(configparser.ParsingError) as cm:
+			advc.parse_ini("[room]\nname = Hall\nno equals sign\n", "x.ini")
+		self.assertEqual(cm.exception.errors[0][0], 3)
+	
+	def test_bad_value_has_line_number(self):
+		source = advc.parse_source("[ball]\nname = ball\nscore = lots\n",
+			"bad.ini")
+		with self.assertRaises(ValueError) as cm:
+			compile_sources([source])
+		self.assertTrue(str(cm.exception).startswith("bad.ini:3:"))
+
+class CacheTest(unittest.TestCase):
+	def setUp(self):
+		self.tmp = tempfile.mkdtemp()
+	
+	def tearDown(self):
+		shutil.rmtree(self.tmp)
+	
+	def test_cached_same_as_parsed(self):
+		with open(os.path.join(top, "wizard-away", "wizard-away.ini")) as f:
+			text = f.read()
+		first = advc.read_sources([source_file(text, "a.ini")], self.tmp)
+		self.assertEqual(len(os.listdir(self.tmp)), 1)
+		second = advc.read_sources([source_file(text, "a.ini")], self.tmp)
+		self.assertEqual(first, second)
+	
+	def test_damaged_entry_parsed_again(self):
+		text = "[hall]\ntype = room\nname = Hall\n"
+		first = advc.read_sources([source_file(text, "a.ini")], self.tmp)
+		path = advc.cache_path(text, self.tmp)
+		with open(path, "w") as f:
+			f.write('{"file": ')
+		second = advc.read_sources([source_file(text, "a.ini")], self.tmp)
+		self.assertEqual(first, second)
+		with open(path) as f:
+			self.assertEqual(json.load(f), first[0])
+	
+	def test_parsers_kept_apart(self):
+		text = "[hall]\ntype = room\nname = Hall\n"
+		self.assertNotEqual(advc.cache_path(text, self.tmp),
+			advc.cache_path(text, self.tmp, fast=False))
+		self.assertNotEqual(advc.cache_path(text, self.tmp),
+			advc.cache_path(text + "\n", self.tmp))
+	
+	def test_cached_keeps_file_name(self):
+		text = "[ball]\nname = ball\nscore = lots\n"
+		advc.read_sources([source_file(text, "bad.ini")], self.tmp)
+		parsed = advc.read_sources([source_file(text, "other.ini")],
+			self.tmp)
+		self.assertEqual(parsed[0]["file"], "other.ini")
+		with self.assertRaises(ValueError) as cm:
+			compile_sources(parsed)
+		self.assertTrue(str(cm.exception).startswith("other.ini:3:"))
+
+class SolveTest(unittest.TestCase):
+	def setUp(self):
+		self.tmp = tempfile.mkdtemp()
+		self.source = os.path.join(top, "wizard-away", "wizard-away.ini")
+		with open(self.source) as f:
+			self.game = compile_sources([advc.parse_source(f.read())])
+	
+	def tearDown(self):
+		shutil.rmtree(self.tmp)
+	
+	def test_sources_are_not_compiled(self):
+		self.assertEqual(advc.load_compiled(self.source), None)
+	
+	def test_compiled_story_solves_the_same(self):
+		expected = advc.solve_story(self.game, 3000)
+		path = os.path.join(self.tmp, "story.advb")
+		with open(path, "wb") as f:
+			advbin.dump(advc.minify_story(self.game), f)
+		solution = advc.solve_story(advc.load_compiled(path), 3000)
+		self.assertEqual(solution["states"], expected["states"])
+		self.assertEqual(solution["best"][1], expected["best"][1])
+		path = os.path.join(self.tmp, "story.json")
+		with open(path, "w") as f:
+			advc.write_story(self.game, f)
+		solution = advc.solve_story(advc.load_compiled(path), 3000)
+		self.assertEqual(solution["states"], expected["states"])
+
+	def test_report_whole_scores(self):
+		game = json.loads(json.dumps(self.game))
+		game["config"]["max_score"] = 25.0 # As compiled stories have it.
+		out = io.StringIO()
+		with contextlib.redirect_stdout(out):
+			advc.report_solution(game, advc.solve_story(game, 3000))
+		self.assertRegex(out.getvalue(), r"Highest score: \d+ of 25\.\n")
+
+class BatchTest(unittest.TestCase):
+	def setUp(self):
+		self.tmp = tempfile.mkdtemp()
+		source = os.path.join(top, "wizard-away", "wizard-away.ini")
+		for i in ["", "a", "b"]:
+			os.makedirs(os.path.join(self.tmp, i), exist_ok=True)
+			shutil.copy(source, os.path.join(self.tmp, i))
+			# Something to tell each project apart by.
+			with open(os.path.join(self.tmp, i, "more.ini"), "w") as f:
+				f.write("[extra-{0}]\ntype = scenery\n".format(i))
+				f.write("name = extra\nlocation = limbo\n")
+	
+	def tearDown(self):
+		shutil.rmtree(self.tmp)
+	
+	def build(self):
+		results, elapsed = advc.batch_build(self.tmp, self.tmp, None, 2,
+			check=False, merge=True, minify=False, binary=False,
+			cache=None, index=False, fast=True)
+		return sorted((i["project"], i["objects"]) for i in results)
+	
+	def test_merge_into_source_tree(self):
+		first = self.build()
+		self.assertEqual(len(first), 3)
+		self.assertTrue(all(i[1] > 0 for i in first))
+		self.assertEqual(self.build(), first)
+
+class OutputTest(unittest.TestCase):
+	def setUp(self):
+		self.tmp = tempfile.mkdtemp()
+		self.path = os.path.join(self.tmp, "story.json")
+	
+	def tearDown(self):
+		shutil.rmtree(self.tmp)
+	
+	def test_writes_file(self):
+		advc.write_output(self.path, advc.write_story, {"objects": {}})
+		with open(self.path) as f:
+			self.assertEqual(json.load(f), {"objects": {}})
+		self.assertEqual(os.listdir(self.tmp), ["story.json"])
+	
+	def test_no_leftovers_on_error(self):
+		def broken(f):
+			f.write(b"{" if "b" in f.mode else "{")
+			raise ValueError("oops")
+		for binary in [False, True]:
+			with self.assertRaises(ValueError):
+				advc.write_output(self.path, broken, binary=binary)
+			self.assertEqual(os.listdir(self.tmp), [])
+
+class Stop(Exception):
+	pass
+
+class WatchTest(unittest.TestCase):
+	def setUp(self):
+		self.tmp = tempfile.mkdtemp()
+		self.paths = []
+		for name in ["wizard-away.ini", "advprompt-book.ini"]:
+			path = os.path.join(self.tmp, name)
+			shutil.copy(os.path.join(top, "wizard-away", name), path)
+			self.paths.append(path)
+		self.template = os.path.join(self.tmp, "promptrun.html")
+		shutil.copy(os.path.join(top, "promptrun.html"), self.template)
+	
+	def tearDown(self):
+		shutil.rmtree(self.tmp)
+	
+	def edit(self, path, old, new):
+		with open(path) as f:
+			text = f.read()
+		with open(path, "w") as f:
+			f.write(text.replace(old, new, 1))
+	
+	def test_burst_is_one_call(self):
+		calls = []
+		def callback(changed):
+			calls.append(changed)
+			raise Stop()
+		def saves():
+			time.sleep(0.2)
+			for i in range(3):
+				self.edit(self.paths[1], "\n[", "\n; Save {0}\n[".format(i))
+				time.sleep(0.03)
+			self.edit(self.paths[0], "\n[", "\n; Saved too\n[")
+		writer = threading.Thread(target=saves)
+		writer.start()
+		try:
+			with self.assertRaises(Stop):
+				advc.watch_files(self.paths, callback,
+					interval=0.02, settle=0.5)
+		finally:
+			writer.join()
+		self.assertEqual(calls, [self.paths])
+	
+	def test_only_changes_parsed(self):
+		build = advc.LiveBuild(self.paths, self.template)
+		build.update(build.paths)
+		self.assertEqual(build.parsed, 2)
+		template = build.template
+		self.assertNotEqual(template, None)
+		self.edit(self.paths[1], "name = Adventure Prompt", "name = AP")
+		game = build.update([self.paths[1]])
+		self.assertEqual(build.parsed, 1)
+		self.assertIs(build.template, template)
+		self.assertEqual(game["objects"]["advprompt"]["name"], "AP")
+		sources = []
+		for i in self.paths:
+			with open(i) as f:
+				sources.append(advc.parse_source(f.read()))
+		expected = compile_sources(sources)
+		advc.sanity_check(expected)
+		self.assertEqual(game["objects"], expected["objects"])
+		self.assertEqual(game["config"], expected["config"])
+	
+	def test_bad_build_kept_out(self):
+		build = advc.LiveBuild(self.paths)
+		build.update(build.paths)
+		self.edit(self.paths[0], "location = study\n", "location = nowhere\n")
+		err = io.StringIO()
+		with contextlib.redirect_stderr(err):
+			self.assertEqual(build.update([self.paths[0]]), None)
+		self.assertIn("nowhere", err.getvalue())
+		self.assertIn("keeping the last good build", err.getvalue())
+	
+	def test_run_rebuilds_on_change(self):
+		build = advc.LiveBuild(self.paths, self.template)
+		names = []
+		def callback(game):
+			names.append(game["objects"]["advprompt"]["name"])
+			if len(names) == 1:
+				threading.Timer(0.2, self.edit, [self.paths[1],
+					"name = Adventure Prompt", "name = AP"]).start()
+			else:
+				raise KeyboardInterrupt() # Like Ctrl-C, to stop watching.
+			return "story.html"
+		err = io.StringIO()
+		with contextlib.redirect_stderr(err):
+			build.run(callback)
+		self.assertEqual(names, ["Adventure Prompt", "AP"])
+		self.assertIn("Built story.html (2 parsed)", err.getvalue())
+
+class ServeTest(unittest.TestCase):
+	def setUp(self):
+		with open(os.path.join(top, "wizard-away", "wizard-away.ini")) as f:
+			self.game = compile_sources([advc.parse_source(f.read())])
+		with open(os.path.join(top, "promptrun.html")) as f:
+			self.template = advc.split_template(f.read())
+		self.server = advc.StoryServer(("127.0.0.1", 0))
+		thread = threading.Thread(target=self.server.serve_forever)
+		thread.daemon = True
+		thread.start()
+	
+	def tearDown(self):
+		self.server.shutdown()
+		self.server.server_close()
+	
+	def get(self, path, etag=None):
+		conn = http.client.HTTPConnection(*self.server.server_address[:2],
+			timeout=5)
+		headers = {} if etag == None else {"If-None-Match": etag}
+		conn.request("GET", path, headers=headers)
+		response = conn.getresponse()
+		body = response.read()
+		conn.close()
+		return response.status, response.getheader("ETag"), body
+	
+	def test_pages(self):
+		self.assertEqual(self.get("/")[0], 503) # Nothing built yet.
+		self.server.publish(self.game, self.template, index=True)
+		status, etag, body = self.get("/")
+		self.assertEqual(status, 200)
+		self.assertIn(b"var game_data = {", body)
+		self.assertIn(advc.reload_script.encode("utf-8"), body)
+		status, story_etag, body = self.get("/story.json")
+		story = json.loads(body.decode("utf-8"))
+		self.assertEqual(story["objects"], self.game["objects"])
+		self.assertEqual(story["index"],
+			promptrun.make_index(self.game["objects"]))
+		self.assertNotEqual(story_etag, etag)
+		self.assertEqual(self.get("/other")[0], 404)
+	
+	def test_conditional_get(self):
+		self.server.publish(self.game, self.template)
+		status, etag, body = self.get("/")
+		self.assertEqual(self.get("/", etag), (304, etag, b""))
+		self.assertEqual(self.get("/", '"other", ' + etag)[0], 304)
+		self.game["objects"]["study"]["name"] = "Renamed"
+		self.server.publish(self.game, self.template)
+		status, new_etag, body = self.get("/", etag)
+		self.assertEqual(status, 200)
+		self.assertNotEqual(new_etag, etag)
+		self.assertIn(b"Renamed", body)
+	
+	def test_reload_event(self):
+		self.server.publish(self.game, self.template)
+		conn = http.client.HTTPConnection(*self.server.server_address[:2],
+			timeout=5)
+		conn.request("GET", "/events")
+		response = conn.getresponse()
+		self.assertEqual(response.getheader("Content-Type"),
+			"text/event-stream")
+		self.server.publish(self.game, self.template)
+		self.assertEqual(response.fp.readline(), b"data: reload\n")
+		self.assertEqual(response.fp.readline(), b"\n")
+		conn.close()
+
+if __name__ == "__main__":
+	unittest.main()
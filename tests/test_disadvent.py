@@ -0,0 +1,130 @@
+import os
+import sys
+import io
+import copy
+import json
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import advbin
+import disadvent
+
+top = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+def load_sample(name):
+	with open(os.path.join(top, name)) as f:
+		return json.load(f)
+
+def make_save(game):
+	"""A copy of the story as if someone played it a little."""
+	save = copy.deepcopy(game)
+	objs = save["objects"]
+	objs["hero"]["location"] = "tent"
+	objs["lantern"]["location"] = "hero"
+	objs["lantern"]["visited"] = True
+	del objs["ball"]["drop"]
+	del objs["map"]
+	objs["note"] = {"type": "text", "name": "note", "location": "tent"}
+	save["meta"]["title"] = "Changed"
+	save["turns"] = 12
+	return save
+
+class StoryTest(unittest.TestCase):
+	def setUp(self):
+		self.tmp = tempfile.mkdtemp()
+		self.game = load_sample("starry.json")
+		self.base = self.write("base.json", self.game)
+	
+	def tearDown(self):
+		shutil.rmtree(self.tmp)
+	
+	def write(self, name, game, binary=False):
+		path = os.path.join(self.tmp, name)
+		if binary:
+			with open(path, "wb") as f:
+				advbin.dump(game, f)
+		else:
+			with open(path, "w") as f:
+				json.dump(game, f, indent=1)
+		return path
+
+class StreamTest(StoryTest):
+	def test_same_as_loading(self):
+		with open(self.base, "rb") as f:
+			streamed = list(disadvent.open_story(f))
+		self.assertEqual(streamed, list(disadvent.iter_game(self.game)))
+		path = self.write("base.advb", self.game, binary=True)
+		with open(path, "rb") as f:
+			streamed = list(disadvent.open_story(f))
+		self.assertEqual(streamed, list(disadvent.iter_game(self.game)))
+	
+	def test_extra_data(self):
+		with self.assertRaises(ValueError):
+			list(disadvent.iter_story(io.StringIO('{"objects": {}} {}')))
+
+class DiffTest(StoryTest):
+	def test_no_changes(self):
+		for path in [self.write("copy.json", self.game),
+				self.write("copy.advb", self.game, binary=True)]:
+			diff = disadvent.diff_stories(self.base, path)
+			self.assertEqual(diff["objects"],
+				{"added": {}, "removed": {}, "changed": {}})
+			self.assertEqual(diff["meta"]["changed"], {})
+	
+	def test_changes(self):
+		save = self.write("save.json", make_save(self.game))
+		diff = disadvent.diff_stories(self.base, save)
+		objs = diff["objects"]
+		self.assertEqual(list(objs["added"]), ["note"])
+		self.assertEqual(list(objs["removed"]), ["map"])
+		self.assertEqual(sorted(objs["changed"]),
+			["ball", "hero", "lantern"])
+		self.assertEqual(objs["changed"]["hero"]["changed"],
+			{"location": ["rbank", "tent"]})
+		self.assertEqual(objs["changed"]["lantern"]["added"],
+			{"visited": True})
+		self.assertEqual(list(objs["changed"]["ball"]["removed"]),
+			["drop"])
+		self.assertEqual(diff["meta"]["changed"]["title"][1], "Changed")
+		self.assertEqual(diff["other"]["added"], {"turns": 12})
+		text = io.StringIO()
+		disadvent.write_diff(diff, text)
+		self.assertTrue(text.getvalue().endswith(
+			"1 objects added, 1 removed, 3 changed.\n"))
+
+class DeltaTest(StoryTest):
+	def test_expands_to_save(self):
+		save = make_save(self.game)
+		path = self.write("save.advb", save, binary=True)
+		delta = json.loads(json.dumps(disadvent.make_delta(self.base, path)))
+		self.assertNotIn("tent", delta["objects"]["set"])
+		self.assertEqual(disadvent.expand_delta(self.base, delta), save)
+	
+	def test_keeps_number_types(self):
+		save = copy.deepcopy(self.game)
+		save["config"]["max_score"] = 25 # Was 25.0 in the story.
+		save["objects"]["lantern"]["score"] = 5
+		save["objects"]["lantern"]["light"] = 1
+		save["objects"]["hero"]["list"] = [1, True]
+		self.game["objects"]["hero"]["list"] = [1.0, 1]
+		self.base = self.write("base.json", self.game)
+		path = self.write("save.json", save)
+		delta = json.loads(json.dumps(disadvent.make_delta(self.base, path)))
+		expanded = disadvent.expand_delta(self.base, delta)
+		self.assertEqual(json.dumps(expanded), json.dumps(save))
+	
+	def test_base_checks(self):
+		path = self.write("save.json", make_save(self.game))
+		delta = disadvent.make_delta(self.base, path)
+		self.game["objects"]["tent"]["name"] = "Edited"
+		self.write("base.json", self.game)
+		with self.assertRaises(ValueError):
+			disadvent.expand_delta(self.base, delta)
+		with self.assertRaises(ValueError):
+			disadvent.expand_delta(self.base, {"objects": {}})
+
+if __name__ == "__main__":
+	unittest.main()
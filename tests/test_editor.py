@@ -0,0 +1,384 @@
+import os
+import sys
+import io
+import json
+import contextlib
+import tempfile
+import argparse
+import shlex
+import asyncio
+import subprocess
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import advprompt
+import advbin
+import disadvent
+
+top = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+def run(editor, *lines):
+	"""Run editor commands, returning whatever they printed."""
+	out = io.StringIO()
+	with contextlib.redirect_stdout(out):
+		for i in lines:
+			editor.onecmd(i)
+	return out.getvalue()
+
+class IndexTest(unittest.TestCase):
+	def test_find_matches_scan(self):
+		editor = advprompt.Editor()
+		editor.quiet = True
+		run(editor, "dig Hall hall", "dig Cellar cellar",
+			"open down d cellar", "create Lamp lamp", "tel lamp hall",
+			"clone lamp lamp2", "set lamp2 light true", "tel d hall",
+			"recycle cellar", "set lamp2 color red", "undo", "undo")
+		objs = editor.game["objects"]
+		for prop, value in [("location", "hall"), ("location", "limbo"),
+				("type", "room"), ("link", "cellar"), ("light", True),
+				("name", "Lamp"), ("color", "red")]:
+			expected = [i for i in objs if objs[i].get(prop) == value]
+			self.assertEqual(sorted(editor.find(prop, value)),
+				sorted(expected), (prop, value))
+	
+	def test_story_order(self):
+		editor = advprompt.Editor()
+		editor.quiet = True
+		editor.restore_game(os.path.join(top, "starry.json"))
+		run(editor, "tel rbank", "set rbank-ne location limbo",
+			"set rbank-ne location rbank", "tel boat limbo",
+			"tel boat rbank", "recycle tentflap", "undo")
+		text = run(editor, "look")
+		self.assertLess(text.index("(rbank-ne)"), text.index("(rbank-s)"))
+		objs = editor.game["objects"]
+		for prop, value in [("location", "rbank"), ("type", "exit"),
+				("location", "low-cave")]:
+			expected = [i for i in objs if objs[i].get(prop) == value]
+			self.assertEqual(editor.find(prop, value), expected)
+	
+	def test_fresh_after_edits(self):
+		editor = advprompt.Editor()
+		editor.quiet = True
+		run(editor, "dig Hall hall", "create Lamp lamp", "tel lamp hall",
+			"recycle lamp", "unrecycle lamp", "undo", "redo")
+		maintained = editor.index
+		editor.reindex()
+		self.assertEqual(maintained, editor.index)
+
+class CompletionTest(unittest.TestCase):
+	def complete(self, line):
+		text = line.split(" ")[-1]
+		begidx = len(line) - len(text)
+		return self.editor.completedefault(text, line, begidx, len(line))
+	
+	def setUp(self):
+		self.editor = advprompt.Editor()
+		self.editor.quiet = True
+		run(self.editor, "dig Hall hall", "dig Hallway hallway",
+			"create Hammer hammer", "open east e hall")
+	
+	def test_ids(self):
+		self.assertEqual(self.complete("look ha"),
+			["hall", "hallway", "hammer"])
+		self.assertEqual(self.complete("tel hammer ha"),
+			["hall", "hallway"])
+		self.assertEqual(self.complete("lock e +ham"), ["+hammer"])
+	
+	def test_properties_and_values(self):
+		self.assertIn("description", self.complete("set hall des"))
+		self.assertEqual(self.complete("set e link hallw"), ["hallway"])
+		self.assertEqual(self.complete("find type ro"), ["room"])
+	
+	def test_follows_changes(self):
+		run(self.editor, "recycle hammer")
+		self.assertEqual(self.complete("look ham"), [])
+		self.assertEqual(self.complete("unrecycle ham"), ["hammer"])
+
+class UndoTest(unittest.TestCase):
+	def setUp(self):
+		self.editor = advprompt.Editor()
+		self.editor.quiet = True
+	
+	def test_undo_redo_property(self):
+		run(self.editor, "dig Hall hall", "desc hall 'A big hall.'")
+		objs = self.editor.game["objects"]
+		run(self.editor, "undo")
+		self.assertEqual(objs["hall"]["description"], "")
+		run(self.editor, "redo")
+		self.assertEqual(objs["hall"]["description"], "A big hall.")
+	
+	def test_undo_keeps_indexes(self):
+		run(self.editor, "dig Hall hall", "create Lamp lamp")
+		run(self.editor, "tel lamp hall", "undo")
+		self.assertEqual(self.editor.find("location", "hall"), [])
+		run(self.editor, "redo")
+		self.assertEqual(self.editor.find("location", "hall"), ["lamp"])
+	
+	def test_undo_recycle(self):
+		run(self.editor, "dig Hall hall", "recycle hall")
+		self.assertNotIn("hall", self.editor.game["objects"])
+		run(self.editor, "undo")
+		self.assertIn("hall", self.editor.game["objects"])
+		self.assertNotIn("hall", self.editor.trash)
+	
+	def test_undo_room_author_is_in(self):
+		run(self.editor, "dig Hall hall", "tel hall", "undo")
+		self.assertNotIn("hall", self.editor.game["objects"])
+		self.assertEqual(self.editor.here, "limbo")
+		self.assertIn("Limbo", run(self.editor, "look"))
+	
+	def test_redo_after_new_command(self):
+		run(self.editor, "dig Hall hall", "undo", "dig Cellar cellar")
+		self.assertEqual(len(self.editor.redo_log), 0)
+
+class RecordTest(unittest.TestCase):
+	def test_acts_like_dict(self):
+		obj = {"type": "thing", "name": "ball", "dark": True,
+			"score": 5, "description": ""}
+		record = advprompt.Record(obj)
+		self.assertEqual(dict(record), obj)
+		self.assertEqual(list(record), list(obj))
+		record["light"] = False
+		del record["dark"]
+		record["name"] = "red ball"
+		obj["light"] = False
+		del obj["dark"]
+		obj["name"] = "red ball"
+		self.assertEqual(record.as_dict(), obj)
+		self.assertEqual(list(record), list(obj))
+	
+	def test_json_with_default(self):
+		obj = {"type": "room", "name": "Hall", "visited": False}
+		text = json.dumps({"hall": advprompt.Record(obj)},
+			default=advprompt.Record.as_dict)
+		self.assertEqual(json.loads(text), {"hall": obj})
+
+	def test_layouts_bounded(self):
+		limit = advprompt.layout_limit
+		advprompt.layout_limit = 10
+		try:
+			records = [advprompt.Record({"n" + str(i): i}) for i in range(50)]
+			self.assertLessEqual(len(advprompt.record_layouts), 10)
+			for i in range(50):
+				records[i]["extra"] = True
+				self.assertEqual(list(records[i]), ["n" + str(i), "extra"])
+		finally:
+			advprompt.layout_limit = limit
+		same = [advprompt.Record({"type": "room", "name": i}) for i in "ab"]
+		self.assertIs(same[0]._layout, same[1]._layout)
+	
+	def test_every_save_path(self):
+		tmp = tempfile.TemporaryDirectory()
+		self.addCleanup(tmp.cleanup)
+		editor = advprompt.SharedEditor()
+		editor.quiet = True
+		base = os.path.join(tmp.name, "base.json")
+		editor.save_game(base)
+		run(editor, "dig Hall hall", "set hall dark", "set hall colour red",
+			"set hero score 5", "set limbo visited", "set limbo !visited")
+		expected = json.loads(json.dumps(editor.game,
+			default=advprompt.Record.as_dict))
+		for name in ["save.json", "save.advb"]:
+			path = os.path.join(tmp.name, name)
+			editor.save_game(path)
+			with open(path, "rb") as f:
+				self.assertEqual(advbin.load_any(f.read()), expected)
+		delta = disadvent.make_delta(base, os.path.join(tmp.name, "save.json"))
+		delta = json.loads(json.dumps(delta))
+		self.assertEqual(disadvent.expand_delta(base, delta), expected)
+		for name in ["shared.json", "shared.advb"]:
+			path = os.path.join(tmp.name, name)
+			editor.modified = True
+			asyncio.run(advprompt.BuildServer(editor, path).save())
+			with open(path, "rb") as f:
+				self.assertEqual(advbin.load_any(f.read()), expected)
+
+class TimingTest(unittest.TestCase):
+	def test_commands_grouped(self):
+		editor = advprompt.Editor()
+		editor.quiet = True
+		run(editor, "timing on", "dig Hall hall", "open east e hall",
+			"l", "look", "east", "limbo", "frobnicate the thing", "ex hall")
+		self.assertEqual(sorted(editor.timings),
+			["default", "dig", "examine", "go", "look", "open"])
+		self.assertEqual(len(editor.timings["look"]), 2)
+		self.assertEqual(len(editor.timings["go"]), 2)
+
+class SearchTest(unittest.TestCase):
+	def setUp(self):
+		self.editor = advprompt.Editor()
+		self.editor.quiet = True
+		run(self.editor, "dig 'Old mill' mill",
+			"desc mill 'Mordecai grinds flour here, as old millers do.'",
+			"create 'Mordecai' miller",
+			"desc miller 'An old man.'",
+			"tel miller mill")
+	
+	def search(self, line):
+		objs = self.editor.game["objects"]
+		return [i[0] for i in self.editor.text_index().search(
+			objs, advprompt.shell_parse(line))]
+	
+	def assertFresh(self):
+		fresh = advprompt.TextIndex(self.editor.game["objects"])
+		self.assertEqual(self.editor.text.postings, fresh.postings)
+		self.assertEqual(self.editor.text.words.words, fresh.words.words)
+	
+	def test_words_phrases_prefixes(self):
+		self.assertEqual(self.search("mordecai"), ["miller", "mill"])
+		self.assertEqual(self.search('"old man"'), ["miller"])
+		self.assertEqual(self.search('"man old"'), [])
+		self.assertEqual(self.search("mill*"), ["mill"])
+		self.assertEqual(self.search("mordecai flour"), ["mill"])
+		self.assertEqual(self.search("nobody"), [])
+	
+	def test_output_says_where(self):
+		output = run(self.editor, "grep mordecai")
+		self.assertEqual(output.splitlines(), [
+			"Mordecai (id: miller) in name",
+			"Old mill (id: mill) in description"])
+	
+	def test_updates_on_edits(self):
+		self.search("mordecai")
+		run(self.editor, "name miller Ezekiel")
+		self.assertEqual(self.search("mordecai"), ["mill"])
+		self.assertEqual(self.search("ezekiel"), ["miller"])
+		run(self.editor, "recycle miller")
+		self.assertEqual(self.search("ezekiel"), [])
+		run(self.editor, "undo")
+		self.assertEqual(self.search("ezekiel"), ["miller"])
+		run(self.editor, "undo")
+		self.assertEqual(self.search("ezekiel"), [])
+		self.assertFresh()
+	
+	def test_numbers(self):
+		self.search("mordecai")
+		run(self.editor, "set miller name 42")
+		self.assertEqual(self.search("42"), ["miller"])
+		self.assertFresh()
+		run(self.editor, "set miller name Bob")
+		self.assertEqual(self.search("42"), [])
+		self.assertFresh()
+
+class ScriptTest(unittest.TestCase):
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		self.editor = advprompt.Editor()
+		self.editor.quiet = True
+	
+	def tearDown(self):
+		self.tmp.cleanup()
+	
+	def batch(self, script):
+		"""Run a script as --batch would, returning the exit status."""
+		path = os.path.join(self.tmp.name, "build.txt")
+		with open(path, "w") as f:
+			f.write(script)
+		self.output = os.path.join(self.tmp.name, "story.json")
+		if os.path.exists(self.output):
+			os.remove(self.output)
+		args = argparse.Namespace(
+			batch=path, output=self.output, story=None)
+		err = io.StringIO()
+		with contextlib.redirect_stderr(err), \
+				contextlib.redirect_stdout(io.StringIO()):
+			status = advprompt.run_batch(self.editor, args)
+		self.errors = err.getvalue()
+		return status
+	
+	def test_success(self):
+		self.assertEqual(self.batch("# A comment\n\ndig Hall hall\n"), 0)
+		with open(self.output) as f:
+			self.assertIn("hall", json.load(f)["objects"])
+	
+	def test_stops_at_first_error(self):
+		other = os.path.join(self.tmp.name, "other.json")
+		for line in ["recycle nosuch", 'look "unterminated',
+				"timing show", "frobnicate the thing", "save " + other]:
+			with self.subTest(line=line):
+				self.editor = advprompt.Editor()
+				self.editor.quiet = True
+				status = self.batch(
+					"dig Hall hall\n{0}\ndig Cellar cellar\n".format(line))
+				self.assertEqual(status, 1)
+				self.assertTrue(self.errors.startswith("Line 2: "))
+				self.assertNotIn("cellar", self.editor.game["objects"])
+				self.assertFalse(os.path.exists(self.output))
+				self.assertFalse(os.path.exists(other))
+	
+	def test_quiet_queries_print(self):
+		text = run(self.editor, "dig Hall hall", "examine hall")
+		self.assertEqual(text.splitlines(), ["Object hall:",
+			"type: room", "name: Hall", "description: "])
+	
+	def test_ascii_whitespace(self):
+		for line in ["a\u00a0b c", "a\x0bb\x1cc", 'x "y\u2003z" w',
+				"  spaced\tout\r\n"]:
+			self.assertEqual(advprompt.shell_parse(line), shlex.split(line))
+
+class StartupTest(unittest.TestCase):
+	def test_servers_not_imported(self):
+		code = "import sys, advprompt; print(' '.join(sorted(sys.modules)))"
+		found = subprocess.run([sys.executable, "-c", code], cwd=top,
+			stdout=subprocess.PIPE, universal_newlines=True, check=True)
+		for i in ["asyncio", "signal", "argparse", "advc", "http.server",
+				"concurrent.futures"]:
+			self.assertNotIn(i, found.stdout.split())
+
+class RpcTest(unittest.TestCase):
+	def setUp(self):
+		self.service = advprompt.EditorService(advprompt.Editor())
+	
+	def call(self, method, params=None, request_id=1):
+		request = {"jsonrpc": "2.0", "id": request_id, "method": method}
+		if params != None:
+			request["params"] = params
+		return json.loads(self.service.handle_line(json.dumps(request)))
+	
+	def test_commands_and_queries(self):
+		reply = self.call("dig", ["Wine cellar", "cellar"])
+		self.assertEqual(reply["id"], 1)
+		self.assertTrue(reply["result"]["ok"])
+		reply = self.call("objects.get", ["cellar"])
+		self.assertEqual(reply["result"]["properties"]["name"],
+			"Wine cellar")
+		reply = self.call("objects.find", {"property": "type",
+			"value": "room"})
+		self.assertEqual(reply["result"], ["cellar", "limbo"])
+		self.call("desc", ["cellar", "Dusty racks line the walls."])
+		reply = self.call("look", {"line": "cellar"})
+		self.assertIn("Dusty racks", reply["result"]["output"])
+		reply = self.call("help", ["dig"])
+		self.assertIn("room", reply["result"]["output"])
+	
+	def test_errors(self):
+		self.assertEqual(self.call("nonsense")["error"]["code"], -32601)
+		self.assertEqual(self.call("shell", ["1"])["error"]["code"],
+			-32601)
+		reply = self.call("objects.get", ["a", "b"])
+		self.assertEqual(reply["error"]["code"], -32602)
+		reply = self.call("objects.get", ["nowhere"])
+		self.assertEqual(reply["error"]["code"], 1)
+		self.assertFalse(self.call("teleport", ["nowhere"])["result"]["ok"])
+		reply = json.loads(self.service.handle_line("{nope"))
+		self.assertEqual(reply["error"]["code"], -32700)
+	
+	def test_batches_and_notifications(self):
+		batch = [
+			{"jsonrpc": "2.0", "method": "dig", "params": ["A", "a"]},
+			{"jsonrpc": "2.0", "id": 7, "method": "objects.list",
+				"params": {"type": "room"}},
+			"junk"
+		]
+		reply = json.loads(self.service.handle_line(json.dumps(batch)))
+		self.assertEqual(len(reply), 2)
+		self.assertEqual([i["id"] for i in reply[0]["result"]],
+			["a", "limbo"])
+		self.assertEqual(reply[1]["error"]["code"], -32600)
+		notification = {"jsonrpc": "2.0", "method": "look"}
+		self.assertEqual(
+			self.service.handle_line(json.dumps(notification)), None)
+
+if __name__ == "__main__":
+	unittest.main()
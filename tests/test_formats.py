@@ -0,0 +1,121 @@
+import os
+import sys
+import copy
+import json
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import advc
+import advbin
+import promptrun
+
+top = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+def load_sample(name):
+	with open(os.path.join(top, name)) as f:
+		return json.load(f)
+
+class MinifyTest(unittest.TestCase):
+	def test_unpacks_to_same_text(self):
+		game = load_sample("starry.json")
+		small = advc.minify_story(game)
+		self.assertIn("strings", small)
+		self.assertLess(len(json.dumps(small)), len(json.dumps(game)))
+		promptrun.unpack_strings(small)
+		names = sorted(i["name"] for i in small["objects"].values())
+		self.assertEqual(names,
+			sorted(i["name"] for i in game["objects"].values()))
+	
+	def test_numbers_in_text_fields(self):
+		game = load_sample("starry.json")
+		game["objects"]["ball"]["name"] = 42.0
+		game["objects"]["boat"]["name"] = 42.0
+		game["objects"]["chest"]["description"] = 7
+		small = advc.minify_story(game)
+		promptrun.unpack_strings(small)
+		names = [i["name"] for i in small["objects"].values()]
+		self.assertEqual(names.count("42"), 2)
+		descriptions = [i.get("description")
+			for i in small["objects"].values()]
+		self.assertIn("7", descriptions)
+	
+	def test_ids_keep_story_order(self):
+		game = {"objects": {}}
+		for i in range(2000):
+			game["objects"]["room{0}".format(i)] = {
+				"type": "room", "name": "Room", "description": ""}
+		game["objects"]["hero"] = {"type": "actor", "name": "you",
+			"location": "room0"}
+		small = advc.minify_story(game)
+		for i in small["objects"]:
+			self.assertFalse(i.isdigit(), i)
+		# The same objects, in the same order, under their new names.
+		self.assertEqual(list(small["objects"])[-1], "hero")
+		self.assertEqual(len(small["objects"]), len(game["objects"]))
+
+class BinaryTest(unittest.TestCase):
+	def round_trip(self, game):
+		data = advbin.dumps(game)
+		self.assertTrue(advbin.is_binary(data))
+		found = advbin.loads(data)
+		self.assertEqual(found, game)
+		self.assertEqual(json.dumps(found), json.dumps(game))
+		return found
+	
+	def test_samples(self):
+		for name in ["starry.json", "cloak.json"]:
+			game = load_sample(name)
+			self.round_trip(game)
+	
+	def test_smaller_for_big_stories(self):
+		game = {"objects": {}}
+		for i in range(1000):
+			game["objects"]["room{0}".format(i)] = {"type": "room",
+				"name": "Room {0}".format(i), "description": "A room.",
+				"dark": i % 5 == 0}
+		self.round_trip(game)
+		self.assertLess(len(advbin.dumps(game)),
+			len(json.dumps(game).encode("utf-8")) // 2)
+	
+	def test_odd_values(self):
+		self.round_trip({
+			"meta": {"title": "\u00c9t\u00e9 \U0001f600", "year": 2018},
+			"objects": {
+				"a": {"type": "room", "name": "A", "score": 1.5,
+					"dark": True, "link": None},
+				"b": {"type": "room", "name": "B", "score": 2,
+					"dark": False},
+				"c": {"type": "room", "name": "C", "score": True,
+					"dark": None},
+				"d": {"type": ["not", "a", "string"], "big": 2**70,
+					"nested": {"x": [1, 2.5, None]}},
+				"e": {},
+				"f": {"name": "", "type": None}
+			},
+			"config": {},
+			"turns": 3,
+			"other": [1, "two"]
+		})
+	
+	def test_key_order(self):
+		game = {"objects": {"z": {"name": "z", "type": "thing"},
+			"a": {"type": "thing", "name": "a"},
+			"m": {"name": "m", "type": "thing"}}}
+		found = self.round_trip(game)
+		self.assertEqual(list(found["objects"]), ["z", "a", "m"])
+		self.assertEqual(list(found["objects"]["a"]), ["type", "name"])
+	
+	def test_load_any(self):
+		game = load_sample("cloak.json")
+		self.assertEqual(advbin.load_any(json.dumps(game).encode("utf-8")),
+			game)
+		self.assertEqual(advbin.load_any(advbin.dumps(game)), game)
+	
+	def test_truncated(self):
+		data = advbin.dumps(load_sample("cloak.json"))
+		with self.assertRaises(Exception):
+			advbin.loads(data[:len(data) // 2])
+
+if __name__ == "__main__":
+	unittest.main()
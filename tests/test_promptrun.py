@@ -0,0 +1,154 @@
+import os
+import sys
+import json
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import advc
+import promptrun
+
+top = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+def load_starry():
+	with open(os.path.join(top, "starry.json")) as f:
+		return json.load(f)
+
+def load_wizard():
+	game = advc.new_game()
+	for name in ["wizard-away.ini", "advprompt-book.ini"]:
+		with open(os.path.join(top, "wizard-away", name)) as f:
+			advc.merge_source(advc.parse_source(f.read()), game)
+	return json.loads(json.dumps(game))
+
+# As found by advc.py --solve, which takes a while.
+starry_walkthrough = ["enter", "take electric lantern", "out",
+	"get on inflatable boat", "northeast", "enter", "up", "read mural map",
+	"down", "drop electric lantern", "down", "northwest",
+	"take Treasure chest", "southeast", "drop Treasure chest", "up",
+	"south", "east", "take Treasure chest", "west",
+	"get on inflatable boat", "southwest", "get off inflatable boat",
+	"south", "pack up"]
+
+def labels(game):
+	return [game.action_text(i) for i in game.actions()]
+
+def play(game, *steps):
+	"""Click on actions by their text, returning what the last one showed."""
+	text = None
+	for step in steps:
+		found = [i for i in game.actions() if game.action_text(i) == step]
+		if len(found) < 1:
+			raise AssertionError("{0!r} not in {1}".format(
+				step, labels(game)))
+		text = game.perform(found[0])
+	return text
+
+class PlayTest(unittest.TestCase):
+	def setUp(self):
+		self.game = promptrun.Game(load_starry())
+	
+	def test_opening(self):
+		text = self.game.text()
+		self.assertTrue(text.startswith("Score: 0/25  Moves: 0\n\nIt's so"))
+		self.assertIn("\n\nRight riverbank\n\n", text)
+		self.assertIn("You see: inflatable boat, your tent", text)
+		self.assertIn("Which way now? northeast, south", text)
+		self.assertIn("You are carrying: Nothing.", text)
+		self.assertEqual(labels(self.game), ["look inflatable boat",
+			"get on inflatable boat", "look your tent", "enter",
+			"northeast", "south"])
+	
+	def test_locked_exit(self):
+		text = play(self.game, "northeast")
+		self.assertIn("Swimming in a cold mountain river? No thanks.", text)
+		self.assertEqual(self.game.objects["hero"]["location"], "rbank")
+		self.assertEqual(self.game.game["meta"]["turns"], 0)
+	
+	def test_take_and_drop(self):
+		text = play(self.game, "enter", "take electric lantern")
+		self.assertTrue(text.startswith("Score: 5/25  Moves: 2"))
+		self.assertIn("\n\nTaken.\n\n", text)
+		self.assertIn("You are carrying: electric lantern", text)
+		self.assertEqual(self.game.objects["lantern"]["location"], "hero")
+		text = play(self.game, "out", "drop electric lantern")
+		self.assertEqual(self.game.objects["lantern"]["location"], "rbank")
+		self.assertIn("You are carrying: Nothing.", text)
+		play(self.game, "take electric lantern")
+		self.assertEqual(self.game.game["meta"]["score"], 5) # Only once.
+	
+	def test_vehicle(self):
+		text = play(self.game, "get on inflatable boat", "northeast")
+		self.assertIn("Left riverbank (on the inflatable boat)", text)
+		self.assertEqual(self.game.objects["boat"]["location"], "lbank")
+		self.assertEqual(self.game.objects["hero"]["location"], "boat")
+		self.assertEqual(self.game.room_here(), "lbank")
+		text = play(self.game, "east") # Not by boat.
+		self.assertIn("You can't exactly row a boat up a rocky trail.", text)
+		play(self.game, "get off inflatable boat", "east")
+		self.assertEqual(self.game.room_here(), "karst")
+	
+	def test_dark_room(self):
+		text = play(self.game, "get on inflatable boat", "northeast",
+			"get off inflatable boat", "enter")
+		self.assertIn("Daylight duly dwindles away from the cave mouth, as",
+			text)
+		self.assertIn("Which way now? south\n", text)
+		self.assertEqual(labels(self.game), ["south"])
+	
+	def test_walkthrough_reaches_ending(self):
+		text = play(self.game, *starry_walkthrough)
+		self.assertEqual(self.game.ending, "the-end")
+		self.assertEqual(self.game.game["meta"]["score"], 25)
+		self.assertEqual(self.game.actions(), [])
+		self.assertIn("*** And that's when things started", text)
+		self.assertIn("Surprise!", text)
+	
+	def test_snapshot_and_restore(self):
+		play(self.game, "enter", "take electric lantern", "out")
+		state = self.game.snapshot()
+		actions = self.game.actions()
+		objects = json.dumps(self.game.objects)
+		play(self.game, "drop electric lantern", "get on inflatable boat",
+			"northeast")
+		self.assertNotEqual(self.game.snapshot(), state)
+		self.game.restore(state)
+		self.assertEqual(self.game.snapshot(), state)
+		self.assertEqual(self.game.actions(), actions)
+		self.assertEqual(json.dumps(self.game.objects), objects)
+	
+	def test_save_and_resume(self):
+		play(self.game, "enter", "take electric lantern", "out", "south")
+		data = json.loads(json.dumps(self.game.save_data()))
+		resumed = promptrun.Game(data)
+		self.assertEqual(resumed.game["meta"]["turns"], 4)
+		self.assertEqual(resumed.game["meta"]["score"], 5)
+		self.assertEqual(labels(resumed), labels(self.game))
+		self.assertEqual(resumed.text().split("\n\n")[1:],
+			self.game.text().split("\n\n")[1:])
+
+class MagicTest(unittest.TestCase):
+	def setUp(self):
+		self.game = promptrun.Game(load_wizard())
+	
+	def test_looking_inside(self):
+		play(self.game, "look bookshelf")
+		self.assertEqual(self.game.described, "shelf")
+		self.assertIn("take pocket book", labels(self.game))
+		play(self.game, "look pocket book")
+		self.assertIn("learn Magic word: zblorb", labels(self.game))
+	
+	def test_spells(self):
+		play(self.game, "look bookshelf", "look pocket book",
+			"learn Magic word: zblorb")
+		self.assertEqual(self.game.game["meta"]["score"], 5)
+		self.assertEqual(
+			self.game.objects["zblorb-spell"]["location"], "hero")
+		self.assertNotIn("look ball lightning", labels(self.game))
+		play(self.game, "cast Magic word: zblorb")
+		self.assertEqual(self.game.objects["globe"]["location"], "study")
+		self.assertIn("look ball lightning", labels(self.game))
+		self.assertIn("cast Magic word: zblorb", labels(self.game))
+
+if __name__ == "__main__":
+	unittest.main()
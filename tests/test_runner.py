@@ -0,0 +1,198 @@
+import os
+import sys
+import json
+import shutil
+import subprocess
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import advc
+import promptrun
+
+top = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# Runs the script from promptrun.html on a bare-bones DOM, clicking random
+# buttons, and prints each page as text along with the final game state.
+harness = r"""
+var fs = require("fs");
+var input = JSON.parse(fs.readFileSync(0, "utf8"));
+
+function Element(name) {
+	this.tagName = name;
+	this.children = [];
+	this.attrs = {};
+	this.style = {};
+	this.listeners = {};
+	this.disabled = false;
+}
+Element.prototype.appendChild = function (child) {
+	this.children.push(child);
+	return child;
+};
+Object.defineProperty(Element.prototype, "innerHTML", {
+	set: function (html) { this.children = html === "" ? [] : [html]; }
+});
+Element.prototype.setAttribute = function (k, v) { this.attrs[k] = "" + v; };
+Element.prototype.getAttribute = function (k) { return this.attrs[k]; };
+Element.prototype.addEventListener = function (t, f) { this.listeners[t] = f; };
+Element.prototype.scrollIntoView = function () {};
+
+var made = [];
+var by_id = {};
+var document = {
+	createElement: function (name) {
+		var e = new Element(name);
+		made.push(e);
+		return e;
+	},
+	createTextNode: function (text) { return "" + text; },
+	getElementById: function (id) {
+		if (by_id[id] === undefined)
+			by_id[id] = new Element("div");
+		return by_id[id];
+	},
+	getElementsByTagName: function (name) {
+		return made.filter(function (e) { return e.tagName === name; });
+	}
+};
+var on_load = null;
+var window = {addEventListener: function (t, f) { on_load = f; }};
+
+function text(node) {
+	if (typeof node === "string")
+		return node;
+	var s = node.children.map(text).join("");
+	if (node.tagName === "button")
+		return "[" + s + "]";
+	else if (["p", "div", "li", "dt", "dd", "br"].indexOf(node.tagName) >= 0)
+		return s + "\n";
+	else
+		return s;
+}
+
+function buttons(node, found) {
+	if (typeof node === "string")
+		return found;
+	if (node.tagName === "button" && !node.disabled && node.listeners.click)
+		found.push(node);
+	for (var i = 0; i < node.children.length; i++)
+		buttons(node.children[i], found);
+	return found;
+}
+
+eval(input.script);
+
+var results = [];
+for (var n = 0; n < input.seeds; n++) {
+	var seed = n + 1;
+	game_data = JSON.parse(input.story);
+	on_load();
+	var verso = document.getElementById("verso-page");
+	var recto = document.getElementById("recto-page");
+	var pages = [];
+	for (var turn = 0; turn < input.turns; turn++) {
+		var choices = buttons(verso, []).concat(buttons(recto, []));
+		if (choices.length === 0)
+			break;
+		seed = (Math.imul(seed, 1103515245) + 12345) >>> 0;
+		var button = choices[(seed >>> 8) % choices.length];
+		made = [];
+		button.listeners.click.call(button);
+		pages.push(text(verso) + "\n--\n" + text(recto));
+	}
+	results.push({pages: pages, objects: game_data.objects,
+		index: game_data.index});
+}
+console.log(JSON.stringify(results));
+"""
+
+def load_sample(name):
+	with open(os.path.join(top, name)) as f:
+		return json.load(f)
+
+def load_wizard():
+	game = advc.new_game()
+	for name in ["wizard-away.ini", "advprompt-book.ini"]:
+		with open(os.path.join(top, "wizard-away", name)) as f:
+			advc.merge_source(advc.parse_source(f.read()), game)
+	advc.sanity_check(game)
+	return json.loads(json.dumps(game))
+
+def runner_script():
+	with open(os.path.join(top, "promptrun.html")) as f:
+		page = f.read()
+	return page.partition("<script>")[2].partition("</script>")[0]
+
+def with_index(game):
+	return dict(game, index=promptrun.make_index(game["objects"]))
+
+class IndexTest(unittest.TestCase):
+	def scan(self, objects):
+		"""What the runner finds by looking at every object in turn."""
+		index = {"contents": {}, "exits": {}, "actions": {}, "lights": []}
+		for i in objects:
+			obj = objects[i]
+			loc = obj.get("location")
+			if loc == None:
+				continue
+			elif obj.get("type") == "exit":
+				index["exits"].setdefault(loc, []).append(i)
+			elif obj.get("type") == "action":
+				index["actions"].setdefault(loc, []).append(i)
+			else:
+				index["contents"].setdefault(loc, []).append(i)
+		index["lights"] = [i for i in objects
+			if objects[i].get("light")
+			and objects[i].get("type") not in ("exit", "action")]
+		return index
+
+	def test_same_as_scan(self):
+		for game in [load_sample("starry.json"), load_sample("cloak.json"),
+				load_wizard()]:
+			self.assertEqual(promptrun.make_index(game["objects"]),
+				self.scan(game["objects"]))
+
+	def test_saved_index_kept_current(self):
+		game = promptrun.Game(with_index(load_sample("starry.json")))
+		for step in ["enter", "take electric lantern", "out",
+				"drop electric lantern", "get on inflatable boat",
+				"northeast"]:
+			game.apply([i for i in game.actions()
+				if game.action_text(i) == step][0])
+		saved = json.loads(json.dumps(game.save_data()))
+		self.assertEqual(saved["index"], self.scan(saved["objects"]))
+		self.assertEqual(saved["index"]["contents"]["lbank"],
+			["cave-m", "boat"]) # In story order, not the order they came.
+
+@unittest.skipIf(shutil.which("node") == None, "needs Node.js")
+class RunnerTest(unittest.TestCase):
+	def play(self, game, seeds=8, turns=150):
+		found = subprocess.run(["node", "-e", harness], input=json.dumps({
+			"script": runner_script(), "story": json.dumps(game),
+			"seeds": seeds, "turns": turns}), stdout=subprocess.PIPE,
+			universal_newlines=True, check=True)
+		return json.loads(found.stdout)
+
+	def check_story(self, game):
+		plain = self.play(game)
+		indexed = self.play(with_index(game))
+		for a, b in zip(plain, indexed):
+			self.assertGreater(len(a["pages"]), 1)
+			self.assertEqual(a["pages"], b["pages"])
+			self.assertEqual(a["objects"], b["objects"])
+			self.assertNotIn("index", a)
+			self.assertEqual(b["index"],
+				promptrun.make_index(b["objects"]))
+
+	def test_starry(self):
+		self.check_story(load_sample("starry.json"))
+
+	def test_cloak(self):
+		self.check_story(load_sample("cloak.json"))
+
+	def test_wizard(self):
+		self.check_story(load_wizard())
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,217 @@
+import os
+import sys
+import json
+import shutil
+import asyncio
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import advbin
+import advprompt
+
+class Client(object):
+	"""An author on the other end of a socket, as telnet would be."""
+	
+	async def connect(self, address, name):
+		self.reader, self.writer = await asyncio.open_connection(*address)
+		await self.reader.readuntil(b"Your name? ")
+		return await self.login(name)
+	
+	async def login(self, name):
+		self.writer.write(name.encode("utf-8") + b"\r\n")
+		self.writer.write(b"outputsuffix --done--\r\n")
+		return await self.read_reply()
+	
+	async def rejected(self, name):
+		self.writer.write(name.encode("utf-8") + b"\r\n")
+		data = await self.reader.readuntil(b"? ")
+		return data.decode("utf-8")
+	
+	async def hear(self, text):
+		"""Read lines sent unasked until one has the given text."""
+		while True:
+			line = (await self.reader.readline()).decode("utf-8")
+			if text in line:
+				return line
+	
+	async def read_reply(self):
+		data = await self.reader.readuntil(b"--done--\r\n")
+		return data[:-len(b"--done--\r\n")].decode("utf-8")
+	
+	async def send(self, line):
+		self.writer.write(line.encode("utf-8") + b"\r\n")
+		return await self.read_reply()
+	
+	def close(self):
+		self.writer.close()
+
+def new_world():
+	editor = advprompt.SharedEditor()
+	editor.quiet = True
+	editor.onecmd("dig Hall hall")
+	editor.onecmd("dig Cellar cellar")
+	editor.quiet = False
+	return editor
+
+def run_with_server(test, path=None):
+	"""Run test(server, address) against a build server on a free port."""
+	async def main():
+		server = advprompt.BuildServer(new_world(), path)
+		listener = await asyncio.start_server(server.session,
+			"127.0.0.1", 0)
+		try:
+			await test(server, listener.sockets[0].getsockname()[:2])
+		finally:
+			listener.close()
+			await listener.wait_closed()
+	asyncio.run(asyncio.wait_for(main(), 10))
+
+class SessionTest(unittest.TestCase):
+	def test_login(self):
+		async def test(server, address):
+			alice = Client()
+			text = await alice.connect(address, "alice")
+			self.assertIn("Limbo", text)
+			bob = Client()
+			bob.reader, bob.writer = await asyncio.open_connection(
+				*address)
+			await bob.reader.readuntil(b"Your name? ")
+			self.assertIn("Another?", await bob.rejected("alice"))
+			self.assertIn("One word", await bob.rejected("bob smith"))
+			await bob.login("bob")
+			self.assertEqual(sorted(server.authors), ["alice", "bob"])
+			text = await alice.send("WHO")
+			self.assertIn("alice: Limbo (limbo)", text)
+			self.assertIn("bob: Limbo (limbo)", text)
+			bob.close()
+			alice.close()
+		run_with_server(test)
+	
+	def test_others_hear_changes(self):
+		async def test(server, address):
+			alice = Client()
+			bob = Client()
+			await alice.connect(address, "alice")
+			await bob.connect(address, "bob")
+			await alice.send("desc hall 'A big hall.'")
+			heard = await bob.hear("[alice]")
+			self.assertIn("(changed: hall)", heard)
+			bob.close()
+			alice.close()
+		run_with_server(test)
+	
+	def test_disabled_commands(self):
+		tmp = tempfile.mkdtemp()
+		target = os.path.join(tmp, "written.txt")
+		async def test(server, address):
+			alice = Client()
+			await alice.connect(address, "alice")
+			for i in advprompt.shared_disabled:
+				text = await alice.send(i + " " + target)
+				self.assertIn("not available", text, i)
+			text = await alice.send("TIMING export " + target)
+			self.assertIn("not available", text)
+			alice.close()
+		try:
+			run_with_server(test)
+			self.assertFalse(os.path.exists(target))
+		finally:
+			shutil.rmtree(tmp)
+	
+	def test_recycle_moves_authors(self):
+		async def test(server, address):
+			alice = Client()
+			bob = Client()
+			await alice.connect(address, "alice")
+			await bob.connect(address, "bob")
+			await alice.send("tel cellar")
+			text = await bob.send("recycle cellar")
+			self.assertEqual(server.authors["alice"].here, "limbo")
+			self.assertIn("alice: Limbo (limbo)", await bob.send("who"))
+			await alice.hear("is gone")
+			self.assertIn("Limbo", await alice.send("look"))
+			bob.close()
+			alice.close()
+		run_with_server(test)
+
+class SaveTest(unittest.TestCase):
+	def setUp(self):
+		self.tmp = tempfile.mkdtemp()
+	
+	def tearDown(self):
+		shutil.rmtree(self.tmp)
+	
+	def test_changed_ids(self):
+		editor = new_world()
+		editor.quiet = True
+		editor.onecmd("open down d cellar")
+		self.assertEqual(advprompt.changed_ids(editor.changes), ["d"])
+		editor.onecmd("tel d hall")
+		self.assertEqual(advprompt.changed_ids(editor.changes), ["d"])
+		editor.onecmd("meta title 'New title'")
+		self.assertEqual(advprompt.changed_ids(editor.changes), ["meta"])
+		editor.onecmd("look")
+		self.assertEqual(advprompt.changed_ids(editor.changes), [])
+	
+	def test_snapshot_keeps_old_world(self):
+		editor = new_world()
+		editor.quiet = True
+		before = json.dumps(editor.game, default=advprompt.Record.as_dict)
+		editor.snapshot = advprompt.Snapshot(editor.game)
+		editor.onecmd("desc hall 'Changed.'")
+		editor.onecmd("recycle cellar")
+		editor.onecmd("dig Attic attic")
+		editor.onecmd("meta title 'Changed'")
+		path = os.path.join(self.tmp, "snap.json")
+		with open(path, "w") as f:
+			asyncio.run(editor.snapshot.write(f))
+		with open(path) as f:
+			self.assertEqual(f.read(), before)
+		self.assertEqual(editor.game["objects"]["hall"]["description"],
+			"Changed.")
+	
+	def test_commands_run_during_save(self):
+		editor = new_world()
+		editor.quiet = True
+		for i in range(3000):
+			editor.onecmd("create Thing t{0}".format(i))
+		path = os.path.join(self.tmp, "world.json")
+		server = advprompt.BuildServer(editor, path)
+		author = advprompt.Author("alice", None, "limbo")
+		server.authors["alice"] = author
+		before = json.loads(json.dumps(editor.game,
+			default=advprompt.Record.as_dict))
+		async def main():
+			task = asyncio.ensure_future(server.save())
+			await asyncio.sleep(0) # Let it take the snapshot.
+			count = 0
+			while not task.done():
+				server.command(author, "desc t2999 'Changed {0}.'".format(
+					count))
+				count += 1
+				await asyncio.sleep(0)
+			await task
+			return count
+		self.assertGreater(asyncio.run(main()), 1)
+		with open(path) as f:
+			self.assertEqual(json.load(f), before)
+		self.assertTrue(editor.modified)
+		self.assertEqual(os.listdir(self.tmp), ["world.json"])
+	
+	def test_binary_save(self):
+		editor = new_world()
+		path = os.path.join(self.tmp, "world.advb")
+		server = advprompt.BuildServer(editor, path)
+		editor.modified = True
+		asyncio.run(server.save())
+		self.assertFalse(editor.modified)
+		self.assertEqual(os.listdir(self.tmp), ["world.advb"])
+		with open(path, "rb") as f:
+			found = advbin.load(f)
+		self.assertEqual(json.dumps(found), json.dumps(editor.game,
+			default=advprompt.Record.as_dict))
+
+if __name__ == "__main__":
+	unittest.main()